@@ -63,6 +63,8 @@ LOCAL_APPS = [
     'trips.apps.TripsConfig',
     'site_info.apps.SiteInfoConfig',
     'pdfgen.apps.PdfgenConfig',
+    'taskqueue.apps.TaskqueueConfig',
+    'outbox.apps.OutboxConfig',
 ]
 
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#installed-apps
@@ -91,6 +93,64 @@ DEBUG = env.bool('DJANGO_DEBUG', False)
 SECRET_KEY = env('DJANGO_SECRET_KEY')
 GOOGLE_MAPS_API = env('GOOGLE_MAPS_API')
 
+# OUTBOUND HTTP CONFIGURATION
+# ------------------------------------------------------------------------------
+# Used by trips.httpclient for all calls to external APIs
+GOOGLE_TIMEZONE_API_URL = 'https://maps.googleapis.com/maps/api/timezone/json'
+# Seconds to wait for a connection and for each read from the socket
+HTTP_CONNECT_TIMEOUT = env.float('HTTP_CONNECT_TIMEOUT', default=3.05)
+HTTP_READ_TIMEOUT = env.float('HTTP_READ_TIMEOUT', default=5)
+# Connections kept alive per host
+HTTP_POOL_SIZE = 10
+# Calls to a host fail fast for HTTP_CIRCUIT_RESET_SECONDS after this many
+# consecutive failures
+HTTP_CIRCUIT_FAILURES = 5
+HTTP_CIRCUIT_RESET_SECONDS = 30
+
+# TIMEZONE INDEX CONFIGURATION
+# ------------------------------------------------------------------------------
+# Offline timezone boundaries used by TripLocation.get_timezone(). Build the
+# file with: python manage.py build_timezone_index <geojson>
+# The Google Maps Time Zone API is used if the file does not exist.
+TIMEZONE_INDEX_PATH = env('TIMEZONE_INDEX_PATH',
+    default=str(APPS_DIR.path('trips/data/timezones.idx')))
+
+# CELESTIAL CACHE CONFIGURATION
+# ------------------------------------------------------------------------------
+# Sun times are cached per date and coordinates rounded to this many decimal
+# places (3 is about 110 m), so nearby locations share one entry.
+CELESTIAL_CACHE_PRECISION = env.int('CELESTIAL_CACHE_PRECISION', default=3)
+# Seconds before a cached entry is recomputed, picking up timezone changes
+CELESTIAL_CACHE_TTL = env.int('CELESTIAL_CACHE_TTL',
+    default=60 * 60 * 24 * 90)
+# Entries kept in the in-process LRU cache in front of the database table
+CELESTIAL_CACHE_SIZE = env.int('CELESTIAL_CACHE_SIZE', default=10000)
+# On a cache miss the timezone and sun times are looked up concurrently on a
+# pool of this many threads, waiting at most CELESTIAL_LOOKUP_TIMEOUT seconds
+CELESTIAL_LOOKUP_THREADS = 4
+CELESTIAL_LOOKUP_TIMEOUT = 10
+
+# TRIP FRAGMENT CACHE CONFIGURATION
+# ------------------------------------------------------------------------------
+# Rendered partials of the trip pages are cached until their trip changes,
+# see trips.fragments. Name of the cache in CACHES holding them.
+TRIP_FRAGMENT_CACHE = env('TRIP_FRAGMENT_CACHE', default='default')
+# Seconds a fragment is kept. Fragments of changed trips are never read
+# again, this only frees the space they use.
+TRIP_FRAGMENT_TIMEOUT = env.int('TRIP_FRAGMENT_TIMEOUT',
+    default=60 * 60 * 24 * 7)
+
+# TASK QUEUE CONFIGURATION
+# ------------------------------------------------------------------------------
+# Jobs are stored in the database and run by: python manage.py run_taskqueue
+# Set TASKQUEUE_ALWAYS_EAGER to run jobs immediately instead of queueing them.
+TASKQUEUE_ALWAYS_EAGER = env.bool('TASKQUEUE_ALWAYS_EAGER', default=False)
+# Seconds before a job claimed by a worker that died is run again
+TASKQUEUE_LEASE_SECONDS = 300
+# Failed jobs are retried after 10s, 20s, 40s, ... up to one hour
+TASKQUEUE_BACKOFF_SECONDS = 10
+TASKQUEUE_MAX_BACKOFF_SECONDS = 3600
+
 # FIXTURE CONFIGURATION
 # ------------------------------------------------------------------------------
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#std:setting-FIXTURE_DIRS
@@ -100,7 +160,17 @@ FIXTURE_DIRS = (
 
 # EMAIL CONFIGURATION
 # ------------------------------------------------------------------------------
-EMAIL_BACKEND = env('DJANGO_EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
+# Emails are saved to the outbox during the request and sent through
+# OUTBOX_EMAIL_BACKEND by: python manage.py send_outbox
+EMAIL_BACKEND = env('DJANGO_EMAIL_BACKEND', default='outbox.backends.OutboxBackend')
+OUTBOX_EMAIL_BACKEND = env('DJANGO_OUTBOX_EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
+# Emails claimed by a worker at a time
+OUTBOX_BATCH_SIZE = 50
+# Emails sent per second by each worker, 0 for no limit
+OUTBOX_RATE_LIMIT = env.float('OUTBOX_RATE_LIMIT', default=10)
+# Seconds before an email claimed by a worker that died is sent again.
+# Failed emails are retried like task queue jobs.
+OUTBOX_LEASE_SECONDS = 300
 
 # MANAGER CONFIGURATION
 # ------------------------------------------------------------------------------
@@ -172,6 +242,7 @@ TEMPLATES = [
                 'django.template.context_processors.static',
                 'django.template.context_processors.tz',
                 'django.contrib.messages.context_processors.messages',
+                'trips.context_processors.notification_count',
             ],
         },
     },
@@ -208,6 +279,11 @@ MEDIA_ROOT = str(APPS_DIR('media'))
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#media-url
 MEDIA_URL = '/media/'
 
+# Rendered trip plan PDFs, see pdfgen/rendering.py
+TRIP_PLAN_DIR = env('TRIP_PLAN_DIR', default=str(APPS_DIR('media/trip_plans')))
+# Seconds before a trip plan that failed to render is queued again
+TRIP_PLAN_RETRY_AFTER = env.int('TRIP_PLAN_RETRY_AFTER', default=300)
+
 # URL Configuration
 # ------------------------------------------------------------------------------
 ROOT_URLCONF = 'config.urls'
@@ -32,13 +32,17 @@ EMAIL_BACKEND = env('DJANGO_EMAIL_BACKEND',
 
 # CACHING
 # ------------------------------------------------------------------------------
+# Set DJANGO_CACHE_URL to try the production cache, e.g.
+# filecache:///var/tmp/getyrbeta_cache
 CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': ''
-    }
+    'default': env.cache('DJANGO_CACHE_URL', default='locmemcache://'),
 }
 
+# TASK QUEUE
+# ------------------------------------------------------------------------------
+# Run background jobs inline so a worker process isn't needed for development
+TASKQUEUE_ALWAYS_EAGER = env.bool('TASKQUEUE_ALWAYS_EAGER', default=True)
+
 # django-debug-toolbar
 # ------------------------------------------------------------------------------
 MIDDLEWARE += ['debug_toolbar.middleware.DebugToolbarMiddleware', ]
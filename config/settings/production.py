@@ -3,6 +3,8 @@ Production Configurations
 
 - Use WhiteNoise for serving static files
 - Use mailgun to send emails
+- Use a cache shared by all processes, and cached sessions
+- Use a pool of database connections per process
 
 
 """
@@ -72,7 +74,28 @@ ANYMAIL = {
     'MAILGUN_API_KEY': env('DJANGO_MAILGUN_API_KEY'),
     'MAILGUN_SENDER_DOMAIN': env('MAILGUN_SENDER_DOMAIN')
 }
-EMAIL_BACKEND = 'anymail.backends.mailgun.MailgunBackend'
+# Emails are queued in the outbox and sent through Mailgun by send_outbox
+EMAIL_BACKEND = 'outbox.backends.OutboxBackend'
+OUTBOX_EMAIL_BACKEND = 'anymail.backends.mailgun.MailgunBackend'
+
+# CACHING
+# ------------------------------------------------------------------------------
+# One cache shared by every gunicorn and task queue worker on the machine,
+# stored on local disk so no cache server is needed. When the processes run
+# on more than one machine, point DJANGO_CACHE_URL at a shared cache, e.g.
+# rediscache://host:6379/1 (requires django-redis) or memcache://host:11211
+# (requires python-memcached). See docs/deploy.rst.
+CACHES = {
+    'default': env.cache('DJANGO_CACHE_URL',
+        default='filecache:///var/tmp/getyrbeta_cache?max_entries=20000'),
+}
+
+# SESSIONS
+# ------------------------------------------------------------------------------
+# Sessions are read from the cache and written through to the database, so
+# authenticated requests don't query the sessions table
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'default'
 
 # TEMPLATE CONFIGURATION
 # ------------------------------------------------------------------------------
@@ -90,6 +113,26 @@ TEMPLATES[0]['OPTIONS']['loaders'] = [
 # Raises ImproperlyConfigured exception if DATABASE_URL not in os.environ
 DATABASES['default'] = env.db('DATABASE_URL')
 
+# Each process keeps a pool of open connections. A request takes one when it
+# first queries the database and returns it when it finishes (CONN_MAX_AGE 0).
+# Processes x DJANGO_DB_POOL_SIZE must stay below the database's connection
+# limit. Set DJANGO_DB_POOL=False to keep one connection per worker thread
+# instead, which only suits sync workers. See the dbpool package.
+if env.bool('DJANGO_DB_POOL', default=True):
+    DATABASES['default']['ENGINE'] = 'dbpool.backends.postgresql'
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['POOL'] = {
+        'MAX_SIZE': env.int('DJANGO_DB_POOL_SIZE', default=10),
+        # Seconds a request waits for a connection before failing
+        'TIMEOUT': env.float('DJANGO_DB_POOL_TIMEOUT', default=10.0),
+        # Connections idle for longer are tested before they are reused
+        'HEALTH_CHECK_INTERVAL': env.float(
+            'DJANGO_DB_POOL_HEALTH_CHECK_INTERVAL', default=30.0),
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = env.int('DJANGO_CONN_MAX_AGE',
+        default=60)
+
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#site-id
 # Different for local and production because sites were created/deleted and
 # the id auto-incremented.
@@ -21,6 +21,8 @@ EMAIL_PORT = 1025
 # In-memory email backend stores messages in django.core.mail.outbox
 # for unit testing purposes
 EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+# Emails sent from the outbox by send_outbox end up there too
+OUTBOX_EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
 
 # CACHING
 # ------------------------------------------------------------------------------
@@ -29,8 +31,14 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': ''
+    },
+    # Fragment versions are not rolled back with the test database, so
+    # fragments are only cached by the tests that enable it
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
     }
 }
+TRIP_FRAGMENT_CACHE = 'fragments'
 
 # TESTING
 # ------------------------------------------------------------------------------
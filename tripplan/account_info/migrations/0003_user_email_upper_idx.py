@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-17 23:20
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account_info', '0002_auto_20171001_1543'),
+    ]
+
+    operations = [
+        # Functional index for email__iexact, which compares UPPER(email).
+        # The unique index on email can't be used for those lookups.
+        migrations.RunSQL(
+            ['CREATE INDEX account_info_user_email_upper_idx '
+             'ON account_info_user (UPPER(email))'],
+            ['DROP INDEX account_info_user_email_upper_idx'],
+        ),
+    ]
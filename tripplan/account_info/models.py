@@ -1,8 +1,9 @@
 from django.conf import settings
-from django.db import models
+from django.db import IntegrityError, models, transaction
 
 from authtools.models import AbstractEmailUser
 
+from trips import fragments, notifications
 from trips.models import TripGuest, TripMember
 
 class User(AbstractEmailUser):
@@ -25,21 +26,49 @@ class User(AbstractEmailUser):
         '''
         # User instance will not have pk if it is being created
         if not self.pk:
-            # save instance so it can be referenced by TripMember
-            response = super(User, self).save(*args, **kwargs)
-            trip_guests = TripGuest.objects.filter(email__iexact=self.email)
-            for trip_guest in trip_guests:
-                TripMember.objects.create(
-                    member=self,
-                    trip=trip_guest.trip,
-                    organizer=True,
-                    accept_reqd=True
-                )
-                trip_guest.delete()
+            with transaction.atomic():
+                # save instance so it can be referenced by TripMember
+                response = super(User, self).save(*args, **kwargs)
+                self.convert_trip_guests()
             return response
         else:
             super(User, self).save(*args, **kwargs)
 
+    def convert_trip_guests(self):
+        '''
+        Replaces the TripGuest invitations for the user's email with
+        TripMember invitations, with one query per step however many trips
+        the user was invited to. Trips the user already is a member of are
+        skipped, so converting again adds no duplicates.
+        '''
+        # Locked so an invitation can't be converted twice concurrently
+        trip_guests = list(TripGuest.objects.select_for_update().filter(
+            email__iexact=self.email).values_list('pk', 'trip_id'))
+        if not trip_guests:
+            return
+        trip_ids = set(trip_id for pk, trip_id in trip_guests)
+        trip_ids -= set(TripMember.objects.filter(member=self,
+            trip_id__in=trip_ids).values_list('trip_id', flat=True))
+        tripmembers = [
+            TripMember(member=self, trip_id=trip_id, organizer=True,
+                accept_reqd=True)
+            for trip_id in sorted(trip_ids)
+        ]
+        try:
+            with transaction.atomic():
+                TripMember.objects.bulk_create(tripmembers)
+        except IntegrityError:
+            # The user was added to one of the trips meanwhile
+            for tripmember in tripmembers:
+                TripMember.objects.get_or_create(member=self,
+                    trip_id=tripmember.trip_id, defaults={
+                        'organizer': True, 'accept_reqd': True})
+        TripGuest.objects.filter(
+            pk__in=[pk for pk, trip_id in trip_guests]).delete()
+        # bulk_create() sends no post_save signals
+        fragments.invalidate(trip_id for pk, trip_id in trip_guests)
+        notifications.update([self.pk])
+
     def get_full_name(self):
         if self.full_name:
             return self.full_name
@@ -1,8 +1,12 @@
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.core.exceptions import ValidationError
+from django.db import connection
+from django.utils import timezone
 
 from account_info.models import User, Vehicle, EmergencyContact
+from trips.models import Trip, TripGuest, TripMember
 
 
 class UserModelTests(TestCase):
@@ -83,6 +87,46 @@ class UserModelTests(TestCase):
     NOTE: Add tests to verify that max length of User fields are correct
     '''
 
+class UserGuestConversionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trips = [Trip.objects.create(title='trip %d' % i,
+            start_date=timezone.now().date()) for i in range(10)]
+
+    def invite(self, email, trips):
+        for trip in trips:
+            TripGuest.objects.create(trip=trip, email=email)
+
+    def test_guest_invitations_become_member_invitations(self):
+        self.invite('Guest@Email.com', self.trips[:3])
+        user = User.objects.create_user(email='guest@email.com',
+            password='ValidPassword')
+        tripmembers = TripMember.objects.filter(member=user)
+        self.assertEqual(set(tripmember.trip for tripmember in tripmembers),
+            set(self.trips[:3]))
+        self.assertTrue(all(tripmember.accept_reqd
+            for tripmember in tripmembers))
+        self.assertFalse(TripGuest.objects.exists())
+
+    def test_queries_do_not_grow_with_number_of_invitations(self):
+        self.invite('one@email.com', self.trips[:1])
+        self.invite('ten@email.com', self.trips)
+        with CaptureQueriesContext(connection) as one:
+            User.objects.create_user(email='one@email.com')
+        with CaptureQueriesContext(connection) as ten:
+            User.objects.create_user(email='ten@email.com')
+        self.assertEqual(len(ten), len(one))
+        self.assertEqual(TripMember.objects.count(), 11)
+
+    def test_converting_again_adds_no_duplicates(self):
+        self.invite('guest@email.com', self.trips[:2])
+        user = User.objects.create_user(email='guest@email.com')
+        # e.g. invited again as a guest by a concurrent request
+        self.invite('guest@email.com', self.trips[:1])
+        user.convert_trip_guests()
+        self.assertEqual(TripMember.objects.filter(member=user).count(), 2)
+        self.assertFalse(TripGuest.objects.exists())
+
 class VehicleModelTests(TestCase):
     @classmethod
     def setUpTestData(cls):
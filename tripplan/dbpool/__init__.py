@@ -0,0 +1,19 @@
+"""
+Database backends that keep a bounded pool of open connections per process.
+
+Django opens a new connection for each request when CONN_MAX_AGE is 0, and
+with CONN_MAX_AGE > 0 it keeps one connection per thread. Under gevent every
+request runs in its own greenlet, so persistent connections are never reused
+and pile up until the database refuses new ones. These backends check a
+connection out of a pool when a request first queries the database and
+return it when Django closes the connection at the end of the request.
+
+Usage:
+    DATABASES['default']['ENGINE'] = 'dbpool.backends.postgresql'
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['POOL'] = {
+        'MAX_SIZE': 10,
+        'TIMEOUT': 10,
+        'HEALTH_CHECK_INTERVAL': 30,
+    }
+"""
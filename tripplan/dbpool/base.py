@@ -0,0 +1,61 @@
+import threading
+
+from .pool import ConnectionPool
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, name, options):
+    """
+    Returns the pool of the database alias, creating it on first use
+    """
+    with _pools_lock:
+        pool = _pools.get((alias, name))
+        if pool is None:
+            pool = _pools[(alias, name)] = ConnectionPool(
+                max_size=options.get('MAX_SIZE', 10),
+                timeout=options.get('TIMEOUT', 10.0),
+                health_check_interval=options.get(
+                    'HEALTH_CHECK_INTERVAL', 30.0),
+            )
+        return pool
+
+
+def close_pools():
+    """
+    Closes the idle connections of all pools and forgets the pools
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_idle()
+
+
+class PooledDatabaseWrapperMixin(object):
+    """
+    Takes connections from the pool of the database alias instead of
+    opening them, and returns them instead of closing them. Mixed into the
+    DatabaseWrapper of a Django backend.
+    """
+    def get_pool(self):
+        # The test runner changes NAME to the test database
+        return get_pool(self.alias, self.settings_dict['NAME'],
+            self.settings_dict.get('POOL', {}))
+
+    def get_new_connection(self, conn_params):
+        parent = super(PooledDatabaseWrapperMixin, self)
+        return self.get_pool().checkout(
+            lambda: parent.get_new_connection(conn_params))
+
+    def _close(self):
+        pool = self.get_pool()
+        # Django keeps using a connection closed inside an atomic block
+        # until the block exits, so it can't be handed to another request
+        if self.in_atomic_block or (
+                self.errors_occurred and not self.is_usable()):
+            pool.discard(self.connection)
+        else:
+            pool.checkin(self.connection)
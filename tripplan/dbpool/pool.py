@@ -0,0 +1,115 @@
+import collections
+import threading
+import time
+
+from django.db.utils import OperationalError
+
+
+class PoolTimeout(OperationalError):
+    pass
+
+
+class ConnectionPool(object):
+    """
+    A bounded pool of DB-API connections shared by the threads of a process.
+
+    At most max_size connections are open at the same time. checkout() waits
+    up to timeout seconds for one to be returned when all of them are in
+    use. A connection that was idle for longer than health_check_interval
+    seconds is tested with a query before it is handed out again, and
+    replaced when the query fails.
+
+    The locks are the ones of the threading module, which gevent patches,
+    so waiting for a connection only blocks the waiting greenlet.
+    """
+    def __init__(self, max_size=10, timeout=10.0, health_check_interval=30.0):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.lock = threading.Lock()
+        # (connection, time it was returned), most recently returned last
+        self.idle = collections.deque()
+        self.stats = collections.Counter()
+
+    def checkout(self, connect):
+        """
+        Returns an idle connection, or a new one made by connect()
+        """
+        if not self.slots.acquire(timeout=self.timeout):
+            self.stats['timeouts'] += 1
+            raise PoolTimeout('No database connection was returned to the '
+                'pool within %s seconds (%d in use)' % (
+                    self.timeout, self.max_size))
+        try:
+            return self._get_connection(connect)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def _get_connection(self, connect):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                connection, returned_at = self.idle.pop()
+            if self.is_healthy(connection, returned_at):
+                self.stats['reused'] += 1
+                return connection
+            self._close(connection)
+        self.stats['created'] += 1
+        return connect()
+
+    def is_healthy(self, connection, returned_at):
+        # psycopg2 notices some disconnections on its own
+        if getattr(connection, 'closed', False):
+            return False
+        if time.monotonic() - returned_at < self.health_check_interval:
+            return True
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute('SELECT 1')
+            finally:
+                cursor.close()
+        except Exception:
+            return False
+        return True
+
+    def checkin(self, connection):
+        """
+        Returns a connection taken with checkout() to the pool
+        """
+        try:
+            # Ends a transaction that was left open
+            connection.rollback()
+        except Exception:
+            self._close(connection)
+        else:
+            with self.lock:
+                self.idle.append((connection, time.monotonic()))
+        self.slots.release()
+
+    def discard(self, connection):
+        """
+        Closes a connection taken with checkout() instead of returning it
+        """
+        self._close(connection)
+        self.slots.release()
+
+    def _close(self, connection):
+        self.stats['discarded'] += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close_idle(self):
+        """
+        Closes the connections that are not in use
+        """
+        with self.lock:
+            idle = list(self.idle)
+            self.idle.clear()
+        for connection, returned_at in idle:
+            self._close(connection)
@@ -0,0 +1,125 @@
+import os
+import sqlite3
+import tempfile
+import threading
+
+from django.db import connections, transaction
+from django.test import SimpleTestCase
+
+from .backends.sqlite3.base import DatabaseWrapper
+from .base import close_pools
+from .pool import ConnectionPool, PoolTimeout
+
+
+def connect():
+    return sqlite3.connect(':memory:', check_same_thread=False,
+        isolation_level=None)
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def test_returned_connection_is_reused(self):
+        pool = ConnectionPool(max_size=2)
+        connection = pool.checkout(connect)
+        pool.checkin(connection)
+        self.assertIs(pool.checkout(connect), connection)
+        self.assertEqual((pool.stats['created'], pool.stats['reused']),
+            (1, 1))
+
+    def test_checkout_waits_for_a_free_connection(self):
+        pool = ConnectionPool(max_size=1, timeout=0.01)
+        pool.checkout(connect)
+        with self.assertRaises(PoolTimeout):
+            pool.checkout(connect)
+        self.assertEqual(pool.stats['timeouts'], 1)
+
+    def test_discarded_connection_frees_its_slot(self):
+        pool = ConnectionPool(max_size=1, timeout=0.01)
+        pool.discard(pool.checkout(connect))
+        pool.checkout(connect)
+        self.assertEqual(pool.stats['created'], 2)
+
+    def test_broken_idle_connection_is_replaced(self):
+        pool = ConnectionPool(max_size=1, health_check_interval=0)
+        connection = pool.checkout(connect)
+        pool.checkin(connection)
+        connection.close()
+        self.assertIsNot(pool.checkout(connect), connection)
+        self.assertEqual(pool.stats['discarded'], 1)
+
+    def test_checkin_rolls_back_open_transaction(self):
+        pool = ConnectionPool(max_size=1)
+        connection = pool.checkout(connect)
+        connection.execute('CREATE TABLE t (id INTEGER)')
+        connection.execute('BEGIN')
+        connection.execute('INSERT INTO t VALUES (1)')
+        pool.checkin(connection)
+        self.assertFalse(connection.in_transaction)
+        self.assertEqual(
+            connection.execute('SELECT COUNT(*) FROM t').fetchone(), (0,))
+
+    def test_open_connections_are_bounded(self):
+        pool = ConnectionPool(max_size=3)
+        in_use = []
+        lock = threading.Lock()
+        peak = [0]
+
+        def request():
+            for _ in range(20):
+                connection = pool.checkout(connect)
+                with lock:
+                    in_use.append(connection)
+                    peak[0] = max(peak[0], len(in_use))
+                with lock:
+                    in_use.remove(connection)
+                pool.checkin(connection)
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(peak[0], 3)
+        self.assertLessEqual(pool.stats['created'], 3)
+
+
+class PooledDatabaseWrapperTests(SimpleTestCase):
+    def setUp(self):
+        handle, self.name = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.wrapper = DatabaseWrapper({
+            'ENGINE': 'dbpool.backends.sqlite3',
+            'NAME': self.name,
+            'ATOMIC_REQUESTS': False,
+            'AUTOCOMMIT': True,
+            'CONN_MAX_AGE': 0,
+            'OPTIONS': {},
+            'TIME_ZONE': None,
+            'USER': '',
+            'PASSWORD': '',
+            'HOST': '',
+            'PORT': '',
+            'POOL': {'MAX_SIZE': 1, 'TIMEOUT': 0.01},
+        }, alias='pooltest')
+        connections['pooltest'] = self.wrapper
+
+    def tearDown(self):
+        self.wrapper.close()
+        del connections['pooltest']
+        close_pools()
+        os.remove(self.name)
+
+    def get_connection(self):
+        self.wrapper.ensure_connection()
+        return self.wrapper.connection
+
+    def test_close_returns_connection_to_pool(self):
+        connection = self.get_connection()
+        self.wrapper.close()
+        self.assertIs(self.get_connection(), connection)
+
+    def test_close_inside_atomic_block_discards_connection(self):
+        with transaction.atomic(using='pooltest'):
+            connection = self.get_connection()
+            self.wrapper.close()
+        self.assertIsNot(self.get_connection(), connection)
+        self.assertEqual(self.wrapper.get_pool().stats['discarded'], 1)
@@ -0,0 +1,12 @@
+from django.contrib import admin
+
+from .models import OutgoingEmail
+
+
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipients', 'status', 'attempts', 'created',
+        'sent')
+    list_filter = ('status',)
+
+
+admin.site.register(OutgoingEmail, OutgoingEmailAdmin)
@@ -0,0 +1,18 @@
+from django.core.mail.backends.base import BaseEmailBackend
+
+from .models import OutgoingEmail
+
+
+class OutboxBackend(BaseEmailBackend):
+    """
+    Saves emails to the outbox instead of sending them. They are sent by
+    the send_outbox command through settings.OUTBOX_EMAIL_BACKEND.
+
+    The emails are saved in the current transaction, so they are not sent
+    if it is rolled back.
+    """
+    def send_messages(self, email_messages):
+        emails = [OutgoingEmail.objects.from_message(message)
+            for message in email_messages if message.recipients()]
+        OutgoingEmail.objects.bulk_create(emails)
+        return len(emails)
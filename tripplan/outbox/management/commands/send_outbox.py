@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from outbox.worker import get_stats, send_pending
+
+
+class Command(BaseCommand):
+    help = ('Sends the emails in the outbox. Start one or more of these as '
+        'worker processes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+            help='Exit once the outbox has no sendable emails.')
+        parser.add_argument('--sleep', type=float, default=1.0,
+            help='Seconds to wait when the outbox is empty.')
+        parser.add_argument('--batch-size', type=int,
+            help='Emails claimed at a time, default OUTBOX_BATCH_SIZE.')
+        parser.add_argument('--rate-limit', type=float,
+            help='Emails sent per second, default OUTBOX_RATE_LIMIT.')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            count = send_pending(batch_size=options['batch_size'],
+                rate_limit=options['rate_limit'])
+            if count:
+                self.report(count)
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
+
+    def report(self, count):
+        values = get_stats()
+        self.stdout.write(
+            'Tried %d email(s): %d sent, %d retried, %d failed in total, '
+            '%d queued. Send latency p50 %s p99 %s, queue latency p50 %s '
+            'p99 %s' % (
+                count, values['sent'], values['retried'], values['failed'],
+                values['queue_depth'],
+                self.format_seconds(values['send_latency_p50']),
+                self.format_seconds(values['send_latency_p99']),
+                self.format_seconds(values['queue_latency_p50']),
+                self.format_seconds(values['queue_latency_p99']),
+            ))
+
+    def format_seconds(self, seconds):
+        if seconds is None:
+            return '-'
+        return '%.0fms' % (seconds * 1000)
@@ -0,0 +1,114 @@
+import datetime
+import json
+
+from django.conf import settings
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.db import models, transaction
+from django.utils import timezone
+
+
+# EmailMessage attributes saved with each email
+MESSAGE_FIELDS = ('subject', 'body', 'from_email', 'to', 'cc', 'bcc',
+    'reply_to', 'extra_headers')
+
+
+class OutgoingEmailManager(models.Manager):
+    def from_message(self, message):
+        """
+        Returns an unsaved OutgoingEmail for an EmailMessage. Attachments
+        are not supported.
+        """
+        if message.attachments:
+            raise ValueError('Emails with attachments cannot be queued.')
+        data = {field: getattr(message, field) for field in MESSAGE_FIELDS}
+        data['alternatives'] = getattr(message, 'alternatives', [])
+        return self.model(
+            subject=message.subject,
+            recipients=', '.join(message.recipients()),
+            message=json.dumps(data),
+        )
+
+    def claim(self, batch_size, lease=None):
+        """
+        Lock up to batch_size sendable emails, mark them as sending and
+        return them, oldest first.
+
+        An email is sendable when it is pending, or when it is being sent
+        but its lease has expired because the worker sending it died.
+        Workers skip rows locked by other workers, so several can drain
+        the outbox.
+        """
+        if lease is None:
+            lease = getattr(settings, 'OUTBOX_LEASE_SECONDS', 300)
+        now = timezone.now()
+        send_after = now + datetime.timedelta(seconds=lease)
+        with transaction.atomic():
+            emails = list(self.select_for_update(skip_locked=True).filter(
+                status__in=(OutgoingEmail.PENDING, OutgoingEmail.SENDING),
+                send_after__lte=now,
+            ).order_by('send_after', 'pk')[:batch_size])
+            for email in emails:
+                email.status = OutgoingEmail.SENDING
+                email.attempts += 1
+                email.send_after = send_after
+            self.filter(pk__in=[email.pk for email in emails]).update(
+                status=OutgoingEmail.SENDING,
+                attempts=models.F('attempts') + 1,
+                send_after=send_after,
+            )
+        return emails
+
+    def queue_depth(self):
+        return self.filter(status=OutgoingEmail.PENDING).count()
+
+
+class OutgoingEmail(models.Model):
+    PENDING = 'PE'
+    SENDING = 'SG'
+    SENT = 'SE'
+    FAILED = 'FA'
+
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    subject = models.TextField(blank=True)
+    recipients = models.TextField()
+    # The EmailMessage attributes as JSON, see get_message()
+    message = models.TextField()
+    status = models.CharField(
+        max_length=2,
+        choices=STATUS_CHOICES,
+        default=PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    send_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    objects = OutgoingEmailManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'send_after']),
+        ]
+
+    def __str__(self):
+        return '%s to %s (%s)' % (self.subject, self.recipients,
+            self.get_status_display())
+
+    def get_message(self):
+        """
+        Returns the EmailMessage to send
+        """
+        data = json.loads(self.message)
+        alternatives = data.pop('alternatives')
+        data['headers'] = data.pop('extra_headers')
+        if alternatives:
+            return EmailMultiAlternatives(alternatives=alternatives, **data)
+        return EmailMessage(**data)
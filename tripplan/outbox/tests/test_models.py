@@ -0,0 +1,68 @@
+import datetime
+
+from django.core import mail
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from outbox.models import OutgoingEmail
+
+
+@override_settings(EMAIL_BACKEND='outbox.backends.OutboxBackend')
+class OutboxBackendTests(TestCase):
+    def test_send_mail_saves_email(self):
+        mail.send_mail('Subject', 'Body', 'from@email.com',
+            ['to@email.com', 'other@email.com'])
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.status, OutgoingEmail.PENDING)
+        self.assertEqual(email.recipients, 'to@email.com, other@email.com')
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_message_is_restored(self):
+        message = EmailMultiAlternatives('Subject', 'Body', 'from@email.com',
+            ['to@email.com'], bcc=['bcc@email.com'],
+            reply_to=['reply@email.com'], headers={'X-Trip': '1'})
+        message.attach_alternative('<p>Body</p>', 'text/html')
+        message.send()
+        restored = OutgoingEmail.objects.get().get_message()
+        self.assertEqual(restored.recipients(),
+            ['to@email.com', 'bcc@email.com'])
+        self.assertEqual(restored.reply_to, ['reply@email.com'])
+        self.assertEqual(restored.extra_headers, {'X-Trip': '1'})
+        self.assertEqual(restored.alternatives, [['<p>Body</p>', 'text/html']])
+
+    def test_attachments_are_refused(self):
+        message = EmailMessage('Subject', 'Body', 'from@email.com',
+            ['to@email.com'])
+        message.attach('plan.txt', 'Plan', 'text/plain')
+        with self.assertRaises(ValueError):
+            message.send()
+
+
+class OutgoingEmailManagerTests(TestCase):
+    def create(self, **kwargs):
+        return OutgoingEmail.objects.create(recipients='to@email.com',
+            message='{}', **kwargs)
+
+    def test_claim_takes_oldest_sendable_emails(self):
+        now = timezone.now()
+        later = self.create(send_after=now - datetime.timedelta(minutes=1))
+        first = self.create(send_after=now - datetime.timedelta(minutes=2))
+        self.create(send_after=now + datetime.timedelta(minutes=1))
+        self.create(status=OutgoingEmail.SENT)
+        emails = OutgoingEmail.objects.claim(10)
+        self.assertEqual(emails, [first, later])
+        self.assertEqual(emails[0].attempts, 1)
+        self.assertEqual(OutgoingEmail.objects.filter(
+            status=OutgoingEmail.SENDING, attempts=1).count(), 2)
+
+    def test_claim_respects_batch_size(self):
+        for _ in range(3):
+            self.create()
+        self.assertEqual(len(OutgoingEmail.objects.claim(2)), 2)
+        self.assertEqual(OutgoingEmail.objects.queue_depth(), 1)
+
+    def test_email_with_expired_lease_is_claimed_again(self):
+        self.create(status=OutgoingEmail.SENDING,
+            send_after=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(len(OutgoingEmail.objects.claim(10)), 1)
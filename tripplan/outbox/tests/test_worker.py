@@ -0,0 +1,118 @@
+from unittest import mock
+
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from account_info.models import User
+from outbox import worker
+from outbox.models import OutgoingEmail
+from outbox.worker import get_stats, send_pending
+from trips.models import Trip
+
+
+def queue(count):
+    with override_settings(EMAIL_BACKEND='outbox.backends.OutboxBackend'):
+        for i in range(count):
+            mail.send_mail('Subject %d' % i, 'Body', 'from@email.com',
+                ['to%d@email.com' % i])
+
+
+class WorkerTests(TestCase):
+    def setUp(self):
+        worker.reset()
+
+    def test_send_pending_sends_all_emails(self):
+        queue(3)
+        self.assertEqual(send_pending(batch_size=2, rate_limit=0), 3)
+        self.assertEqual([message.subject for message in mail.outbox],
+            ['Subject 0', 'Subject 1', 'Subject 2'])
+        self.assertFalse(OutgoingEmail.objects.exclude(
+            status=OutgoingEmail.SENT).exists())
+
+    def test_emails_are_sent_over_one_connection(self):
+        queue(3)
+        with mock.patch('outbox.worker.get_connection',
+                side_effect=mail.get_connection) as get_connection:
+            send_pending(batch_size=1, rate_limit=0)
+        self.assertEqual(get_connection.call_count, 1)
+
+    def test_limit(self):
+        queue(3)
+        self.assertEqual(send_pending(limit=2, rate_limit=0), 2)
+        self.assertEqual(OutgoingEmail.objects.queue_depth(), 1)
+
+    def test_rate_limit_spaces_sends(self):
+        queue(3)
+        clock = [0.0]
+        sent_at = []
+
+        def sleep(seconds):
+            clock[0] += seconds
+
+        def send_email(connection, email):
+            sent_at.append(clock[0])
+
+        with mock.patch('outbox.worker.time.monotonic',
+                lambda: clock[0]), \
+                mock.patch('outbox.worker.time.sleep', sleep), \
+                mock.patch('outbox.worker.send_email', send_email):
+            send_pending(rate_limit=10)
+        self.assertEqual(sent_at, [0.0, 0.1, 0.2])
+
+    @mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+        side_effect=ConnectionRefusedError)
+    def test_failed_email_is_retried_later(self, send_messages):
+        queue(1)
+        before = timezone.now()
+        send_pending(rate_limit=0)
+        email = OutgoingEmail.objects.get()
+        self.assertEqual(email.status, OutgoingEmail.PENDING)
+        self.assertGreater(email.send_after, before)
+        self.assertIn('ConnectionRefusedError', email.last_error)
+        self.assertEqual(send_pending(rate_limit=0), 0)
+
+    @mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+        side_effect=ConnectionRefusedError)
+    def test_email_fails_after_max_attempts(self, send_messages):
+        queue(1)
+        OutgoingEmail.objects.update(attempts=4)
+        send_pending(rate_limit=0)
+        self.assertEqual(OutgoingEmail.objects.get().status,
+            OutgoingEmail.FAILED)
+        self.assertEqual(get_stats()['failed'], 1)
+
+    def test_stats(self):
+        queue(2)
+        send_pending(limit=1, rate_limit=0)
+        stats = get_stats()
+        self.assertEqual((stats['sent'], stats['queue_depth']), (1, 1))
+        self.assertIsNotNone(stats['send_latency_p99'])
+        self.assertGreaterEqual(stats['queue_latency_p50'], 0)
+
+
+@override_settings(EMAIL_BACKEND='outbox.backends.OutboxBackend')
+class InvitationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='organizer@email.com',
+            password='ValidPassword')
+        self.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+        self.client.force_login(self.user)
+
+    @mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+        side_effect=ConnectionRefusedError)
+    def test_invitation_is_queued_while_mail_is_down(self, send_messages):
+        response = self.client.post(reverse('trips:add_trip_guest'),
+            {'trip_id': self.trip.id, 'email': 'guest@email.com'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(OutgoingEmail.objects.get().recipients,
+            'guest@email.com')
+
+    def test_bulk_invitations_are_queued(self):
+        self.client.post(reverse('trips:bulk_invite'),
+            {'trip_id': self.trip.id, 'emails': 'a@email.com b@email.com'})
+        self.assertEqual(OutgoingEmail.objects.queue_depth(), 2)
+        send_pending(rate_limit=0)
+        self.assertEqual(len(mail.outbox), 2)
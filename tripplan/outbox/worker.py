@@ -0,0 +1,124 @@
+import collections
+import datetime
+import logging
+import time
+import traceback
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.utils import timezone
+
+from taskqueue.worker import get_backoff
+
+from .models import OutgoingEmail
+
+
+logger = logging.getLogger(__name__)
+
+stats = collections.Counter()
+
+# Seconds of the most recently sent emails
+send_latencies = collections.deque(maxlen=1000)
+queue_latencies = collections.deque(maxlen=1000)
+
+
+def send_email(connection, email):
+    """
+    Send a claimed email over an open connection. On failure it is
+    rescheduled with the task queue's exponential backoff, or marked failed
+    once it has used all of its attempts. Returns True if it was sent.
+    """
+    start = time.monotonic()
+    try:
+        connection.send_messages([email.get_message()])
+    except Exception:
+        # The connection may be broken, the next send opens a new one
+        connection.close()
+        email.last_error = traceback.format_exc()
+        if email.attempts >= email.max_attempts:
+            email.status = OutgoingEmail.FAILED
+            stats['failed'] += 1
+            logger.error('Email %s failed permanently: %s', email.pk,
+                email.last_error)
+        else:
+            email.status = OutgoingEmail.PENDING
+            email.send_after = timezone.now() + datetime.timedelta(
+                seconds=get_backoff(email.attempts))
+            stats['retried'] += 1
+        email.save()
+        return False
+
+    send_latencies.append(time.monotonic() - start)
+    email.status = OutgoingEmail.SENT
+    email.sent = timezone.now()
+    email.last_error = ''
+    email.save()
+    queue_latencies.append((email.sent - email.created).total_seconds())
+    stats['sent'] += 1
+    return True
+
+
+def send_pending(limit=None, batch_size=None, rate_limit=None):
+    """
+    Claim and send emails in batches until the outbox has no sendable
+    emails or limit emails have been tried, all over one connection of
+    settings.OUTBOX_EMAIL_BACKEND. At most rate_limit emails are sent per
+    second, 0 for no limit. Returns the number of emails tried.
+    """
+    if batch_size is None:
+        batch_size = settings.OUTBOX_BATCH_SIZE
+    if rate_limit is None:
+        rate_limit = settings.OUTBOX_RATE_LIMIT
+    interval = 1.0 / rate_limit if rate_limit else 0
+    next_send = time.monotonic()
+    count = 0
+    connection = get_connection(settings.OUTBOX_EMAIL_BACKEND,
+        fail_silently=False)
+    try:
+        while limit is None or count < limit:
+            size = batch_size if limit is None else min(batch_size,
+                limit - count)
+            emails = OutgoingEmail.objects.claim(size)
+            if not emails:
+                break
+            for email in emails:
+                delay = next_send - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_send = max(next_send, time.monotonic()) + interval
+                send_email(connection, email)
+                count += 1
+    finally:
+        connection.close()
+    return count
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[int(round(percent / 100 * (len(values) - 1)))]
+
+
+def get_stats():
+    """
+    Returns the counters of this process, the number of emails waiting and
+    the p50/p99 latencies in seconds of the recently sent emails: of the
+    send itself, and from queueing to sending
+    """
+    values = {name: stats[name] for name in ('sent', 'retried', 'failed')}
+    values['queue_depth'] = OutgoingEmail.objects.queue_depth()
+    for name, latencies in (('send_latency', send_latencies),
+            ('queue_latency', queue_latencies)):
+        values[name + '_p50'] = percentile(latencies, 50)
+        values[name + '_p99'] = percentile(latencies, 99)
+    return values
+
+
+def reset():
+    """
+    Resets the counters and latencies. The outbox is not touched.
+    """
+    stats.clear()
+    send_latencies.clear()
+    queue_latencies.clear()
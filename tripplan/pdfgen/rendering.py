@@ -0,0 +1,182 @@
+"""
+Trip plan PDFs are rendered by the task queue and stored on disk.
+
+Each PDF is stored in a directory of the trip in settings.TRIP_PLAN_DIR,
+under the fragment version of the trip, see trips.fragments, and a hash of
+the trip plan HTML. Any change to the trip's data bumps its version, so a
+request only has to look up the file of the current version, without
+rendering anything. Only if fragment versions are not kept is the HTML
+rendered to get the version. Rendering the HTML is cheap, while WeasyPrint takes
+seconds for a large trip, so the render job only runs WeasyPrint if the
+HTML differs from that of the stored PDF.
+"""
+import datetime
+import glob
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from taskqueue.models import Job
+from trips import fragments
+from trips.models import Trip, TripMember
+
+
+TEMPLATE_NAME = 'pdfgen/trip_plan.html'
+BASE_URL = 'file://' + settings.STATIC_ROOT + '/'
+
+READY = 'ready'
+PENDING = 'pending'
+FAILED = 'failed'
+
+
+def get_context(trip):
+    """
+    Returns the context of the trip plan. The data of the fragments is
+    only loaded for fragments that are not cached, see trips.fragments.
+    """
+    context = {'trip': trip}
+    context['emergency_info'] = SimpleLazyObject(TripMember.objects.filter(
+        trip=trip,
+        accept_reqd=False
+    ).get_emergency_info)
+
+    # Context for route overview
+    context['detail_page_title'] = "Route Overview"
+    if trip.number_nights > 0:
+        context['end_date'] = trip.start_date + datetime.timedelta(
+            days=trip.number_nights)
+
+    context.update(fragments.lazy_context(trip.get_route_context,
+        Trip.ROUTE_CONTEXT_KEYS))
+
+    # Context for gear list
+    context.update(fragments.lazy_context(trip.get_gear_context,
+        Trip.GEAR_CONTEXT_KEYS))
+    return context
+
+
+def render_html(trip):
+    return render_to_string(TEMPLATE_NAME, get_context(trip))
+
+
+def get_content_hash(html):
+    return hashlib.sha256(html.encode('utf-8')).hexdigest()
+
+
+def get_version(trip):
+    """
+    Returns the version of the trip plan: the fragment version of the trip,
+    or the hash of the trip plan HTML if fragment versions are not kept,
+    e.g. with a DummyCache as settings.TRIP_FRAGMENT_CACHE
+    """
+    version = fragments.get_version(trip.id)
+    if version is None:
+        version = get_content_hash(render_html(trip))
+    return version
+
+
+def get_directory(trip_id):
+    return os.path.join(settings.TRIP_PLAN_DIR, str(trip_id))
+
+
+def get_path(trip_id, version, content_hash):
+    return os.path.join(get_directory(trip_id),
+        '%s-%s.pdf' % (version, content_hash))
+
+
+def find_path(trip_id, version):
+    """
+    Returns the path of the stored PDF of a version of a trip plan, or None
+    if it is not stored
+    """
+    paths = glob.glob(get_path(trip_id, version, '*'))
+    return paths[0] if paths else None
+
+
+def html_to_pdf(html):
+    # WeasyPrint loads cairo and pango on import. Only the task queue
+    # worker renders PDFs, so web processes don't need to load them.
+    from easy_pdf.rendering import html_to_pdf
+    return html_to_pdf(html, base_url=BASE_URL)
+
+
+def store(trip_id, version, content_hash, render_pdf):
+    """
+    Stores the PDF of a version of a trip plan and deletes older versions
+    of it. If the stored PDF has the same content hash it is renamed
+    instead of calling render_pdf(). A new file is written under a
+    temporary name and moved into place, so a partly written file is
+    never served.
+    """
+    directory = get_directory(trip_id)
+    os.makedirs(directory, exist_ok=True)
+    path = get_path(trip_id, version, content_hash)
+    same_content = glob.glob(get_path(trip_id, '*', content_hash))
+    if same_content:
+        os.replace(same_content[0], path)
+    else:
+        pdf = render_pdf()
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as pdf_file:
+            pdf_file.write(pdf)
+        os.replace(temp_path, path)
+
+    for old_path in glob.glob(get_path(trip_id, '*', '*')):
+        if old_path != path:
+            os.remove(old_path)
+    return path
+
+
+def render_trip_plan(trip):
+    """
+    Renders and stores the PDF of the current version of a trip plan
+    unless it is already stored. Returns the path of the PDF.
+    """
+    # Read before the trip's data, so a change made while rendering bumps
+    # the version again and the changed trip plan is rendered as well
+    version = get_version(trip)
+    path = find_path(trip.id, version)
+    if path is not None:
+        return path
+    html = render_html(trip)
+    return store(trip.id, version, get_content_hash(html),
+        lambda: html_to_pdf(html))
+
+
+def request_trip_plan(trip):
+    """
+    Returns (status, path) for the current version of a trip plan. The
+    path is None unless the status is READY. If it is not stored yet, a
+    job is queued to render it and the status is PENDING. If rendering
+    this version failed, the status is FAILED until
+    settings.TRIP_PLAN_RETRY_AFTER seconds have passed, after which the
+    next request queues it again.
+    """
+    version = get_version(trip)
+    path = find_path(trip.id, version)
+    if path is not None:
+        return READY, path
+
+    dedup_key = 'trip_plan:%s:%s' % (trip.id, version)
+    job = Job.objects.filter(dedup_key=dedup_key).order_by('-pk').first()
+    if job is not None and job.status == Job.FAILED:
+        retry_at = job.updated + datetime.timedelta(
+            seconds=settings.TRIP_PLAN_RETRY_AFTER)
+        if timezone.now() < retry_at:
+            return FAILED, None
+    if job is None or job.status in (Job.DONE, Job.FAILED):
+        Job.objects.enqueue(
+            'pdfgen.render_trip_plan',
+            {'trip_id': trip.id},
+            dedup_key=dedup_key
+        )
+        # Jobs run immediately with TASKQUEUE_ALWAYS_EAGER
+        path = find_path(trip.id, version)
+        if path is not None:
+            return READY, path
+    return PENDING, None
@@ -0,0 +1,17 @@
+from taskqueue.registry import task
+from trips.models import Trip
+
+from . import rendering
+
+
+@task('pdfgen.render_trip_plan')
+def render_trip_plan(trip_id):
+    """
+    Render and store the PDF of a trip plan. Nothing is done if the trip
+    has been deleted since the job was queued.
+    """
+    try:
+        trip = Trip.objects.get(pk=trip_id)
+    except Trip.DoesNotExist:
+        return
+    rendering.render_trip_plan(trip)
@@ -1,3 +1,197 @@
-from django.test import TestCase
+import datetime
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from taskqueue.models import Job
+from taskqueue.worker import run_pending
+from trips import fragments
+from trips.models import Trip
+
+from . import rendering
+from .views import TripPlanView, TripPlanStatusView
+
+
+@mock.patch('pdfgen.rendering.html_to_pdf', return_value=b'%PDF-1.4')
+class TripPlanRenderingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.trip_plan_dir = tempfile.mkdtemp()
+        self.override = override_settings(TRIP_PLAN_DIR=self.trip_plan_dir,
+            TRIP_FRAGMENT_CACHE='default')
+        self.override.enable()
+        self.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.trip_plan_dir)
+
+    def test_render_trip_plan_stores_pdf(self, html_to_pdf):
+        path = rendering.render_trip_plan(self.trip)
+        with open(path, 'rb') as pdf_file:
+            self.assertEqual(pdf_file.read(), b'%PDF-1.4')
+        self.assertEqual(os.listdir(rendering.get_directory(self.trip.id)),
+            [os.path.basename(path)])
+
+    def test_trip_plan_has_no_links_to_change_the_trip(self, html_to_pdf):
+        html = rendering.render_html(self.trip)
+        self.assertIn('Route Overview', html)
+        self.assertNotIn(
+            reverse('trips:trip_schedule', args=(self.trip.id,)), html)
+        self.assertNotIn(
+            reverse('trips:trip_clone', args=(self.trip.id,)), html)
+
+    def test_unchanged_trip_plan_is_not_rendered_again(self, html_to_pdf):
+        first = rendering.render_trip_plan(self.trip)
+        second = rendering.render_trip_plan(self.trip)
+        self.assertEqual(first, second)
+        self.assertEqual(html_to_pdf.call_count, 1)
+
+    def test_changed_trip_plan_replaces_old_pdf(self, html_to_pdf):
+        first = rendering.render_trip_plan(self.trip)
+        self.trip.title = 'new title'
+        self.trip.save()
+        second = rendering.render_trip_plan(self.trip)
+        self.assertNotEqual(first, second)
+        self.assertEqual(html_to_pdf.call_count, 2)
+        self.assertEqual(os.listdir(rendering.get_directory(self.trip.id)),
+            [os.path.basename(second)])
+
+    @override_settings(TRIP_FRAGMENT_CACHE='fragments')
+    def test_changed_trip_plan_without_fragment_versions(self, html_to_pdf):
+        first = rendering.render_trip_plan(self.trip)
+        self.assertEqual(rendering.request_trip_plan(self.trip),
+            (rendering.READY, first))
+        self.trip.title = 'new title'
+        self.trip.save()
+        self.assertEqual(rendering.request_trip_plan(self.trip),
+            (rendering.PENDING, None))
+
+    def test_new_version_with_unchanged_html_reuses_pdf(self, html_to_pdf):
+        first = rendering.render_trip_plan(self.trip)
+        fragments.invalidate([self.trip.id])
+        second = rendering.render_trip_plan(self.trip)
+        self.assertNotEqual(first, second)
+        self.assertEqual(html_to_pdf.call_count, 1)
+        self.assertEqual(os.listdir(rendering.get_directory(self.trip.id)),
+            [os.path.basename(second)])
+
+    def test_request_trip_plan_queues_one_job(self, html_to_pdf):
+        self.assertEqual(rendering.request_trip_plan(self.trip)[0],
+            rendering.PENDING)
+        self.assertEqual(rendering.request_trip_plan(self.trip)[0],
+            rendering.PENDING)
+        self.assertEqual(Job.objects.count(), 1)
+        self.assertFalse(html_to_pdf.called)
+
+    def test_request_trip_plan_is_ready_after_job_runs(self, html_to_pdf):
+        rendering.request_trip_plan(self.trip)
+        run_pending()
+        status, path = rendering.request_trip_plan(self.trip)
+        self.assertEqual(status, rendering.READY)
+        self.assertTrue(os.path.exists(path))
+
+    def test_request_for_stored_trip_plan_does_not_render(self,
+            html_to_pdf):
+        rendering.render_trip_plan(self.trip)
+        with mock.patch('pdfgen.rendering.render_html') as render_html, \
+                self.assertNumQueries(0):
+            status, path = rendering.request_trip_plan(self.trip)
+        self.assertEqual(status, rendering.READY)
+        self.assertFalse(render_html.called)
+
+    def test_request_trip_plan_reports_failed_job(self, html_to_pdf):
+        html_to_pdf.side_effect = RuntimeError('Rendering failed')
+        rendering.request_trip_plan(self.trip)
+        Job.objects.update(max_attempts=1)
+        run_pending()
+        self.assertEqual(rendering.request_trip_plan(self.trip)[0],
+            rendering.FAILED)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_request_trip_plan_retries_failed_job_later(self, html_to_pdf):
+        html_to_pdf.side_effect = RuntimeError('Rendering failed')
+        rendering.request_trip_plan(self.trip)
+        Job.objects.update(max_attempts=1)
+        run_pending()
+        Job.objects.update(updated=timezone.now() - datetime.timedelta(
+            seconds=settings.TRIP_PLAN_RETRY_AFTER + 1))
+        html_to_pdf.side_effect = None
+        self.assertEqual(rendering.request_trip_plan(self.trip)[0],
+            rendering.PENDING)
+        self.assertEqual(Job.objects.count(), 2)
+        run_pending()
+        self.assertEqual(rendering.request_trip_plan(self.trip)[0],
+            rendering.READY)
+
+    @override_settings(TASKQUEUE_ALWAYS_EAGER=True)
+    def test_request_trip_plan_renders_immediately_when_eager(self,
+            html_to_pdf):
+        self.assertEqual(rendering.request_trip_plan(self.trip)[0],
+            rendering.READY)
+
+
+@mock.patch('pdfgen.rendering.html_to_pdf', return_value=b'%PDF-1.4')
+class TripPlanViewTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.trip_plan_dir = tempfile.mkdtemp()
+        self.override = override_settings(TRIP_PLAN_DIR=self.trip_plan_dir)
+        self.override.enable()
+        self.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.trip_plan_dir)
+
+    def get(self, view_class):
+        request = self.factory.get('/fake/')
+        return view_class.as_view()(request, trip_id=self.trip.id)
+
+    def test_url_names_reverse_correctly(self, html_to_pdf):
+        self.assertEqual(reverse('pdfgen:trip_plan', args=[1]),
+            '/pdfgen/1/trip_plan/')
+        self.assertEqual(reverse('pdfgen:trip_plan_status', args=[1]),
+            '/pdfgen/1/trip_plan/status/')
+
+    def test_trip_plan_view_shows_status_page_while_rendering(self,
+            html_to_pdf):
+        response = self.get(TripPlanView)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Preparing the trip plan', response.content)
+
+    def test_trip_plan_view_serves_stored_pdf(self, html_to_pdf):
+        rendering.render_trip_plan(self.trip)
+        response = self.get(TripPlanView)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4')
+        self.assertEqual(html_to_pdf.call_count, 1)
+
+    def test_trip_plan_view_shows_status_page_if_pdf_was_replaced(self,
+            html_to_pdf):
+        path = os.path.join(self.trip_plan_dir, 'replaced.pdf')
+        with mock.patch('pdfgen.rendering.request_trip_plan',
+                return_value=(rendering.READY, path)):
+            response = self.get(TripPlanView)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Preparing the trip plan', response.content)
+
+    def test_status_view(self, html_to_pdf):
+        response = self.get(TripPlanStatusView)
+        self.assertJSONEqual(response.content.decode(),
+            {'status': 'pending'})
+        run_pending()
+        response = self.get(TripPlanStatusView)
+        self.assertJSONEqual(response.content.decode(), {
+            'status': 'ready',
+            'url': reverse('pdfgen:trip_plan', args=[self.trip.id]),
+        })
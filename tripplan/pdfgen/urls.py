@@ -7,4 +7,6 @@ app_name = 'pdfgen'
 urlpatterns = [
     url(r'^(?P<trip_id>[0-9]+)/trip_plan/$',
         views.TripPlanView.as_view(), name='trip_plan'),
+    url(r'^(?P<trip_id>[0-9]+)/trip_plan/status/$',
+        views.TripPlanStatusView.as_view(), name='trip_plan_status'),
 ]
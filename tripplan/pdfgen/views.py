@@ -1,54 +1,49 @@
-import datetime
-
-from django.conf import settings
 from django.urls import reverse
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse
-from django.views.generic import TemplateView
-from django.db.models.functions import Lower
+from django.http import FileResponse, JsonResponse
+from django.views.generic import View
 
-from easy_pdf.views import PDFTemplateView
+from trips.models import Trip
 
-from trips.models import Trip, TripMember, TripLocation, Item
+from . import rendering
 
 
-class TripPlanView(PDFTemplateView):
-    template_name = "pdfgen/trip_plan.html"
-    base_url = 'file://' + settings.STATIC_ROOT + '/'
-    # download_filename = "test.pdf"
+class TripPlanView(View):
+    """
+    Serves the stored PDF of the trip plan. If the current version of the
+    trip plan is not stored yet, it is rendered in the background and a
+    page polling TripPlanStatusView is shown instead.
+    """
+    template_name = "pdfgen/trip_plan_status.html"
 
-    def get_context_data(self, **kwargs):
-        context = super(TripPlanView, self).get_context_data(**kwargs)
+    def get(self, request, *args, **kwargs):
         trip = get_object_or_404(Trip, pk=self.kwargs['trip_id'])
-        context['trip'] = trip
-        context['object_list'] = TripMember.objects.filter(
-            trip_id = trip.id,
-            accept_reqd = False
-        )
-
-        # Context for route overview
-        context['detail_page_title'] = "Route Overview"
-        if trip.number_nights > 0:
-            context['end_date'] = trip.start_date + datetime.timedelta(
-                days=trip.number_nights)
-
-        context['trailhead'] = trip.get_trailhead()
-        context['endpoint'] = trip.get_endpoint()
-
-        context['objective_dict'] = trip.get_location_context(
-            TripLocation.OBJECTIVE)
-        context['camp_dict'] = trip.get_location_context(TripLocation.CAMP)
-
-        # Context for gear list
-        trip_items = Item.objects.filter(
-                trip_id = self.kwargs['trip_id']
-            ).prefetch_related(
-                'item_owners'
-            )
-        context['trip_items'] = trip_items.order_by(Lower('description'))
-
-        trip_members = TripMember.objects.filter(
-                trip=trip
-            ).select_related('member')
-        context['trip_members'] = trip_members
-        return context
+        status, path = rendering.request_trip_plan(trip)
+        if status == rendering.READY:
+            try:
+                pdf_file = open(path, 'rb')
+            except FileNotFoundError:
+                # Replaced by a newer version since it was looked up
+                status = rendering.PENDING
+            else:
+                return FileResponse(pdf_file, content_type='application/pdf')
+        return render(request, self.template_name, {
+            'trip': trip,
+            'status': status,
+            'status_url': reverse('pdfgen:trip_plan_status',
+                args=(trip.id,)),
+        })
+
+
+class TripPlanStatusView(View):
+    """
+    Returns the rendering status of the trip plan as JSON, with the url of
+    the PDF once it is ready
+    """
+    def get(self, request, *args, **kwargs):
+        trip = get_object_or_404(Trip, pk=self.kwargs['trip_id'])
+        status, path = rendering.request_trip_plan(trip)
+        data = {'status': status}
+        if status == rendering.READY:
+            data['url'] = reverse('pdfgen:trip_plan', args=(trip.id,))
+        return JsonResponse(data)
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class TaskqueueConfig(AppConfig):
+    name = 'taskqueue'
+
+    def ready(self):
+        # Register the task functions defined in each app's tasks.py
+        from . import registry
+        registry.autodiscover()
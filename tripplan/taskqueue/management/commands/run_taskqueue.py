@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from taskqueue.worker import run_pending
+
+
+class Command(BaseCommand):
+    help = 'Runs queued jobs. Start one or more of these as worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+            help='Exit once the queue has no runnable jobs.')
+        parser.add_argument('--sleep', type=float, default=1.0,
+            help='Seconds to wait when the queue is empty.')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            count = run_pending()
+            if count:
+                self.stdout.write('Ran %d job(s)' % count)
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def delete_duplicate_pending_jobs(apps, schema_editor):
+    """
+    Deletes all but the oldest pending job per dedup key
+    """
+    Job = apps.get_model('taskqueue', 'Job')
+    duplicates = Job.objects.filter(status='PE').exclude(
+        dedup_key='').values('dedup_key').annotate(
+        count=Count('pk')).filter(count__gt=1)
+    for duplicate in list(duplicates):
+        first, *others = Job.objects.filter(
+            status='PE',
+            dedup_key=duplicate['dedup_key']
+        ).order_by('pk')
+        Job.objects.filter(pk__in=[other.pk for other in others]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('taskqueue', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_pending_jobs,
+            migrations.RunPython.noop),
+        # Partial unique index, so concurrent enqueue() calls can't both
+        # queue a pending job with the same dedup key
+        migrations.RunSQL(
+            ["CREATE UNIQUE INDEX taskqueue_job_pending_dedup_key_uniq "
+             "ON taskqueue_job (dedup_key) "
+             "WHERE status = 'PE' AND dedup_key <> ''"],
+            ['DROP INDEX taskqueue_job_pending_dedup_key_uniq'],
+        ),
+    ]
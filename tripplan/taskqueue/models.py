@@ -0,0 +1,117 @@
+import datetime
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+
+
+class JobManager(models.Manager):
+    def enqueue(self, name, payload=None, dedup_key='', delay=0):
+        """
+        Add a job to the queue and return it. If dedup_key is given and a
+        pending job with the same key exists, that job is returned instead
+        of creating a duplicate. A unique index on the dedup keys of
+        pending jobs keeps concurrent calls from both creating one.
+
+        With settings.TASKQUEUE_ALWAYS_EAGER the job is run immediately.
+        """
+        if dedup_key:
+            existing = self.get_pending(dedup_key)
+            if existing:
+                return existing
+
+        try:
+            with transaction.atomic():
+                job = self.create(
+                    name=name,
+                    payload=json.dumps(payload or {}),
+                    dedup_key=dedup_key,
+                    run_after=timezone.now() + datetime.timedelta(
+                        seconds=delay),
+                )
+        except IntegrityError:
+            # Queued by a concurrent call
+            existing = self.get_pending(dedup_key)
+            if existing is None:
+                raise
+            return existing
+        if getattr(settings, 'TASKQUEUE_ALWAYS_EAGER', False):
+            from .worker import run_job
+            job.attempts += 1
+            run_job(job)
+        return job
+
+    def get_pending(self, dedup_key):
+        return self.filter(dedup_key=dedup_key, status=Job.PENDING).first()
+
+    def claim(self, lease=None):
+        """
+        Lock the next runnable job, mark it as running and return it.
+        Returns None if no job is ready.
+
+        A job is runnable when it is pending, or when it is running but its
+        lease has expired because the worker running it died. Workers skip
+        rows locked by other workers, so several can drain one queue.
+        """
+        if lease is None:
+            lease = getattr(settings, 'TASKQUEUE_LEASE_SECONDS', 300)
+        now = timezone.now()
+        with transaction.atomic():
+            job = self.select_for_update(skip_locked=True).filter(
+                status__in=(Job.PENDING, Job.RUNNING),
+                run_after__lte=now,
+            ).order_by('run_after', 'pk').first()
+            if job is None:
+                return None
+            job.status = Job.RUNNING
+            job.attempts += 1
+            job.run_after = now + datetime.timedelta(seconds=lease)
+            job.save(update_fields=['status', 'attempts', 'run_after',
+                'updated'])
+        return job
+
+    def queue_depth(self):
+        return self.filter(status=Job.PENDING).count()
+
+
+class Job(models.Model):
+    PENDING = 'PE'
+    RUNNING = 'RU'
+    DONE = 'DO'
+    FAILED = 'FA'
+
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=255)
+    payload = models.TextField(default='{}')
+    dedup_key = models.CharField(max_length=255, blank=True, db_index=True)
+    status = models.CharField(
+        max_length=2,
+        choices=STATUS_CHOICES,
+        default=PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = JobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def __str__(self):
+        return '%s (%s)' % (self.name, self.get_status_display())
+
+    def get_payload(self):
+        return json.loads(self.payload)
@@ -0,0 +1,37 @@
+"""
+Registry of the functions that can be run by the task queue.
+
+Apps define their tasks in a tasks.py module, which is imported when the
+taskqueue app is ready:
+
+    from taskqueue.registry import task
+
+    @task('trips.compute_celestial_times')
+    def compute_celestial_times(latitude, longitude, date):
+        ...
+
+The job payload is passed to the function as keyword arguments.
+"""
+from django.utils.module_loading import autodiscover_modules
+
+
+_tasks = {}
+
+
+def task(name):
+    def register(func):
+        _tasks[name] = func
+        return func
+    return register
+
+
+def get_task(name):
+    """
+    Returns the function registered for name. Raises KeyError if there
+    is none.
+    """
+    return _tasks[name]
+
+
+def autodiscover():
+    autodiscover_modules('tasks')
@@ -0,0 +1,105 @@
+import datetime
+from unittest import mock
+
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from taskqueue import registry
+from taskqueue.models import Job
+
+
+calls = []
+
+
+@registry.task('taskqueue.tests.record')
+def record(**kwargs):
+    calls.append(kwargs)
+
+
+class JobManagerTests(TestCase):
+    def setUp(self):
+        del calls[:]
+
+    def test_enqueue_creates_pending_job(self):
+        job = Job.objects.enqueue('taskqueue.tests.record', {'a': 1})
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertEqual(job.get_payload(), {'a': 1})
+        self.assertEqual(job.attempts, 0)
+
+    def test_enqueue_with_delay_sets_run_after(self):
+        job = Job.objects.enqueue('taskqueue.tests.record', delay=60)
+        self.assertGreater(job.run_after,
+            timezone.now() + datetime.timedelta(seconds=30))
+
+    def test_enqueue_deduplicates_pending_jobs(self):
+        first = Job.objects.enqueue('taskqueue.tests.record', {'a': 1},
+            dedup_key='key')
+        second = Job.objects.enqueue('taskqueue.tests.record', {'a': 1},
+            dedup_key='key')
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_pending_jobs_have_unique_dedup_keys(self):
+        Job.objects.create(name='taskqueue.tests.record', dedup_key='key')
+        Job.objects.create(name='taskqueue.tests.record', dedup_key='key',
+            status=Job.DONE)
+        Job.objects.create(name='taskqueue.tests.record')
+        Job.objects.create(name='taskqueue.tests.record')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Job.objects.create(name='taskqueue.tests.record',
+                dedup_key='key')
+
+    def test_enqueue_returns_job_queued_by_concurrent_call(self):
+        first = Job.objects.enqueue('taskqueue.tests.record',
+            dedup_key='key')
+        get_pending = Job.objects.get_pending
+        # The concurrent call queues its job after this one checked
+        with mock.patch.object(Job.objects, 'get_pending',
+                side_effect=[None, first]):
+            second = Job.objects.enqueue('taskqueue.tests.record',
+                dedup_key='key')
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(get_pending('key'), first)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_enqueue_does_not_deduplicate_finished_jobs(self):
+        first = Job.objects.enqueue('taskqueue.tests.record',
+            dedup_key='key')
+        Job.objects.filter(pk=first.pk).update(status=Job.DONE)
+        second = Job.objects.enqueue('taskqueue.tests.record',
+            dedup_key='key')
+        self.assertNotEqual(first.pk, second.pk)
+
+    @override_settings(TASKQUEUE_ALWAYS_EAGER=True)
+    def test_enqueue_runs_job_immediately_when_eager(self):
+        job = Job.objects.enqueue('taskqueue.tests.record', {'a': 1})
+        self.assertEqual(calls, [{'a': 1}])
+        self.assertEqual(job.status, Job.DONE)
+
+    def test_claim_returns_none_for_empty_queue(self):
+        self.assertIsNone(Job.objects.claim())
+
+    def test_claim_marks_job_running(self):
+        Job.objects.enqueue('taskqueue.tests.record')
+        job = Job.objects.claim()
+        self.assertEqual(job.status, Job.RUNNING)
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(Job.objects.claim())
+
+    def test_claim_skips_jobs_scheduled_in_the_future(self):
+        Job.objects.enqueue('taskqueue.tests.record', delay=60)
+        self.assertIsNone(Job.objects.claim())
+
+    def test_claim_returns_running_job_with_expired_lease(self):
+        Job.objects.enqueue('taskqueue.tests.record')
+        job = Job.objects.claim(lease=0)
+        reclaimed = Job.objects.claim()
+        self.assertEqual(job.pk, reclaimed.pk)
+        self.assertEqual(reclaimed.attempts, 2)
+
+    def test_queue_depth_counts_pending_jobs(self):
+        Job.objects.enqueue('taskqueue.tests.record')
+        Job.objects.enqueue('taskqueue.tests.record')
+        Job.objects.claim()
+        self.assertEqual(Job.objects.queue_depth(), 1)
@@ -0,0 +1,76 @@
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from taskqueue import registry
+from taskqueue.models import Job
+from taskqueue.worker import get_backoff, run_job, run_pending
+
+
+calls = []
+
+
+@registry.task('taskqueue.tests.succeed')
+def succeed(**kwargs):
+    calls.append(kwargs)
+
+
+@registry.task('taskqueue.tests.fail')
+def fail(**kwargs):
+    raise RuntimeError('Upstream unavailable')
+
+
+class WorkerTests(TestCase):
+    def setUp(self):
+        del calls[:]
+
+    def test_run_pending_runs_all_runnable_jobs(self):
+        Job.objects.enqueue('taskqueue.tests.succeed', {'n': 1})
+        Job.objects.enqueue('taskqueue.tests.succeed', {'n': 2})
+        self.assertEqual(run_pending(), 2)
+        self.assertEqual(calls, [{'n': 1}, {'n': 2}])
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 2)
+
+    def test_run_pending_respects_limit(self):
+        Job.objects.enqueue('taskqueue.tests.succeed')
+        Job.objects.enqueue('taskqueue.tests.succeed')
+        self.assertEqual(run_pending(limit=1), 1)
+        self.assertEqual(Job.objects.queue_depth(), 1)
+
+    def test_failed_job_is_retried_with_backoff(self):
+        Job.objects.enqueue('taskqueue.tests.fail')
+        job = Job.objects.claim()
+        self.assertFalse(run_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertIn('Upstream unavailable', job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+
+    def test_failed_job_is_not_retried_if_queued_again(self):
+        Job.objects.enqueue('taskqueue.tests.fail', dedup_key='key')
+        job = Job.objects.claim()
+        queued = Job.objects.enqueue('taskqueue.tests.fail', dedup_key='key')
+        self.assertFalse(run_job(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(Job.objects.get_pending('key'), queued)
+
+    def test_job_fails_after_max_attempts(self):
+        job = Job.objects.enqueue('taskqueue.tests.fail')
+        Job.objects.filter(pk=job.pk).update(max_attempts=1)
+        job = Job.objects.claim()
+        run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_unknown_task_fails_job(self):
+        job = Job.objects.enqueue('taskqueue.tests.unknown')
+        job = Job.objects.claim()
+        self.assertFalse(run_job(job))
+
+    @override_settings(TASKQUEUE_BACKOFF_SECONDS=10,
+        TASKQUEUE_MAX_BACKOFF_SECONDS=60)
+    def test_backoff_doubles_up_to_maximum(self):
+        self.assertEqual(
+            [get_backoff(attempts) for attempts in range(1, 6)],
+            [10, 20, 40, 60, 60]
+        )
@@ -0,0 +1,73 @@
+import datetime
+import logging
+import traceback
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import registry
+from .models import Job
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_backoff(attempts):
+    """
+    Returns the delay in seconds before a failed job is retried. The delay
+    doubles with each attempt, up to TASKQUEUE_MAX_BACKOFF_SECONDS.
+    """
+    base = getattr(settings, 'TASKQUEUE_BACKOFF_SECONDS', 10)
+    maximum = getattr(settings, 'TASKQUEUE_MAX_BACKOFF_SECONDS', 3600)
+    return min(base * 2 ** max(attempts - 1, 0), maximum)
+
+
+def run_job(job):
+    """
+    Run a claimed job. On success the job is marked done. On failure it is
+    rescheduled with exponential backoff, or marked failed once it has used
+    all of its attempts. Returns True if the job succeeded.
+    """
+    try:
+        func = registry.get_task(job.name)
+        func(**job.get_payload())
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+            logger.error('Job %s failed permanently: %s', job.pk,
+                job.last_error)
+        else:
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + datetime.timedelta(
+                seconds=get_backoff(job.attempts))
+        try:
+            with transaction.atomic():
+                job.save()
+        except IntegrityError:
+            # A job with the same dedup key was queued while this one ran.
+            # It runs instead of the retry.
+            job.status = Job.FAILED
+            job.save()
+        return False
+
+    job.status = Job.DONE
+    job.last_error = ''
+    job.save()
+    return True
+
+
+def run_pending(limit=None):
+    """
+    Claim and run jobs until the queue has no runnable jobs or limit jobs
+    have been run. Returns the number of jobs run.
+    """
+    count = 0
+    while limit is None or count < limit:
+        job = Job.objects.claim()
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 from .models import Trip, Item, ItemOwner, \
-    TripMember, TripGuest, TripLocation, ItemNotification
+    TripMember, TripGuest, TripLocation, ItemNotification, CelestialTimes
 
 admin_models = (
     Trip,
@@ -9,8 +9,28 @@ admin_models = (
     ItemOwner,
     TripMember,
     TripGuest,
-    TripLocation,
-    ItemNotification
+    ItemNotification,
+    CelestialTimes
 )
 
 admin.site.register(admin_models)
+
+
+@admin.register(TripLocation)
+class TripLocationAdmin(admin.ModelAdmin):
+    actions = ['recompute_celestial_times']
+
+    def recompute_celestial_times(self, request, queryset):
+        """
+        Saving a location only looks up its sun times when its coordinates
+        or date change. This recomputes them, e.g. after a lookup gave
+        wrong times.
+        """
+        count = 0
+        for location in queryset:
+            location.save(force_celestial=True)
+            count += 1
+        self.message_user(request,
+            'Sun times of %d location(s) will be recomputed.' % count)
+    recompute_celestial_times.short_description = \
+        'Recompute sun times of selected locations'
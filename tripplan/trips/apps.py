@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class TripsConfig(AppConfig):
     name = 'trips'
+
+    def ready(self):
+        from . import signals
+        signals.connect()
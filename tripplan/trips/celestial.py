@@ -0,0 +1,171 @@
+"""
+In-process part of the celestial times cache.
+
+Celestial times are stored in the CelestialTimes table, keyed by the date
+and the coordinates rounded to settings.CELESTIAL_CACHE_PRECISION decimal
+places, so nearby locations on the same day share one entry. The LRU cache
+in this module sits in front of the table so that repeated lookups in a
+process don't query the database either.
+
+Hits and misses are counted per process in `stats`:
+
+    memory_hits     answered by the LRU cache
+    database_hits   answered by the CelestialTimes table
+    misses          computed, which may query the timezone API
+    partial         computed with a failed lookup, so not cached
+
+On a miss the timezone and the sun times are looked up concurrently on a
+thread pool, see run_concurrently().
+"""
+import collections
+from concurrent import futures
+import decimal
+import logging
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+
+class PartialTimes(dict):
+    """
+    Celestial times computed while one of the lookups failed. Returned to
+    the caller but never cached, so they are computed again next time.
+    """
+
+
+class LRUCache:
+    """
+    Thread-safe least recently used cache whose entries expire at a given
+    time. The maximum size is read from settings.CELESTIAL_CACHE_SIZE.
+    """
+    def __init__(self):
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns the value for key, or None if it is missing or expired
+        """
+        with self._lock:
+            try:
+                expires, value = self._entries[key]
+            except KeyError:
+                return None
+            if expires <= timezone.now():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires):
+        maxsize = getattr(settings, 'CELESTIAL_CACHE_SIZE', 10000)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+cache = LRUCache()
+stats = collections.Counter()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Returns the thread pool shared by the process for celestial lookups
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = futures.ThreadPoolExecutor(
+                    max_workers=settings.CELESTIAL_LOOKUP_THREADS)
+    return _executor
+
+
+def discard_executor():
+    """
+    Forgets the thread pool without shutting it down. To be called in a
+    forked process, which inherits the pool but not its threads.
+    """
+    global _executor
+    _executor = None
+
+
+def run_concurrently(*funcs):
+    """
+    Calls each function on the thread pool and waits for all of them, for
+    at most settings.CELESTIAL_LOOKUP_TIMEOUT seconds in total. Returns a
+    list with the result of each function, or None for a function that
+    raised or did not finish in time.
+    """
+    pending = [get_executor().submit(func) for func in funcs]
+    futures.wait(pending, timeout=settings.CELESTIAL_LOOKUP_TIMEOUT)
+    results = []
+    for func, future in zip(funcs, pending):
+        if not future.done():
+            future.cancel()
+            logger.warning('%s timed out', func.__name__)
+            results.append(None)
+        elif future.exception() is not None:
+            logger.warning('%s failed: %r', func.__name__,
+                future.exception())
+            results.append(None)
+        else:
+            results.append(future.result())
+    return results
+
+
+def round_coordinate(value):
+    """
+    Returns a latitude or longitude as a Decimal rounded to
+    settings.CELESTIAL_CACHE_PRECISION decimal places
+    """
+    precision = getattr(settings, 'CELESTIAL_CACHE_PRECISION', 3)
+    return decimal.Decimal(str(value)).quantize(
+        decimal.Decimal(1).scaleb(-precision),
+        rounding=decimal.ROUND_HALF_UP
+    )
+
+
+def make_key(latitude, longitude, date):
+    return (round_coordinate(latitude), round_coordinate(longitude), date)
+
+
+def get_stats():
+    """
+    Returns the hit and miss counters of this process, with the fraction
+    of lookups that did not have to compute the times
+    """
+    values = {name: stats[name]
+        for name in ('memory_hits', 'database_hits', 'misses', 'partial')}
+    total = values['memory_hits'] + values['database_hits'] + \
+        values['misses']
+    values['hit_rate'] = (
+        (values['memory_hits'] + values['database_hits']) / total
+        if total else 0.0
+    )
+    return values
+
+
+def reset():
+    """
+    Empties the LRU cache and resets the counters. The database table is
+    not touched.
+    """
+    cache.clear()
+    stats.clear()
@@ -0,0 +1,93 @@
+"""
+Copies of trips, for groups that run the same route again.
+
+clone_trip() copies a trip to a new start date: its locations, on the same
+days of the trip, its gear, and optionally its members and guests, who are
+then invited to the copy. Every kind of row is copied with one bulk insert
+in one transaction, so copying a trip takes the same number of queries
+however large it is. bulk_create() sends no signals, so the notification
+counts of the invited members are updated here.
+"""
+import datetime
+
+from django.db import transaction
+
+from . import notifications
+from .models import Item, ItemOwner, Trip, TripGuest, TripLocation, \
+    TripMember
+
+
+def clone_trip(trip, start_date, organizer, title=None, number_nights=None,
+        invite_members=False):
+    """
+    Returns a copy of the trip that starts on start_date, with organizer
+    as its organizer. The title and number of nights are those of the trip
+    unless given.
+
+    Gear quantities are copied for the members of the copy: the organizer,
+    and with invite_members also the other members of the trip, who are
+    invited along with its guests. Sun times of the locations are copied
+    from the celestial cache or computed in the background, see
+    TripLocationQuerySet.update_suntimes().
+    """
+    if number_nights is None:
+        number_nights = trip.number_nights
+    with transaction.atomic():
+        clone = Trip.objects.create(
+            title=title or trip.title,
+            start_date=start_date,
+            number_nights=number_nights
+        )
+
+        members = [TripMember(trip=clone, member=organizer, organizer=True,
+            accept_reqd=False)]
+        guests = []
+        if invite_members:
+            members.extend(
+                TripMember(trip=clone, member_id=trip_member.member_id,
+                    organizer=trip_member.organizer, accept_reqd=True)
+                for trip_member in trip.tripmember_set.exclude(
+                    member=organizer)
+            )
+            guests = [TripGuest(trip=clone, email=email)
+                for email in trip.tripguest_set.values_list(
+                    'email', flat=True)]
+        TripMember.objects.bulk_create(members)
+        TripGuest.objects.bulk_create(guests)
+
+        TripLocation.objects.bulk_create(
+            TripLocation(
+                trip=clone,
+                location_type=location.location_type,
+                title=location.title,
+                day_index=location.day_index,
+                date=(None if location.day_index is None else
+                    start_date + datetime.timedelta(days=location.day_index)),
+                latitude=location.latitude,
+                longitude=location.longitude
+            )
+            for location in trip.triplocation_set.order_by('pk')
+        )
+        clone.triplocation_set.update_suntimes()
+
+        items = list(trip.item_set.order_by('pk'))
+        clones = Item.objects.bulk_create(
+            Item(trip=clone, description=item.description) for item in items)
+        # bulk_create only sets primary keys on PostgreSQL. The rows are
+        # inserted in order, so their ids are in the same order.
+        if clones and clones[0].pk is None:
+            clones = list(clone.item_set.order_by('pk'))
+        item_ids = {item.pk: copy.pk for item, copy in zip(items, clones)}
+        ItemOwner.objects.bulk_create(
+            ItemOwner(item_id=item_ids[item_id], owner_id=owner_id,
+                quantity=quantity, accept_reqd=accept_reqd)
+            for item_id, owner_id, quantity, accept_reqd in
+                ItemOwner.objects.filter(
+                    item__trip=trip,
+                    owner__in=[member.member_id for member in members]
+                ).values_list('item_id', 'owner_id', 'quantity',
+                    'accept_reqd')
+        )
+
+        notifications.update([member.member_id for member in members[1:]])
+    return clone
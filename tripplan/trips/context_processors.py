@@ -0,0 +1,17 @@
+from django.utils.functional import SimpleLazyObject
+
+from . import notifications
+
+
+def notification_count(request):
+    """
+    Adds notification_count, the number of pending notifications of the
+    user, read only when a template uses it
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {
+        'notification_count': SimpleLazyObject(
+            lambda: notifications.get_count(user.pk)),
+    }
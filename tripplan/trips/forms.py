@@ -1,3 +1,5 @@
+import re
+
 from django import forms
 
 from django.forms.widgets import NumberInput
@@ -48,23 +50,70 @@ class TripForm(forms.ModelForm):
             )
         )
 
+class TripScheduleForm(TripForm):
+    """
+    Changes the dates of an existing trip, see Trip.reschedule(). The
+    title is shown but can't be changed.
+    """
+    def __init__(self, *args, **kwargs):
+        super(TripScheduleForm, self).__init__(*args, **kwargs)
+        self.fields['title'].disabled = True
+
+class TripCloneForm(TripForm):
+    """
+    Title and dates of a copy of a trip, see trips.cloning
+    """
+    invite_members = forms.BooleanField(required=False,
+        label='Invite the members of this trip')
+
+    def __init__(self, *args, **kwargs):
+        super(TripCloneForm, self).__init__(*args, **kwargs)
+        # Before the buttons
+        self.helper.layout.insert(len(self.helper.layout) - 1,
+            'invite_members')
+
+class LoadedTripField(forms.ModelChoiceField):
+    """
+    Hidden field for a trip that is already loaded, see trips.loaders. Only
+    the id of that trip is valid, and it is cleaned without a query.
+    """
+    widget = forms.HiddenInput
+
+    def __init__(self, trip, *args, **kwargs):
+        super(LoadedTripField, self).__init__(
+            Trip.objects.filter(pk=trip.pk), *args, **kwargs)
+        self.trip = trip
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if str(value) != str(self.trip.pk):
+            raise forms.ValidationError(self.error_messages['invalid_choice'],
+                code='invalid_choice')
+        return self.trip
+
 class LocationForm(forms.ModelForm):
     class Meta:
         model = TripLocation
-        fields = ['trip', 'location_type', 'title', 'date',
+        fields = ['trip', 'location_type', 'title',
             'latitude', 'longitude']
 
     def __init__(self, *args, **kwargs):
         choices = kwargs.pop('choices')
         location_type = kwargs.pop('location_type')
+        trip = kwargs.pop('trip', None)
         super(LocationForm, self).__init__(*args, **kwargs)
+        if trip is not None:
+            self.fields['trip'] = LoadedTripField(trip)
+        if self.instance.pk:
+            self.initial.setdefault('date', self.instance.date_label)
         self.helper = FormHelper()
         self.helper.form_id = 'id-LocationForm'
         self.helper.form_class = 'trip_forms'
         self.helper.form_method = 'post'
         self.helper.form_action = ''
         self.fields['title'].label = 'Title for Trip Plan'
-        self.fields['date'].label = 'Date'
+        # Choices are date labels, see TripLocation.date_label
         self.fields['date'] = forms.ChoiceField(choices=choices)
         self.fields['latitude'].widget = NumberInput(attrs={
             'step': 'any',
@@ -94,6 +143,13 @@ class LocationForm(forms.ModelForm):
         if location_type == TripLocation.BEGIN:
             self.helper['date'].wrap(Field, type='hidden')
 
+    def clean(self):
+        cleaned_data = super(LocationForm, self).clean()
+        if 'date' in cleaned_data:
+            # Sets day_index and date before the model is validated
+            self.instance.date_label = cleaned_data['date']
+        return cleaned_data
+
 class SearchForm(forms.Form):
     class Meta:
         fields = ['email_search']
@@ -126,6 +182,30 @@ class TripGuestForm(forms.ModelForm):
         model = TripGuest
         fields = []
 
+class BulkInviteForm(forms.Form):
+    """
+    Emails of the people to invite to a trip, separated by commas,
+    semicolons or whitespace. Repeated emails are dropped, ignoring case.
+    """
+    MAX_EMAILS = 100
+
+    trip_id = forms.IntegerField()
+    emails = forms.CharField(widget=forms.Textarea)
+
+    def clean_emails(self):
+        emails = []
+        seen = set()
+        for email in re.split(r'[\s,;]+', self.cleaned_data['emails']):
+            if email and email.upper() not in seen:
+                seen.add(email.upper())
+                emails.append(email)
+        if not emails:
+            raise forms.ValidationError('Enter at least one email address.')
+        if len(emails) > self.MAX_EMAILS:
+            raise forms.ValidationError(
+                'Invite at most %d people at a time.' % self.MAX_EMAILS)
+        return emails
+
 class ItemModelForm(forms.ModelForm):
     class Meta:
         model = Item
@@ -0,0 +1,153 @@
+"""
+Cache of rendered trip page fragments.
+
+The partials of the trip pages (route overview, gear grid, emergency info)
+only change when the data of their trip changes. Every trip has a version
+number in the cache, and fragments are cached under the trip id, the
+version and the fragment name. A change to the trip bumps its version, see
+trips.signals, so the trip's fragments are never read again and expire on
+their own. Nothing has to be deleted on invalidation.
+
+The cache backend is the one named by settings.TRIP_FRAGMENT_CACHE. The
+versions are kept there too. A new version is the current time in
+microseconds, so a version that was evicted never repeats an old one.
+
+Hits and misses are counted per process in `stats`, see get_stats().
+Fragments are rendered with the {% tripfragment %} tag, and the context
+they need can be built lazily with lazy_context(), so a hit makes no
+queries.
+"""
+import collections
+import functools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.functional import SimpleLazyObject
+
+
+logger = logging.getLogger(__name__)
+
+stats = collections.Counter()
+
+
+def get_cache():
+    return caches[settings.TRIP_FRAGMENT_CACHE]
+
+
+def get_version_key(trip_id):
+    return 'trip_fragment_version:%s' % trip_id
+
+
+_last_version = 0
+_version_lock = threading.Lock()
+
+
+def new_version():
+    """
+    Returns the current time in microseconds, and never the same version
+    twice in a process
+    """
+    global _last_version
+    with _version_lock:
+        _last_version = max(int(time.time() * 1e6), _last_version + 1)
+        return _last_version
+
+
+def get_version(trip_id):
+    """
+    Returns the current fragment version of a trip
+    """
+    cache = get_cache()
+    key = get_version_key(trip_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def make_key(trip_id, version, name, vary_on=()):
+    return ':'.join(['trip_fragment', str(trip_id), str(version), name] +
+        [str(value) for value in vary_on])
+
+
+def _bump_versions(trip_ids):
+    # A new version is set rather than incremented. incr() is a get and a
+    # set on some backends, e.g. the file cache, so a concurrent bump could
+    # be lost.
+    version = new_version()
+    get_cache().set_many({get_version_key(trip_id): version
+        for trip_id in trip_ids}, None)
+
+
+def invalidate(trip_ids):
+    """
+    Bumps the fragment version of each trip. The versions are bumped again
+    when the transaction commits, so a fragment rendered by a concurrent
+    request before the changes were committed is not used either.
+    """
+    trip_ids = set(trip_id for trip_id in trip_ids if trip_id is not None)
+    if not trip_ids:
+        return
+    stats['invalidations'] += len(trip_ids)
+    _bump_versions(trip_ids)
+    transaction.on_commit(lambda: _bump_versions(trip_ids))
+
+
+def get_or_render(trip_id, name, render, vary_on=()):
+    """
+    Returns the cached fragment of a trip, calling render() to render and
+    cache it on a miss
+    """
+    cache = get_cache()
+    key = make_key(trip_id, get_version(trip_id), name, vary_on)
+    content = cache.get(key)
+    if content is not None:
+        stats['hits'] += 1
+        return content
+
+    stats['misses'] += 1
+    logger.debug('Rendering %s', key)
+    content = render()
+    cache.set(key, content, settings.TRIP_FRAGMENT_TIMEOUT)
+    return content
+
+
+def lazy_context(func, keys):
+    """
+    Returns a dict with a lazy value for each of the keys of the dict
+    returned by func(). func() is only called, once, when one of the
+    values is used, e.g. by rendering a fragment on a cache miss.
+    """
+    @functools.lru_cache(maxsize=None)
+    def get_context():
+        return func()
+
+    def get_value(key):
+        return get_context()[key]
+
+    return {key: SimpleLazyObject(functools.partial(get_value, key))
+        for key in keys}
+
+
+def get_stats():
+    """
+    Returns the hit and miss counters of this process, with the fraction
+    of fragments served from the cache
+    """
+    values = {name: stats[name]
+        for name in ('hits', 'misses', 'invalidations')}
+    total = values['hits'] + values['misses']
+    values['hit_rate'] = values['hits'] / total if total else 0.0
+    return values
+
+
+def reset():
+    """
+    Resets the counters. The cache is not touched.
+    """
+    stats.clear()
@@ -0,0 +1,256 @@
+"""
+Shared client for outbound HTTP calls.
+
+All calls to external APIs go through one requests.Session per process, so
+connections to a host are pooled and kept alive between requests instead
+of paying for a TCP and TLS handshake on every call. Each request has a
+connect and a read timeout, so a hung upstream can't pin a worker.
+
+A circuit breaker is kept per host. After HTTP_CIRCUIT_FAILURES consecutive
+failures (connection errors, timeouts or 5xx responses) calls to the host
+fail immediately with CircuitOpenError for HTTP_CIRCUIT_RESET_SECONDS.
+After that a single trial call is let through, which closes the circuit
+if it succeeds.
+
+Latency is recorded per host, see get_metrics().
+"""
+import collections
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+# Number of recent latencies kept per host for percentiles
+LATENCY_SAMPLES = 1000
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Raised instead of making a call to a host whose circuit is open.
+    Subclasses requests.RequestException so callers handle it like any
+    other failed request.
+    """
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, max_failures, reset_seconds):
+        self.max_failures = max_failures
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self):
+        """
+        Returns True if a call may be made. Only one call at a time is let
+        through while the circuit is half-open.
+        """
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or \
+                    self.failures >= self.max_failures:
+                self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """
+        Ends a trial call that neither succeeded nor failed, so the next
+        call is let through as a trial
+        """
+        with self._lock:
+            self.trial_running = False
+
+
+class HostMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+
+    def record_request(self, latency):
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(latency)
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def as_dict(self):
+        with self._lock:
+            requests, errors, rejected = \
+                self.requests, self.errors, self.rejected
+            latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return latencies[min(int(len(latencies) * fraction),
+                len(latencies) - 1)]
+
+        return {
+            'requests': requests,
+            'errors': errors,
+            'rejected': rejected,
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'max': latencies[-1] if latencies else None,
+        }
+
+
+class HTTPClient:
+    def __init__(self, connect_timeout=None, read_timeout=None,
+            pool_size=None, max_failures=None, reset_seconds=None):
+        self.timeout = (
+            connect_timeout or settings.HTTP_CONNECT_TIMEOUT,
+            read_timeout or settings.HTTP_READ_TIMEOUT,
+        )
+        self.max_failures = max_failures or settings.HTTP_CIRCUIT_FAILURES
+        self.reset_seconds = reset_seconds or \
+            settings.HTTP_CIRCUIT_RESET_SECONDS
+        pool_size = pool_size or settings.HTTP_POOL_SIZE
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+            pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._breakers = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def get_breaker(self, host):
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(
+                    self.max_failures, self.reset_seconds)
+            return self._breakers[host]
+
+    def get_host_metrics(self, host):
+        with self._lock:
+            if host not in self._metrics:
+                self._metrics[host] = HostMetrics()
+            return self._metrics[host]
+
+    def get_metrics(self):
+        """
+        Returns a dict of request counts and latencies in seconds per host
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {host: host_metrics.as_dict()
+            for host, host_metrics in metrics.items()}
+
+    def request(self, method, url, **kwargs):
+        """
+        Same as requests.request(), using the pooled session, the default
+        timeouts and the circuit breaker of the host. Raises
+        CircuitOpenError if the circuit of the host is open.
+        """
+        host = urlsplit(url).netloc
+        breaker = self.get_breaker(host)
+        metrics = self.get_host_metrics(host)
+        if not breaker.allow():
+            metrics.record_rejected()
+            raise CircuitOpenError('Circuit open for %s' % host)
+
+        kwargs.setdefault('timeout', self.timeout)
+        start = time.monotonic()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            breaker.record_failure()
+            metrics.record_error()
+            raise
+        except BaseException:
+            # Not a failure of the host, e.g. an invalid URL or an error in
+            # a hook, but a trial call must not leave the circuit waiting
+            # for its result
+            breaker.release_trial()
+            metrics.record_error()
+            raise
+        finally:
+            latency = time.monotonic() - start
+            metrics.record_request(latency)
+            logger.debug('%s %s took %.3fs', method, host, latency)
+
+        if response.status_code >= 500:
+            breaker.record_failure()
+            metrics.record_error()
+        else:
+            breaker.record_success()
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the HTTPClient shared by the process
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HTTPClient()
+    return _client
+
+
+def get(url, **kwargs):
+    return get_client().get(url, **kwargs)
+
+
+def get_metrics():
+    return get_client().get_metrics()
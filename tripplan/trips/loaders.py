@@ -0,0 +1,31 @@
+"""
+Request-scoped identity map of trips.
+
+A location page needs its trip in the view, in the form and in the
+validation of the location. get_trip() loads each trip once per request
+and returns the same instance every time, so all of them share it, along
+with its memoized date choices, see Trip.get_date_choices(). The map is
+kept on the request and goes away with it, so a trip is never read from
+a previous request.
+"""
+from django.http import Http404
+
+from .models import Trip
+
+
+def get_trip(request, trip_id):
+    """
+    Returns the trip with the id, loading it the first time it is needed
+    in the request. Raises Http404 if there is no such trip.
+    """
+    try:
+        trip_id = int(trip_id)
+    except (TypeError, ValueError):
+        raise Http404('Invalid trip id: %s' % trip_id)
+    trips = request.__dict__.setdefault('_trips', {})
+    if trip_id not in trips:
+        try:
+            trips[trip_id] = Trip.objects.get(pk=trip_id)
+        except Trip.DoesNotExist:
+            raise Http404('No trip with id %d' % trip_id)
+    return trips[trip_id]
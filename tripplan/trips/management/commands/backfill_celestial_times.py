@@ -0,0 +1,238 @@
+import itertools
+import json
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Case, TimeField, Value, When
+
+from trips import celestial, fragments
+from trips.models import CelestialTimes, TripLocation
+
+
+# Rows per UPDATE statement. Every row adds two parameters per celestial
+# field, which keeps a statement under SQLite's limit of 999 parameters.
+UPDATE_BATCH_SIZE = 100
+
+
+def compute_times(inputs):
+    """
+    Computes the celestial times of a (latitude, longitude, date), in a
+    worker process. Returns None if they can't be computed.
+    """
+    latitude, longitude, date = inputs
+    location = TripLocation(latitude=latitude, longitude=longitude, date=date)
+    try:
+        celestial_times = location.compute_celestial_times()
+    except LookupError:
+        return None
+    if isinstance(celestial_times, celestial.PartialTimes):
+        return None
+    return celestial_times
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
+def bulk_update_times(times_by_pk):
+    """
+    Sets the celestial fields of many locations, with one UPDATE per
+    UPDATE_BATCH_SIZE locations instead of a save() per location
+    """
+    pks = list(times_by_pk)
+    for i in range(0, len(pks), UPDATE_BATCH_SIZE):
+        batch = pks[i:i + UPDATE_BATCH_SIZE]
+        TripLocation.objects.filter(pk__in=batch).update(**{
+            field: Case(
+                *[When(pk=pk, then=Value(times_by_pk[pk][field],
+                    output_field=TimeField())) for pk in batch],
+                output_field=TimeField()
+            )
+            for field in TripLocation.CELESTIAL_FIELDS
+        })
+
+
+class Command(BaseCommand):
+    help = (
+        'Computes the sun times of locations that are missing them, and '
+        'corrects those that differ from the cached times of their '
+        'coordinates and date, or recomputes the times of every location '
+        'with --all, in a pool of worker processes. Progress is saved to '
+        'a checkpoint file, and an interrupted run continues from it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', dest='all',
+            help='Recompute the times of every location with coordinates '
+                'and a date, e.g. after they were computed wrongly.')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+            help='Number of locations read, computed and written at once.')
+        parser.add_argument('--processes', type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes. 1 computes in this process.')
+        parser.add_argument('--checkpoint',
+            default='backfill_celestial_times.json',
+            help='File the progress is saved to. It is deleted when the '
+                'run completes.')
+        parser.add_argument('--checkpoint-every', type=int, default=10000,
+            help='Number of locations between saves of the checkpoint. It '
+                'is also saved when the run is interrupted.')
+        parser.add_argument('--restart', action='store_true',
+            help='Ignore an existing checkpoint and start from the first '
+                'location.')
+
+    def handle(self, *args, **options):
+        if min(options['chunk_size'], options['processes'],
+                options['checkpoint_every']) < 1:
+            raise CommandError('--chunk-size, --processes and '
+                '--checkpoint-every must be at least 1.')
+        path = options['checkpoint']
+        checkpoint = self.load_checkpoint(path, options['restart'])
+        if checkpoint['last_pk']:
+            self.stdout.write('Resuming after location %d' %
+                checkpoint['last_pk'])
+
+        locations = TripLocation.objects.filter(
+            pk__gt=checkpoint['last_pk'],
+            latitude__isnull=False,
+            longitude__isnull=False,
+            date__isnull=False
+        )
+        # Stale times can only be found by comparing them with the cache,
+        # so without --all every location is read as well
+        rows = locations.order_by('pk').values_list(
+            'pk', 'trip_id', 'latitude', 'longitude', 'date',
+            *TripLocation.CELESTIAL_FIELDS).iterator()
+
+        pool = None
+        if options['processes'] > 1:
+            # The workers are forked, so Django is set up in them, and
+            # they must not share the database connections
+            connections.close_all()
+            pool = multiprocessing.get_context('fork').Pool(
+                options['processes'], initializer=celestial.discard_executor)
+        start = time.monotonic()
+        processed = 0
+        unsaved = 0
+        completed = False
+        try:
+            for chunk in chunked(rows, options['chunk_size']):
+                updated, failed = self.backfill(chunk, pool, options['all'])
+                processed += len(chunk)
+                unsaved += len(chunk)
+                checkpoint['last_pk'] = chunk[-1][0]
+                checkpoint['read'] += len(chunk)
+                checkpoint['updated'] += updated
+                checkpoint['failed'] += failed
+                if unsaved >= options['checkpoint_every']:
+                    self.save_checkpoint(path, checkpoint)
+                    unsaved = 0
+                self.stdout.write(
+                    '%d locations read: %d updated, %d failed '
+                    '(%.1f locations/s)' % (checkpoint['read'],
+                        checkpoint['updated'], checkpoint['failed'],
+                        processed / (time.monotonic() - start))
+                )
+            completed = True
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            # The checkpoint only counts chunks that were committed
+            if not completed and unsaved:
+                self.save_checkpoint(path, checkpoint)
+
+        if os.path.exists(path):
+            os.remove(path)
+        self.stdout.write('Done: %d locations updated, %d failed.' % (
+            checkpoint['updated'], checkpoint['failed']))
+
+    def backfill(self, chunk, pool, recompute):
+        """
+        Computes the times of a chunk of locations that may be missing
+        times or whose times differ from the cached times of their inputs,
+        or of every location if recompute is True, and stores those that
+        changed. Locations with equal inputs are computed once, and cached
+        times are used unless recompute is True. Returns the numbers of
+        locations updated and of locations whose times could not be
+        computed.
+        """
+        times = {}
+        if recompute:
+            rows = chunk
+        else:
+            for key in set(row[2:5] for row in chunk):
+                cached = CelestialTimes.objects.get_cached(*key)
+                if cached is not None:
+                    times[key] = cached
+            rows = [row for row in chunk
+                if self.needs_times(row, times.get(row[2:5]))]
+        missing = list(set(row[2:5] for row in rows) - set(times))
+        if pool is not None:
+            results = pool.map(compute_times, missing)
+        else:
+            results = map(compute_times, missing)
+        times.update(zip(missing, results))
+
+        times_by_pk = {}
+        trip_ids = set()
+        failed = 0
+        for row in rows:
+            celestial_times = times[row[2:5]]
+            if celestial_times is None:
+                failed += 1
+            elif celestial_times != self.get_stored_times(row):
+                times_by_pk[row[0]] = celestial_times
+                trip_ids.add(row[1])
+        with transaction.atomic():
+            for key in missing:
+                if times[key] is not None:
+                    CelestialTimes.objects.store(*key,
+                        celestial_times=times[key])
+            bulk_update_times(times_by_pk)
+            # update() sends no signals
+            fragments.invalidate(trip_ids)
+        return len(times_by_pk), failed
+
+    def get_stored_times(self, row):
+        return dict(zip(TripLocation.CELESTIAL_FIELDS, row[5:]))
+
+    def needs_times(self, row, cached):
+        """
+        Returns True if the times of the location of a row differ from the
+        cached times of its inputs, e.g. because they were not cleared when
+        it was moved. Without cached times, a location missing its sunrise
+        or sunset may not have been computed, or the sun may not rise or
+        set there on that day. It is computed once, and its times are then
+        cached, so later runs skip it.
+        """
+        stored = self.get_stored_times(row)
+        if cached is not None:
+            return stored != cached
+        return stored['sunrise'] is None or stored['sunset'] is None
+
+    def load_checkpoint(self, path, restart):
+        checkpoint = {'last_pk': 0, 'read': 0, 'updated': 0, 'failed': 0}
+        if restart or not os.path.exists(path):
+            return checkpoint
+        try:
+            with open(path) as f:
+                checkpoint.update(json.load(f))
+        except ValueError:
+            raise CommandError('Invalid checkpoint file %s, use --restart '
+                'to ignore it.' % path)
+        return checkpoint
+
+    def save_checkpoint(self, path, checkpoint):
+        # Replaced atomically, so an interrupted write can't corrupt it
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(temporary_path, path)
@@ -0,0 +1,157 @@
+import itertools
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from account_info.models import User
+from trips.models import Trip, TripGuest, TripMember
+
+
+BATCH_SIZE = 10000
+
+# Functional indexes created by RunSQL in the migrations
+FUNCTIONAL_INDEXES = (
+    'tripguest_email_upper_idx',
+    'tripguest_trip_email_upper_uniq',
+    'account_info_user_email_upper_idx',
+)
+
+
+def batches(iterable):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = ('Seeds trip memberships and prints the query plans of the trip '
+        'member and guest lookups with and without their indexes. Requires '
+        'PostgreSQL. Everything is rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--memberships', type=int, default=1000000,
+            help='Number of TripMember rows to seed.')
+        parser.add_argument('--members-per-trip', type=int, default=20)
+        parser.add_argument('--users', type=int, default=100000,
+            help='Number of users the memberships are spread over.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Query plans can only be compared on '
+                'PostgreSQL, not %s.' % connection.vendor)
+        if options['users'] < options['members_per_trip']:
+            raise CommandError('--users must be at least --members-per-trip')
+
+        with transaction.atomic():
+            trip, user, guest_email = self.seed(options['memberships'],
+                options['members_per_trip'], options['users'])
+            queries = self.get_queries(trip, user, guest_email)
+
+            self.stdout.write('== With indexes ==')
+            self.explain(queries)
+
+            with transaction.atomic():
+                self.drop_indexes()
+                self.stdout.write('== Without indexes ==')
+                self.explain(queries)
+                transaction.set_rollback(True)
+
+            transaction.set_rollback(True)
+
+    def seed(self, memberships, members_per_trip, number_users):
+        self.stdout.write('Seeding %d memberships...' % memberships)
+        users = []
+        for batch in batches(
+                User(email='benchmark-%d@example.com' % i)
+                for i in range(number_users)):
+            users.extend(User.objects.bulk_create(batch))
+
+        trips = []
+        start_date = timezone.now().date()
+        for batch in batches(
+                Trip(title='benchmark', start_date=start_date)
+                for i in range(memberships // members_per_trip)):
+            trips.extend(Trip.objects.bulk_create(batch))
+
+        # Consecutive users per trip; one in five invitations is pending
+        for batch in batches(
+                TripMember(
+                    trip_id=trip.id,
+                    member_id=users[
+                        (i * members_per_trip + j) % number_users].id,
+                    organizer=j == 0,
+                    accept_reqd=j % 5 == 4
+                )
+                for i, trip in enumerate(trips)
+                for j in range(members_per_trip)):
+            TripMember.objects.bulk_create(batch)
+
+        for batch in batches(
+                TripGuest(trip_id=trip.id, email='guest-%d@example.com' % i)
+                for i, trip in enumerate(trips)):
+            TripGuest.objects.bulk_create(batch)
+
+        self.analyze()
+        middle = len(trips) // 2
+        return (
+            trips[middle],
+            users[(middle * members_per_trip) % number_users],
+            'GUEST-%d@example.com' % middle,
+        )
+
+    def get_queries(self, trip, user, guest_email):
+        """
+        The lookups of the views, as (description, queryset) pairs
+        """
+        email = user.email.upper()
+        return [
+            ('Members of a trip (TripMemberListView, '
+                'EmergencyInfoListView, TripPlanView)',
+                TripMember.objects.filter(trip=trip, accept_reqd=False)),
+            ('Invitations of a user (NotificationListView)',
+                TripMember.objects.filter(member=user, accept_reqd=True)),
+            ('Member by email (CheckUserExistsView)',
+                TripMember.objects.filter(member__email__iexact=email,
+                    trip=trip)),
+            ('Guest by email (CheckUserExistsView)',
+                TripGuest.objects.filter(email__iexact=guest_email,
+                    trip=trip)),
+            ('User by email (CheckUserExistsView)',
+                User.objects.filter(email__iexact=email)),
+            ('Guests of all trips by email (User.save)',
+                TripGuest.objects.filter(email__iexact=guest_email)),
+        ]
+
+    def explain(self, queries):
+        with connection.cursor() as cursor:
+            for description, queryset in queries:
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute('EXPLAIN ANALYZE ' + sql, params)
+                self.stdout.write(description)
+                for row in cursor.fetchall():
+                    self.stdout.write('    ' + row[0])
+                self.stdout.write('')
+
+    def drop_indexes(self):
+        """
+        Drops the indexes and unique constraints added for these lookups,
+        leaving the ones that existed before
+        """
+        with connection.schema_editor() as schema_editor:
+            schema_editor.alter_unique_together(TripMember,
+                TripMember._meta.unique_together, [])
+            for index in TripMember._meta.indexes:
+                schema_editor.remove_index(TripMember, index)
+        with connection.cursor() as cursor:
+            for name in FUNCTIONAL_INDEXES:
+                cursor.execute('DROP INDEX %s' % name)
+        self.analyze()
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            for model in (User, Trip, TripMember, TripGuest):
+                cursor.execute('ANALYZE %s' % model._meta.db_table)
@@ -0,0 +1,48 @@
+import datetime
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from trips import solar
+
+
+class Command(BaseCommand):
+    help = 'Reports the per-location cost of the offline solar ephemeris.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--locations', type=int, default=10000,
+            help='Number of random locations to compute.')
+        parser.add_argument('--days', type=int, default=30,
+            help='Number of distinct dates the locations are spread over.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        start = datetime.date(2018, 1, 1)
+        locations = [
+            (
+                rng.uniform(-60, 60),
+                rng.uniform(-180, 180),
+                start + datetime.timedelta(
+                    days=rng.randrange(options['days'])),
+            )
+            for _ in range(options['locations'])
+        ]
+        count = len(locations)
+
+        single = timeit.timeit(
+            lambda: [solar.get_suntimes(*loc) for loc in locations],
+            number=1
+        )
+        batch = timeit.timeit(
+            lambda: solar.get_suntimes_many(locations),
+            number=1
+        )
+
+        self.stdout.write('%d locations over %d dates' % (
+            count, options['days']))
+        self.stdout.write('get_suntimes():      %8.1f us/location' % (
+            single / count * 1e6))
+        self.stdout.write('get_suntimes_many(): %8.1f us/location' % (
+            batch / count * 1e6))
@@ -0,0 +1,155 @@
+import datetime
+import threading
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from django.db.utils import load_backend
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from account_info.models import User
+from dbpool.base import close_pools, get_pool
+from trips.models import Trip, TripMember
+
+
+# Plain backend and its pooled counterpart
+POOLED_ENGINES = {
+    'django.db.backends.postgresql': 'dbpool.backends.postgresql',
+    'django.db.backends.postgresql_psycopg2': 'dbpool.backends.postgresql',
+    'django.db.backends.sqlite3': 'dbpool.backends.sqlite3',
+}
+
+EMAIL = 'benchmark-trip-list@example.com'
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[int(round(percent / 100 * (len(values) - 1)))]
+
+
+class Command(BaseCommand):
+    help = ('Requests the trip list from concurrent threads, opening a '
+        'connection per request and then taking connections from a pool, '
+        'and prints the p50/p99 latencies. Works with PostgreSQL and a '
+        'SQLite file. The seeded trips are deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500,
+            help='Number of requests per run.')
+        parser.add_argument('--concurrency', type=int, default=8,
+            help='Number of threads making requests, also the pool size.')
+        parser.add_argument('--trips', type=int, default=20,
+            help='Number of trips on the list.')
+        parser.add_argument('--connect-latency', type=float, default=0,
+            help='Milliseconds added to opening a connection, e.g. to stand '
+                'in for the network round trips of PostgreSQL on SQLite.')
+
+    def handle(self, *args, **options):
+        settings_dict = connections.databases['default']
+        engine = settings_dict['ENGINE']
+        plain = {pooled: plain for plain, pooled in POOLED_ENGINES.items()}
+        plain_engine = plain.get(engine, engine)
+        if plain_engine not in POOLED_ENGINES:
+            raise CommandError('No pooled backend for %s.' % engine)
+        if settings_dict['NAME'] in ('', ':memory:'):
+            raise CommandError('The threads need a database file, not an '
+                'in-memory database.')
+
+        database = load_backend(plain_engine).Database
+        connect = database.connect
+
+        def slow_connect(*args, **kwargs):
+            time.sleep(options['connect_latency'] / 1000)
+            return connect(*args, **kwargs)
+
+        user = self.seed(options['trips'])
+        original = dict(settings_dict)
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver'],
+                    SECURE_SSL_REDIRECT=False), \
+                    mock.patch.object(database, 'connect', slow_connect):
+                for label, run_engine in (
+                        ('Connection per request', plain_engine),
+                        ('Connection pool', POOLED_ENGINES[plain_engine])):
+                    settings_dict.update(ENGINE=run_engine, CONN_MAX_AGE=0,
+                        POOL={'MAX_SIZE': options['concurrency']})
+                    latencies = self.run(user, options['requests'],
+                        options['concurrency'])
+                    self.report(label, latencies)
+                    if run_engine.startswith('dbpool.'):
+                        pool = get_pool('default', settings_dict['NAME'],
+                            settings_dict['POOL'])
+                        self.stdout.write('    connections opened: %d, '
+                            'reused: %d' % (pool.stats['created'],
+                                pool.stats['reused']))
+                    close_pools()
+        finally:
+            settings_dict.clear()
+            settings_dict.update(original)
+            Trip.objects.filter(tripmember__member=user).delete()
+            user.delete()
+
+    def seed(self, number_trips):
+        user = User.objects.create_user(email=EMAIL, password='benchmark')
+        today = timezone.now().date()
+        trips = Trip.objects.bulk_create(
+            Trip(title='benchmark %d' % i,
+                start_date=today + datetime.timedelta(
+                    days=i - number_trips // 2))
+            for i in range(number_trips))
+        # bulk_create only sets primary keys on PostgreSQL
+        if trips[0].pk is None:
+            trips = Trip.objects.filter(title__startswith='benchmark ')
+        TripMember.objects.bulk_create(
+            TripMember(trip=trip, member=user) for trip in trips)
+        return user
+
+    def run(self, user, number_requests, concurrency):
+        url = reverse('trips:trip_list')
+        latencies = []
+        lock = threading.Lock()
+        remaining = [number_requests]
+        errors = []
+
+        def worker():
+            client = Client()
+            client.force_login(user)
+            close_old_connections()
+            try:
+                while True:
+                    with lock:
+                        if not remaining[0]:
+                            return
+                        remaining[0] -= 1
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    # What the WSGI handler does when a request finishes;
+                    # the test client skips it
+                    close_old_connections()
+                    elapsed = time.perf_counter() - start
+                    if response.status_code != 200:
+                        errors.append(response.status_code)
+                        return
+                    with lock:
+                        latencies.append(elapsed)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker)
+            for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise CommandError('The trip list returned %s.' % errors[0])
+        return latencies
+
+    def report(self, label, latencies):
+        self.stdout.write('%s (%d requests)' % (label, len(latencies)))
+        self.stdout.write('    p50: %7.2f ms   p99: %7.2f ms' % (
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000))
@@ -0,0 +1,43 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from trips import tzindex
+
+
+class Command(BaseCommand):
+    help = (
+        'Builds the offline timezone index from a timezone-boundary-builder '
+        'GeoJSON file (https://github.com/evansiroky/timezone-boundary-builder'
+        '/releases, combined-with-oceans.json is recommended).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('geojson', help='Path to the GeoJSON file.')
+        parser.add_argument('--output', default=None,
+            help='Defaults to settings.TIMEZONE_INDEX_PATH.')
+
+    def handle(self, *args, **options):
+        output = options['output'] or settings.TIMEZONE_INDEX_PATH
+        try:
+            with open(options['geojson']) as geojson_file:
+                features = json.load(geojson_file)['features']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError('Could not read %s: %s' % (
+                options['geojson'], e))
+
+        polygons = []
+        for feature in features:
+            zone = feature['properties']['tzid']
+            geometry = feature['geometry']
+            if geometry['type'] == 'Polygon':
+                polygons.append((zone, geometry['coordinates']))
+            elif geometry['type'] == 'MultiPolygon':
+                for rings in geometry['coordinates']:
+                    polygons.append((zone, rings))
+
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        tzindex.write_index(output, polygons)
+        self.stdout.write('Wrote %d polygons to %s' % (len(polygons), output))
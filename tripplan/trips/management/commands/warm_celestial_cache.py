@@ -0,0 +1,78 @@
+import collections
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from trips import celestial
+from trips.models import CelestialTimes, TripLocation
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills the celestial cache for the most popular trailheads over a '
+        'range of dates, and deletes expired cache entries.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trailheads', type=int, default=100,
+            help='Number of trailheads to warm, most used first.')
+        parser.add_argument('--days', type=int, default=90,
+            help='Number of days to warm, starting at --start.')
+        parser.add_argument('--start', default=None,
+            help='First date as YYYY-MM-DD. Defaults to today.')
+
+    def handle(self, *args, **options):
+        if options['start']:
+            try:
+                start = datetime.datetime.strptime(
+                    options['start'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Invalid --start date: %s' %
+                    options['start'])
+        else:
+            start = timezone.now().date()
+
+        purged = CelestialTimes.objects.purge_expired()
+
+        # Locations within the cache precision share an entry, so count
+        # trailheads by their rounded coordinates
+        counts = collections.Counter()
+        representative = {}
+        trailheads = TripLocation.objects.filter(
+            location_type=TripLocation.BEGIN,
+            latitude__isnull=False,
+            longitude__isnull=False
+        ).values_list('latitude', 'longitude')
+        for latitude, longitude in trailheads.iterator():
+            key = celestial.make_key(latitude, longitude, None)
+            counts[key] += 1
+            representative.setdefault(key, (latitude, longitude))
+
+        celestial.stats.clear()
+        failed = 0
+        popular = counts.most_common(options['trailheads'])
+        for key, count in popular:
+            latitude, longitude = representative[key]
+            for i in range(options['days']):
+                location = TripLocation(
+                    location_type=TripLocation.BEGIN,
+                    latitude=latitude,
+                    longitude=longitude,
+                    date=start + datetime.timedelta(days=i)
+                )
+                try:
+                    location.get_celestial_times()
+                except LookupError as e:
+                    # The timezone is the same on every date
+                    failed += 1
+                    self.stderr.write(str(e))
+                    break
+
+        stats = celestial.get_stats()
+        self.stdout.write(
+            'Warmed %d trailheads over %d days: %d computed, %d already '
+            'cached, %d trailheads failed. Purged %d expired entries.' % (
+                len(popular), options['days'], stats['misses'] - failed,
+                stats['memory_hits'] + stats['database_hits'], failed, purged)
+        )
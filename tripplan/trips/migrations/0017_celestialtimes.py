@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-17 23:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0016_auto_20180129_1632'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CelestialTimes',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latitude', models.DecimalField(decimal_places=6, max_digits=8)),
+                ('longitude', models.DecimalField(decimal_places=6, max_digits=9)),
+                ('date', models.DateField()),
+                ('dawn', models.TimeField(blank=True, null=True)),
+                ('sunrise', models.TimeField(blank=True, null=True)),
+                ('sunset', models.TimeField(blank=True, null=True)),
+                ('dusk', models.TimeField(blank=True, null=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'celestial times',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='celestialtimes',
+            unique_together=set([('latitude', 'longitude', 'date')]),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-17 23:15
+from __future__ import unicode_literals
+
+import datetime
+import re
+
+from django.db import migrations, models
+
+
+# Format of the old TripLocation.date strings, e.g. "Night 2 - 2018-01-02"
+DATE_LABEL_RE = re.compile(
+    r'^(?:Day|Night) (?P<day>[1-9][0-9]*) - (?P<date>\d{4}-\d{2}-\d{2})$')
+
+
+def parse_date_labels(apps, schema_editor):
+    """
+    Sets day_index and date from the old date strings. Locations sharing a
+    string are updated together. Unassigned or unparseable dates are left
+    empty.
+    """
+    TripLocation = apps.get_model('trips', 'TripLocation')
+    labels = TripLocation.objects.values_list(
+        'date_label', flat=True).distinct()
+    for label in list(labels):
+        match = DATE_LABEL_RE.match(label)
+        if match is None:
+            continue
+        try:
+            date = datetime.datetime.strptime(
+                match.group('date'), '%Y-%m-%d').date()
+        except ValueError:
+            continue
+        TripLocation.objects.filter(date_label=label).update(
+            day_index=int(match.group('day')) - 1,
+            date=date
+        )
+
+
+def format_date_labels(apps, schema_editor):
+    TripLocation = apps.get_model('trips', 'TripLocation')
+    locations = TripLocation.objects.filter(
+        day_index__isnull=False,
+        date__isnull=False
+    ).values_list('pk', 'location_type', 'day_index', 'date')
+    for pk, location_type, day_index, date in locations.iterator():
+        prefix = 'Night' if location_type == 'CM' else 'Day'
+        TripLocation.objects.filter(pk=pk).update(
+            date_label='%s %d - %s' % (prefix, day_index + 1, date))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trips', '0017_celestialtimes'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='triplocation',
+            old_name='date',
+            new_name='date_label',
+        ),
+        migrations.AddField(
+            model_name='triplocation',
+            name='day_index',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='triplocation',
+            name='date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(parse_date_labels, format_date_labels),
+        migrations.RemoveField(
+            model_name='triplocation',
+            name='date_label',
+        ),
+        migrations.AddIndex(
+            model_name='triplocation',
+            index=models.Index(fields=['trip', 'location_type', 'day_index'], name='trips_tripl_trip_id_c9c633_idx'),
+        ),
+    ]
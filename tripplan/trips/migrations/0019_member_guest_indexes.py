@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.4 on 2026-10-17 23:18
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def delete_duplicate_members(apps, schema_editor):
+    """
+    Merges duplicate (trip, member) rows into the oldest one, which stays
+    an organizer if any of them was and accepted if any of them was
+    """
+    TripMember = apps.get_model('trips', 'TripMember')
+    duplicates = TripMember.objects.values('trip', 'member').annotate(
+        count=Count('pk')).filter(count__gt=1)
+    for duplicate in list(duplicates):
+        first, *others = TripMember.objects.filter(
+            trip=duplicate['trip'],
+            member=duplicate['member']
+        ).order_by('pk')
+        first.organizer = any(m.organizer for m in [first] + others)
+        first.accept_reqd = all(m.accept_reqd for m in [first] + others)
+        first.save()
+        TripMember.objects.filter(
+            pk__in=[other.pk for other in others]).delete()
+
+
+def delete_duplicate_guests(apps, schema_editor):
+    """
+    Deletes all but the oldest guest of a trip per case-insensitive email
+    """
+    TripGuest = apps.get_model('trips', 'TripGuest')
+    seen = set()
+    duplicate_pks = []
+    guests = TripGuest.objects.order_by('pk').values_list(
+        'pk', 'trip_id', 'email')
+    for pk, trip_id, email in guests.iterator():
+        key = (trip_id, email.upper())
+        if key in seen:
+            duplicate_pks.append(pk)
+        seen.add(key)
+    TripGuest.objects.filter(pk__in=duplicate_pks).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('trips', '0018_triplocation_day_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_members,
+            migrations.RunPython.noop),
+        migrations.RunPython(delete_duplicate_guests,
+            migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='tripmember',
+            unique_together=set([('trip', 'member')]),
+        ),
+        migrations.AddIndex(
+            model_name='tripmember',
+            index=models.Index(fields=['trip', 'accept_reqd'], name='tripmember_trip_accept_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripmember',
+            index=models.Index(fields=['member', 'accept_reqd'], name='tripmember_member_accept_idx'),
+        ),
+        # Functional indexes for email__iexact, which compares UPPER(email)
+        migrations.RunSQL(
+            ['CREATE INDEX tripguest_email_upper_idx '
+             'ON trips_tripguest (UPPER(email))'],
+            ['DROP INDEX tripguest_email_upper_idx'],
+        ),
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX tripguest_trip_email_upper_uniq '
+             'ON trips_tripguest (trip_id, UPPER(email))'],
+            ['DROP INDEX tripguest_trip_email_upper_uniq'],
+        ),
+    ]
@@ -1,20 +1,60 @@
 import datetime
+import re
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models import DEFERRED
+from django.db.models.functions import Coalesce, Lower
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 import pytz
 import requests
 
+from taskqueue.models import Job
+
+from . import celestial, httpclient, solar, tzindex
+
+
+# Format of the choices returned by Trip.get_date_choices()
+DATE_LABEL_RE = re.compile(
+    r'^(?:Day|Night) (?P<day>[1-9][0-9]*) - (?P<date>\d{4}-\d{2}-\d{2})$')
+
+class TripQuerySet(models.QuerySet):
+    def with_list_annotations(self):
+        """
+        Annotates each trip with member_count, the number of members who
+        accepted, and trailhead_title, the title of its trailhead or None,
+        in the same query as the trips
+        """
+        member_count = TripMember.objects.filter(
+            trip=models.OuterRef('pk'), accept_reqd=False
+        ).order_by().values('trip').annotate(
+            count=models.Count('pk')).values('count')
+        trailhead_title = TripLocation.objects.filter(
+            trip=models.OuterRef('pk'), location_type=TripLocation.BEGIN
+        ).order_by('pk').values('title')[:1]
+        return self.annotate(
+            member_count=Coalesce(models.Subquery(member_count,
+                output_field=models.IntegerField()), 0),
+            trailhead_title=models.Subquery(trailhead_title,
+                output_field=models.CharField()),
+        )
 
 class Trip(models.Model):
+    # Keys of the dicts returned by get_route_context() and
+    # get_gear_context()
+    ROUTE_CONTEXT_KEYS = ('trailhead', 'endpoint', 'objective_dict',
+        'camp_dict', 'outside_locations')
+    GEAR_CONTEXT_KEYS = ('trip_items', 'trip_members', 'gear_rows')
+
     title = models.CharField(max_length = 255)
     start_date = models.DateField()
     number_nights = models.PositiveSmallIntegerField(default=0)
     trip_members = models.ManyToManyField(settings.AUTH_USER_MODEL,
         through='TripMember')
 
+    objects = TripQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
@@ -42,24 +82,38 @@ class Trip(models.Model):
             ep = None
         return ep
 
+    def get_date_count(self, date_type='day'):
+        """
+        Returns the number of days (or nights) of the trip
+        """
+        if date_type == 'night':
+            return self.number_nights
+        return self.number_nights + 1
+
     def get_date_choices(self, date_type='day'):
         """
         This function returns a list of choices for the date field.
         Example: [Day X - Month, DD YYYY", ...]
-        TripLocation.date field will hold one of these choices as a string.
+        The choice at index i is the TripLocation.date_label of a location
+        with day_index i.
+        The choices are memoized on the trip until its dates change.
         """
+        key = (date_type, self.start_date, self.number_nights)
+        memo = self.__dict__.setdefault('_date_choices', {})
+        if key in memo:
+            return list(memo[key])
+
         datelist = []
         if date_type == 'night':
-            range_limit = self.number_nights
             prefix = 'Night'
         else:
-            range_limit = self.number_nights + 1
             prefix = 'Day'
 
-        for i in range(0, range_limit):
+        for i in range(0, self.get_date_count(date_type)):
             text_half = prefix + " " + str(i + 1)
             date_half = self.start_date + datetime.timedelta(days=i)
             datelist.append(text_half + ' - ' + str(date_half))
+        memo[key] = tuple(datelist)
         return datelist
 
     def get_location_context(self, location_type):
@@ -68,19 +122,145 @@ class Trip(models.Model):
         returned by get_date_choices(). Each value is a list of locations
         corresponding to the key.
         """
-        context = {}
+        locations = self.triplocation_set.filter(
+            location_type=location_type).order_by('pk')
+        return self.group_locations_by_date(locations, location_type)
+
+    def group_locations_by_date(self, locations, location_type):
+        """
+        Same as get_location_context(), grouping the given locations in
+        memory instead of querying them
+        """
         if location_type == TripLocation.CAMP:
             datelist = self.get_date_choices(date_type='night')
         else:
             datelist = self.get_date_choices()
-        for date in datelist:
-            locations = self.triplocation_set.filter(
-                location_type=location_type,
-                date=date
-            )
-            context[date] = list(locations)
+        context = {date: [] for date in datelist}
+        for location in locations:
+            if location.location_type == location_type and \
+                    self.is_on_trip(location):
+                context[datelist[location.day_index]].append(location)
         return context
 
+    def has_date(self, day_index, date):
+        """
+        Returns True if date is the date of day (or night) day_index of
+        the trip
+        """
+        return day_index is not None and day_index >= 0 and \
+            date == self.start_date + datetime.timedelta(days=day_index)
+
+    def is_on_trip(self, location):
+        """
+        Returns True if the location is dated on one of the days (nights
+        for camps) of the trip
+        """
+        if location.location_type == TripLocation.CAMP:
+            date_type = 'night'
+        else:
+            date_type = 'day'
+        return self.has_date(location.day_index, location.date) and \
+            location.day_index < self.get_date_count(date_type)
+
+    def get_outside_locations(self, locations):
+        """
+        Returns the locations that have a date, but not one of the trip,
+        e.g. on a day after the last one of a shortened trip
+        """
+        return [location for location in locations
+            if location.day_index is not None and
+                not self.is_on_trip(location)]
+
+    def reschedule(self, start_date, number_nights):
+        """
+        Changes the dates of the trip. The locations stay on their day (or
+        night) of the trip, and their dates are moved with one UPDATE. Sun
+        times are only looked up again for the locations whose date
+        changed. Locations on a day after the last day of the new dates
+        are not changed otherwise; they are returned, see
+        get_outside_locations().
+        """
+        with transaction.atomic():
+            self.start_date = start_date
+            self.number_nights = number_nights
+            # Invalidates the fragments of the trip, which covers the
+            # updates of its locations too
+            self.save()
+            locations = self.triplocation_set.filter(day_index__isnull=False)
+            changed = {}
+            for pk, day_index, date in locations.values_list(
+                    'pk', 'day_index', 'date'):
+                if not self.has_date(day_index, date):
+                    changed[pk] = day_index
+            if changed:
+                changed_locations = locations.filter(pk__in=changed)
+                changed_locations.update(
+                    date=models.Case(
+                        *[models.When(day_index=day_index, then=models.Value(
+                            self.start_date + datetime.timedelta(
+                                days=day_index),
+                            output_field=models.DateField()))
+                            for day_index in set(changed.values())],
+                        output_field=models.DateField()
+                    ),
+                    **{field: None for field in TripLocation.CELESTIAL_FIELDS}
+                )
+                changed_locations.update_suntimes()
+            return self.get_outside_locations(locations)
+
+    def get_route_context(self):
+        """
+        Returns the template context for the route overview: the trailhead,
+        the endpoint, and the objective and camp locations by date. All
+        locations are loaded with a single query.
+        """
+        locations = list(self.triplocation_set.order_by('pk'))
+
+        def first_location(location_type):
+            for location in locations:
+                if location.location_type == location_type:
+                    return location
+            return None
+
+        return {
+            'trailhead': first_location(TripLocation.BEGIN),
+            'endpoint': first_location(TripLocation.END),
+            'objective_dict': self.group_locations_by_date(
+                locations, TripLocation.OBJECTIVE),
+            'camp_dict': self.group_locations_by_date(
+                locations, TripLocation.CAMP),
+            'outside_locations': self.get_outside_locations(locations),
+        }
+
+    def get_gear_context(self):
+        """
+        Returns the template context for the gear grid: the items and
+        members of the trip, and gear_rows, a list of (item, quantities)
+        pairs where quantities has the quantity owned by each member in the
+        order of trip_members ('' if none). Uses three queries regardless
+        of the size of the grid.
+        """
+        items = list(self.item_set.order_by(Lower('description')))
+        members = list(self.tripmember_set.select_related('member'))
+
+        item_index = {item.id: i for i, item in enumerate(items)}
+        member_index = {
+            trip_member.member_id: i for i, trip_member in enumerate(members)
+        }
+        quantities = [[''] * len(members) for item in items]
+        owners = ItemOwner.objects.filter(item__trip=self).values_list(
+            'item_id', 'owner_id', 'quantity')
+        for item_id, owner_id, quantity in owners:
+            if owner_id in member_index:
+                quantities[item_index[item_id]][member_index[owner_id]] = \
+                    quantity
+
+        return {
+            'trip_items': items,
+            'trip_members': members,
+            'gear_rows': list(zip(items, quantities)),
+        }
+
     def is_in_the_past(self):
         return self.start_date < timezone.now().date()
 
@@ -112,6 +292,26 @@ class ItemOwner(models.Model):
     def __str__(self):
         return self.owner.email
 
+class TripMemberQuerySet(models.QuerySet):
+    def with_emergency_contacts(self):
+        """
+        Loads the members and their emergency contacts with the trip
+        members, in two queries in total
+        """
+        return self.select_related('member').prefetch_related(
+            'member__emergencycontact_set')
+
+    def get_emergency_info(self):
+        """
+        Returns a list of (member, emergency_contacts) pairs, as rendered
+        by partials/emergency_info_content.html
+        """
+        return [
+            (trip_member.member,
+                list(trip_member.member.emergencycontact_set.all()))
+            for trip_member in self.with_emergency_contacts()
+        ]
+
 class TripMember(models.Model):
     member = models.ForeignKey(settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE)
@@ -119,16 +319,67 @@ class TripMember(models.Model):
     organizer = models.BooleanField(default=False)
     accept_reqd = models.BooleanField(default=False)
 
+    objects = TripMemberQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('trip', 'member')
+        indexes = [
+            # Current or pending members of a trip
+            models.Index(fields=['trip', 'accept_reqd'],
+                name='tripmember_trip_accept_idx'),
+            # Pending invitations of a user
+            models.Index(fields=['member', 'accept_reqd'],
+                name='tripmember_member_accept_idx'),
+        ]
+
     def __str__(self):
         return self.member.email
 
 class TripGuest(models.Model):
+    """
+    Guests are looked up with email__iexact, so the database indexes
+    UPPER(email) and keeps (trip, UPPER(email)) unique. Django can't
+    declare functional indexes, see migration 0019.
+    """
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE)
     email = models.CharField(max_length=255)
 
     def __str__(self):
         return self.email
 
+class TripLocationQuerySet(models.QuerySet):
+    def update_suntimes(self):
+        """
+        Sets the sun times of the locations with coordinates and a date,
+        with one UPDATE per distinct (latitude, longitude, date) whose
+        times are cached. The others are computed by one job, or by the
+        same job as in TripLocation.save() if there is only one.
+        """
+        inputs = self.filter(
+            latitude__isnull=False,
+            longitude__isnull=False,
+            date__isnull=False
+        ).order_by().values_list('latitude', 'longitude', 'date').distinct()
+        uncached = []
+        for latitude, longitude, date in inputs:
+            location = TripLocation(latitude=latitude, longitude=longitude,
+                date=date)
+            celestial_times = location.get_cached_celestial_times()
+            if celestial_times is None:
+                uncached.append(location)
+            else:
+                self.filter(latitude=latitude, longitude=longitude,
+                    date=date).update(**celestial_times)
+        if len(uncached) == 1:
+            uncached[0].schedule_suntimes()
+        elif uncached:
+            payload = {'inputs': [location.get_celestial_payload()
+                for location in uncached]}
+            transaction.on_commit(lambda: Job.objects.enqueue(
+                'trips.compute_celestial_times_batch',
+                payload
+            ))
+
 class TripLocation(models.Model):
     # Set variables to allow human-friendly access to location types
     BEGIN = 'ST'
@@ -152,16 +403,25 @@ class TripLocation(models.Model):
         'camp': CAMP
     }
 
+    # date_label of a location without a date
+    UNASSIGNED = 'Unassigned'
+
+    # Celestial time fields, in the order they occur during a day
+    CELESTIAL_FIELDS = ('dawn', 'sunrise', 'sunset', 'dusk')
+
+    # Fields whose changes make save() look up the celestial times again
+    CELESTIAL_INPUT_FIELDS = ('latitude', 'longitude', 'date', 'trip_id')
+
     # Model fields
     location_type = models.CharField(
         max_length=2,
         choices=LOCATION_TYPE_CHOICES
     )
     title = models.CharField(max_length = 255, blank=True)
-    date = models.CharField(
-        max_length = 255,
-        default='Unassigned',
-    )
+    # Day (or night for camps) of the trip, counting from 0, and its date.
+    # Both are None while the date is unassigned.
+    day_index = models.PositiveSmallIntegerField(blank=True, null=True)
+    date = models.DateField(blank=True, null=True)
     latitude = models.DecimalField(max_digits=8, decimal_places=6, blank=True, null=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE)
@@ -172,6 +432,23 @@ class TripLocation(models.Model):
     sunrise = models.TimeField(blank=True, null=True)
     sunset = models.TimeField(blank=True, null=True)
 
+    objects = TripLocationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['trip', 'location_type', 'day_index']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Remembers the celestial inputs as loaded, see
+        celestial_inputs_changed()
+        """
+        instance = super(TripLocation, cls).from_db(db, field_names, values)
+        instance._loaded_celestial_inputs = instance.get_celestial_inputs()
+        return instance
+
     @property
     def get_location_type_verbose(self):
         """
@@ -186,19 +463,47 @@ class TripLocation(models.Model):
         }
         return location_type[self.location_type]
 
+    @property
+    def date_label(self):
+        """
+        The date as shown to users and used as the value of the date
+        field on forms: "Day X - YYYY-MM-DD", "Night X - YYYY-MM-DD" for
+        camps, or "Unassigned"
+        """
+        if self.day_index is None or self.date is None:
+            return self.UNASSIGNED
+        if self.location_type == self.CAMP:
+            prefix = 'Night'
+        else:
+            prefix = 'Day'
+        return '%s %d - %s' % (prefix, self.day_index + 1, self.date)
+
+    @date_label.setter
+    def date_label(self, value):
+        """
+        Sets day_index and date from one of the choices returned by
+        Trip.get_date_choices(), or "Unassigned". Raises ValueError for
+        any other value.
+        """
+        if value == self.UNASSIGNED:
+            self.day_index = None
+            self.date = None
+            return
+        match = DATE_LABEL_RE.match(value or '')
+        if match is None:
+            raise ValueError('Could not parse date correctly: %s' % value)
+        self.day_index = int(match.group('day')) - 1
+        self.date = datetime.datetime.strptime(
+            match.group('date'), '%Y-%m-%d').date()
+
     def get_date(self):
         """
         This function returns the date if it is assigned.
         Else raises an ValueError exception
         """
-        try:
-            date_components = self.date.split(' - ')
-            date={}
-            date['day'] = date_components[0]
-            date['date'] = datetime.datetime.strptime(date_components[1], '%Y-%m-%d').date()
-        except:
-            raise ValueError('Could not parse date correctly: %s' % self.date)
-        return date['date']
+        if self.date is None:
+            raise ValueError('Date is unassigned')
+        return self.date
 
     def get_date_choices(self, date_type='day'):
         """
@@ -208,110 +513,350 @@ class TripLocation(models.Model):
 
     def clean_fields(self, exclude=None):
         """
-        The value for date must be one of those returned by the
-        Trip.get_date_choices() method
+        The date must be assigned to one of the days (nights for camps) of
+        the trip, i.e. date_label must be one of the choices returned by
+        the Trip.get_date_choices() method
         """
-        super(TripLocation, self).clean_fields(exclude=None)
+        # A trip loaded from the database, e.g. by trips.loaders, is not
+        # looked up again to check that it exists
+        if TripLocation.trip.is_cached(self) and \
+                not self.trip._state.adding:
+            super(TripLocation, self).clean_fields(exclude=['trip'])
+        else:
+            super(TripLocation, self).clean_fields(exclude=None)
         if self.location_type == self.CAMP:
             date_type = 'night'
         else:
             date_type = 'day'
-        if self.date not in self.get_date_choices(date_type):
+        if not (self.trip.has_date(self.day_index, self.date) and
+                self.day_index < self.trip.get_date_count(date_type)):
             if exclude and 'date' in exclude:
                 raise ValidationError(
-                    '%s is not a valid date format.' % self.date
+                    '%s is not a valid date.' % self.date_label
                 )
             else:
                 raise ValidationError(
                     {
-                        'date': '%s is not a valid date format.' % self.date
+                        'date': '%s is not a valid date.' % self.date_label
                     }
                 )
 
     def get_timezone(self):
+        """
+        Returns a dict with the IANA zone name under 'timeZoneId'. Uses the
+        offline timezone index when it is installed, otherwise the Google
+        Maps Time Zone API through the shared HTTP client. Returns an empty
+        dict if neither succeeds.
+        """
+        timezone_id = tzindex.timezone_at(self.latitude, self.longitude)
+        if timezone_id:
+            return {'timeZoneId': timezone_id}
+
         date_at_midnight = str(int(datetime.datetime.combine(
             self.get_date(),
             datetime.datetime.min.time()
         ).timestamp()))
         try:
-            return_value = requests.get(
-                'https://maps.googleapis.com/maps/api/timezone/json',
+            return_value = httpclient.get(
+                settings.GOOGLE_TIMEZONE_API_URL,
                 params={
                     'location': f'{self.latitude}, {self.longitude}',
                     'timestamp': date_at_midnight,
                     'key': settings.GOOGLE_MAPS_API,
                 }
             ).json()
-        except KeyError:
+        except (requests.RequestException, ValueError):
             return_value = {}
 
         return return_value
 
     def get_suntimes_in_utc(self):
         """
-        Get sun times from API. Requires latitude, longitude, and date
-        to be specified. Otherwise returns an empty dict
+        Get sun times from the offline solar ephemeris. Requires latitude,
+        longitude, and date to be specified. Otherwise returns an empty dict
         """
         try:
-            suntime_response = requests.get(
-                'https://api.sunrise-sunset.org/json',
-                params={
-                    'lat': self.latitude,
-                    'lng': self.longitude,
-                    'date': datetime.datetime.strftime(
-                        self.get_date(), '%Y-%m-%d'
-                    ),
-                    'formatted': 0,
-                }
-            ).json()
-            return_value = {
-                'sunrise': datetime.datetime.strptime(
-                    suntime_response['results']['sunrise'],
-                    '%Y-%m-%dT%H:%M:%S+00:00'
-                ).replace(tzinfo=pytz.utc),
-                'sunset':  datetime.datetime.strptime(
-                    suntime_response['results']['sunset'],
-                    '%Y-%m-%dT%H:%M:%S+00:00'
-                ).replace(tzinfo=pytz.utc),
-            }
-        except KeyError:
+            return_value = solar.get_suntimes(
+                self.latitude,
+                self.longitude,
+                self.get_date()
+            )
+        except (TypeError, ValueError):
             return_value = {}
 
         return return_value
 
-    def set_suntimes(self):
+    def get_celestial_times(self, force=False):
         """
-        Set sun times in local timezone
+        Returns a dictionary with a local time (or None) for each of the
+        CELESTIAL_FIELDS. Times are shared with nearby locations through
+        the celestial cache and only computed on a cache miss, or always
+        if force is True. Raises LookupError if the timezone of the
+        location can not be determined.
         """
-        local_timezone = pytz.timezone(
-            self.get_timezone()['timeZoneId']
+        return CelestialTimes.objects.get_times(
+            self.latitude,
+            self.longitude,
+            self.get_date(),
+            compute=self.compute_celestial_times,
+            force=force
         )
 
-        suntimes = self.get_suntimes_in_utc()
-        self.sunrise = suntimes['sunrise'].astimezone(
-            local_timezone
-        ).strftime('%H:%M:%S %Z%z')
-        self.sunset = suntimes['sunset'].astimezone(
-            local_timezone
-        ).strftime('%H:%M:%S %Z%z')
+    def get_cached_celestial_times(self):
+        """
+        Returns the celestial times of the location if they are cached,
+        otherwise None. Never computes the times.
+        """
+        try:
+            date = self.get_date()
+        except ValueError:
+            return None
+        return CelestialTimes.objects.get_cached(
+            self.latitude, self.longitude, date)
+
+    def compute_celestial_times(self):
+        """
+        Computes the value returned by get_celestial_times() without using
+        the cache. The timezone and the sun times are looked up
+        concurrently, so this takes as long as the slower of the two.
+        If the sun times can't be computed, a celestial.PartialTimes with
+        every field None is returned.
+        """
+        timezone_result, suntimes = celestial.run_concurrently(
+            self.get_timezone,
+            self.get_suntimes_in_utc
+        )
+        timezone_id = (timezone_result or {}).get('timeZoneId')
+        if not timezone_id:
+            raise LookupError(
+                'No timezone for %s, %s' % (self.latitude, self.longitude))
+        local_timezone = pytz.timezone(timezone_id)
+
+        if not suntimes:
+            return celestial.PartialTimes(
+                (field, None) for field in self.CELESTIAL_FIELDS)
+        celestial_times = {}
+        for field in self.CELESTIAL_FIELDS:
+            if suntimes.get(field):
+                celestial_times[field] = suntimes[field].astimezone(
+                    local_timezone
+                ).time()
+            else:
+                celestial_times[field] = None
+        return celestial_times
+
+    def set_suntimes(self):
+        """
+        Set sun times in local timezone. Sun times are cleared if the
+        timezone of the location can not be determined, and left empty if
+        they can't be computed.
+        """
+        try:
+            celestial_times = self.get_celestial_times()
+        except (LookupError, ValueError):
+            self.clear_suntimes()
+            return
+
+        for field, value in celestial_times.items():
+            setattr(self, field, value)
 
     def clear_suntimes(self):
         """
         Clear sun time values. To be used if a location is edited to no
         longer include lat/long/date
         """
-        self.sunrise = None
-        self.sunset = None
+        for field in self.CELESTIAL_FIELDS:
+            setattr(self, field, None)
 
-    def save(self, *args, **kwargs):
+    def has_celestial_inputs(self):
         """
-        Set sun times for a location with specified coordinates and date
+        Sun times can only be computed for a location with coordinates and
+        an assigned date
         """
-        if self.latitude and self.longitude and self.date and self.date != 'Unassigned':
-            self.set_suntimes()
-        else:
+        return bool(self.latitude and self.longitude and
+            self.date is not None)
+
+    def get_celestial_inputs(self):
+        """
+        Returns the values of the CELESTIAL_INPUT_FIELDS. A deferred field
+        is not loaded; DEFERRED is returned in its place.
+        """
+        return tuple(self.__dict__.get(field, DEFERRED)
+            for field in self.CELESTIAL_INPUT_FIELDS)
+
+    def celestial_inputs_changed(self):
+        """
+        True unless the location was loaded from the database and none of
+        its celestial inputs changed since it was loaded or last saved
+        """
+        loaded = getattr(self, '_loaded_celestial_inputs', None)
+        if loaded is None or DEFERRED in loaded:
+            return True
+        return loaded != tuple(getattr(self, field)
+            for field in self.CELESTIAL_INPUT_FIELDS)
+
+    def get_celestial_payload(self, force=False):
+        """
+        Returns the payload of the job that computes the sun times of this
+        location. Locations with equal payloads share the same job.
+        """
+        payload = {
+            'latitude': '%.6f' % self.latitude,
+            'longitude': '%.6f' % self.longitude,
+            'date': self.date.isoformat(),
+        }
+        if force:
+            payload['force'] = True
+        return payload
+
+    def schedule_suntimes(self, force=False):
+        """
+        Queue a job to compute the sun times once the current transaction
+        commits. Identical (latitude, longitude, date) jobs are merged.
+        A forced job recomputes the times even if they are cached.
+        """
+        payload = self.get_celestial_payload(force)
+        dedup_key = 'celestial:%(latitude)s:%(longitude)s:%(date)s' % payload
+        if force:
+            dedup_key += ':force'
+        transaction.on_commit(lambda: Job.objects.enqueue(
+            'trips.compute_celestial_times',
+            payload,
+            dedup_key=dedup_key
+        ))
+
+    def save(self, *args, force_celestial=False, **kwargs):
+        """
+        Sun times for a location with specified coordinates and date are
+        copied from the celestial cache, or computed in the background by
+        the task queue if they are not cached yet, and empty until then.
+        They are only looked up when the coordinates, date or trip changed
+        since the location was loaded. force_celestial=True recomputes them
+        in the background even if nothing changed and they are cached.
+        """
+        schedule_suntimes = False
+        if not self.has_celestial_inputs():
             self.clear_suntimes()
+        elif force_celestial:
+            schedule_suntimes = True
+        elif self.celestial_inputs_changed():
+            celestial_times = self.get_cached_celestial_times()
+            if celestial_times is None:
+                # The times of the old inputs must not be shown until the
+                # job has computed the new ones
+                self.clear_suntimes()
+                schedule_suntimes = True
+            else:
+                for field, value in celestial_times.items():
+                    setattr(self, field, value)
         super(TripLocation, self).save(*args, **kwargs)
+        self._loaded_celestial_inputs = self.get_celestial_inputs()
+        if schedule_suntimes:
+            self.schedule_suntimes(force_celestial)
+
+class CelestialTimesManager(models.Manager):
+    def get_expiry_cutoff(self):
+        """
+        Entries last updated before this time have expired
+        """
+        return timezone.now() - datetime.timedelta(
+            seconds=settings.CELESTIAL_CACHE_TTL)
+
+    def get_fresh(self):
+        return self.filter(updated__gt=self.get_expiry_cutoff())
+
+    def purge_expired(self):
+        """
+        Deletes expired entries and returns the number deleted
+        """
+        return self.filter(
+            updated__lte=self.get_expiry_cutoff()).delete()[0]
+
+    def get_cached(self, latitude, longitude, date):
+        """
+        Returns the cached celestial times of a (latitude, longitude, date)
+        from the in-process cache or the database, or None on a miss
+        """
+        key = celestial.make_key(latitude, longitude, date)
+        celestial_times = celestial.cache.get(key)
+        if celestial_times is not None:
+            celestial.stats['memory_hits'] += 1
+            return celestial_times
+
+        entry = self.get_fresh().filter(
+            latitude=key[0],
+            longitude=key[1],
+            date=date
+        ).first()
+        if entry is None:
+            return None
+        celestial.stats['database_hits'] += 1
+        celestial_times = entry.get_celestial_times()
+        celestial.cache.set(key, celestial_times, entry.get_expiry())
+        return celestial_times
+
+    def get_times(self, latitude, longitude, date, compute, force=False):
+        """
+        Returns the cached celestial times of a (latitude, longitude, date).
+        On a miss, or if force is True, compute() is called and its result
+        is cached.
+        """
+        if not force:
+            celestial_times = self.get_cached(latitude, longitude, date)
+            if celestial_times is not None:
+                return celestial_times
+
+        celestial.stats['misses'] += 1
+        celestial_times = compute()
+        if isinstance(celestial_times, celestial.PartialTimes):
+            celestial.stats['partial'] += 1
+            return celestial_times
+        self.store(latitude, longitude, date, celestial_times)
+        return celestial_times
+
+    def store(self, latitude, longitude, date, celestial_times):
+        """
+        Caches the computed celestial times of a (latitude, longitude, date)
+        """
+        key = celestial.make_key(latitude, longitude, date)
+        entry, created = self.update_or_create(
+            latitude=key[0],
+            longitude=key[1],
+            date=date,
+            defaults=celestial_times
+        )
+        celestial.cache.set(key, celestial_times, entry.get_expiry())
+
+class CelestialTimes(models.Model):
+    """
+    Cached local celestial times for coordinates rounded to
+    settings.CELESTIAL_CACHE_PRECISION decimal places. See trips.celestial.
+    """
+    latitude = models.DecimalField(max_digits=8, decimal_places=6)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    date = models.DateField()
+    dawn = models.TimeField(blank=True, null=True)
+    sunrise = models.TimeField(blank=True, null=True)
+    sunset = models.TimeField(blank=True, null=True)
+    dusk = models.TimeField(blank=True, null=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = CelestialTimesManager()
+
+    class Meta:
+        unique_together = ('latitude', 'longitude', 'date')
+        verbose_name_plural = 'celestial times'
+
+    def __str__(self):
+        return '%s, %s on %s' % (self.latitude, self.longitude, self.date)
+
+    def get_celestial_times(self):
+        return {field: getattr(self, field)
+            for field in TripLocation.CELESTIAL_FIELDS}
+
+    def get_expiry(self):
+        return self.updated + datetime.timedelta(
+            seconds=settings.CELESTIAL_CACHE_TTL)
 
 class ItemNotification(models.Model):
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
@@ -319,3 +864,16 @@ class ItemNotification(models.Model):
         on_delete=models.CASCADE, related_name='owners')
     date_created = models.DateTimeField(auto_now_add=True)
     created_by = models.CharField(max_length = 255)
+
+class NotificationCount(models.Model):
+    """
+    Number of pending notifications of a user: trip invitations and gear
+    notifications. Kept up to date by trips.notifications.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE, primary_key=True)
+    count = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '%s: %d' % (self.user_id, self.count)
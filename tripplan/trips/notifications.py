@@ -0,0 +1,94 @@
+"""
+Number of pending notifications of each user, shown in the header of every
+page.
+
+The count is stored per user in NotificationCount and in the cache, so the
+header reads it from the cache, or with one query on a miss. It is updated
+whenever a TripMember or ItemNotification of the user changes, see
+trips.signals. Code that changes them without sending signals, e.g. with
+bulk_create(), calls update() itself.
+"""
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+
+from .models import ItemNotification, NotificationCount, TripMember
+
+
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_cache_key(user_id):
+    return 'notification_count:%s' % user_id
+
+
+def count_notifications(user_ids):
+    """
+    Returns a dict of the number of pending notifications of each user,
+    counted with one query per kind of notification
+    """
+    counts = dict.fromkeys(user_ids, 0)
+    for user_id, count in TripMember.objects.filter(
+            member_id__in=user_ids, accept_reqd=True).order_by().values_list(
+            'member_id').annotate(Count('pk')):
+        counts[user_id] += count
+    for user_id, count in ItemNotification.objects.filter(
+            owner_id__in=user_ids).order_by().values_list(
+            'owner_id').annotate(Count('pk')):
+        counts[user_id] += count
+    return counts
+
+
+def save_counts(user_ids):
+    """
+    Counts the notifications of the users and stores the counts in their
+    NotificationCount. It is created by get_count(), so none is created
+    here for a user being deleted. Returns the counts.
+    """
+    counts = count_notifications(set(user_ids))
+    for user_id, count in counts.items():
+        NotificationCount.objects.filter(user_id=user_id).update(count=count)
+    return counts
+
+
+def cache_counts(counts):
+    for user_id, count in counts.items():
+        cache.set(get_cache_key(user_id), count, CACHE_TIMEOUT)
+
+
+def update(user_ids):
+    """
+    Updates the counts of the users. Until the transaction commits only
+    their NotificationCounts are updated, which are rolled back with it,
+    and their cached counts are deleted. They are counted again and cached
+    when it commits, so concurrent changes are counted too, and a count
+    of changes that are rolled back is never cached.
+    """
+    user_ids = set(user_id for user_id in user_ids if user_id is not None)
+    if not user_ids:
+        return
+    save_counts(user_ids)
+    cache.delete_many([get_cache_key(user_id) for user_id in user_ids])
+    transaction.on_commit(lambda: cache_counts(save_counts(user_ids)))
+
+
+def get_count(user_id):
+    """
+    Returns the number of pending notifications of a user
+    """
+    key = get_cache_key(user_id)
+    count = cache.get(key)
+    if count is None:
+        try:
+            count = NotificationCount.objects.get(user_id=user_id).count
+        except NotificationCount.DoesNotExist:
+            count = count_notifications([user_id])[user_id]
+            try:
+                with transaction.atomic():
+                    NotificationCount.objects.create(user_id=user_id,
+                        count=count)
+            except IntegrityError:
+                # Created by a concurrent request
+                pass
+        cache.set(key, count, CACHE_TIMEOUT)
+    return count
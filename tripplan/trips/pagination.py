@@ -0,0 +1,52 @@
+"""
+Keyset (cursor) pagination of trips by start date.
+
+Django's Paginator counts all rows and skips to an OFFSET, which reads every
+skipped row again. A keyset page instead starts after the (start_date, pk)
+of the last trip of the previous page, given as a cursor, so each page is
+one query of at most page_size + 1 rows however many trips there are.
+"""
+import collections
+import datetime
+
+from django.db.models import Q
+
+
+KeysetPage = collections.namedtuple('KeysetPage',
+    ['object_list', 'next_cursor'])
+
+
+def make_cursor(trip):
+    return '%s.%d' % (trip.start_date.isoformat(), trip.pk)
+
+
+def parse_cursor(cursor):
+    """
+    Returns the (start_date, pk) of a cursor. Raises ValueError if it is
+    not valid.
+    """
+    date, pk = cursor.split('.')
+    return datetime.datetime.strptime(date, '%Y-%m-%d').date(), int(pk)
+
+
+def get_keyset_page(queryset, cursor=None, page_size=20, descending=False):
+    """
+    Returns the page of trips after the cursor, ordered by start date, and
+    the cursor of the next page, or None if this is the last page. Raises
+    ValueError if the cursor is not valid.
+    """
+    if descending:
+        queryset = queryset.order_by('-start_date', '-pk')
+    else:
+        queryset = queryset.order_by('start_date', 'pk')
+    if cursor:
+        start_date, pk = parse_cursor(cursor)
+        lookup = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{'start_date__' + lookup: start_date}) |
+            Q(start_date=start_date, **{'pk__' + lookup: pk}))
+
+    trips = list(queryset[:page_size + 1])
+    if len(trips) > page_size:
+        return KeysetPage(trips[:page_size], make_cursor(trips[page_size - 1]))
+    return KeysetPage(trips, None)
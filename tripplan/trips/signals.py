@@ -0,0 +1,63 @@
+"""
+Invalidates the cached fragments of a trip whenever data rendered in them
+changes, see trips.fragments, and updates the notification counts of users
+whose notifications change, see trips.notifications
+"""
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+
+from . import fragments, notifications
+from .models import Item, ItemNotification, ItemOwner, Trip, TripLocation, \
+    TripMember
+
+
+def get_member_trip_ids(user_id):
+    return TripMember.objects.filter(member_id=user_id).values_list(
+        'trip_id', flat=True)
+
+
+def trip_changed(sender, instance, **kwargs):
+    fragments.invalidate([instance.pk])
+
+
+def trip_data_changed(sender, instance, **kwargs):
+    fragments.invalidate([instance.trip_id])
+
+
+def item_owner_changed(sender, instance, **kwargs):
+    fragments.invalidate(Item.objects.filter(
+        pk=instance.item_id).values_list('trip_id', flat=True))
+
+
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # Logging in only updates last_login, which is not rendered
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    fragments.invalidate(get_member_trip_ids(instance.pk))
+
+
+def emergency_contact_changed(sender, instance, **kwargs):
+    fragments.invalidate(get_member_trip_ids(instance.user_id))
+
+
+def member_notifications_changed(sender, instance, **kwargs):
+    notifications.update([instance.member_id])
+
+
+def owner_notifications_changed(sender, instance, **kwargs):
+    notifications.update([instance.owner_id])
+
+
+def connect():
+    for signal in (post_save, post_delete):
+        signal.connect(trip_changed, sender=Trip)
+        for model in (TripLocation, TripMember, Item):
+            signal.connect(trip_data_changed, sender=model)
+        signal.connect(item_owner_changed, sender=ItemOwner)
+        # Members and their emergency contacts are shown on the
+        # emergency info page and the gear grid
+        signal.connect(user_changed, sender=settings.AUTH_USER_MODEL)
+        signal.connect(emergency_contact_changed,
+            sender='account_info.EmergencyContact')
+        signal.connect(member_notifications_changed, sender=TripMember)
+        signal.connect(owner_notifications_changed, sender=ItemNotification)
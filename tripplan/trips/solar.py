@@ -0,0 +1,162 @@
+"""
+Offline solar ephemeris used for the celestial times of a TripLocation.
+
+The calculations follow the NOAA solar calculator
+(https://www.esrl.noaa.gov/gmd/grad/solcalc/calcdetails.html) and are
+accurate to about a minute between +/- 72 degrees of latitude. All results
+are timezone-aware datetimes in UTC.
+
+The position of the sun only depends on the time, not on the observer, so
+get_suntimes_many() computes the initial solar terms once per distinct date
+and reuses them for every location on that date.
+"""
+import datetime
+import math
+
+import pytz
+
+
+# Zenith angles (degrees) of the events returned by get_suntimes().
+# Sunrise/sunset account for atmospheric refraction and the solar disc.
+ZENITH = {
+    'dawn': 96.0,
+    'sunrise': 90.833,
+    'sunset': 90.833,
+    'dusk': 96.0,
+}
+
+# Events before solar noon use the negative hour angle
+MORNING_EVENTS = ('dawn', 'sunrise')
+
+UNIX_EPOCH_JULIAN_DAY = 2440587.5
+J2000_JULIAN_DAY = 2451545.0
+
+
+def julian_day(date, minutes=0.0):
+    """
+    Returns the Julian day for a date plus a number of minutes after
+    midnight UTC.
+    """
+    days = (date - datetime.date(1970, 1, 1)).days
+    return UNIX_EPOCH_JULIAN_DAY + days + minutes / 1440.0
+
+
+def solar_terms(jd):
+    """
+    Returns a tuple (declination, equation_of_time) for a Julian day.
+    Declination is in degrees, the equation of time is in minutes.
+    """
+    jc = (jd - J2000_JULIAN_DAY) / 36525.0
+
+    mean_long = (280.46646 + jc * (36000.76983 + jc * 0.0003032)) % 360
+    mean_anom = 357.52911 + jc * (35999.05029 - 0.0001537 * jc)
+    eccent = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+
+    anom_rad = math.radians(mean_anom)
+    eq_of_ctr = (
+        math.sin(anom_rad) * (1.914602 - jc * (0.004817 + 0.000014 * jc)) +
+        math.sin(2 * anom_rad) * (0.019993 - 0.000101 * jc) +
+        math.sin(3 * anom_rad) * 0.000289
+    )
+    omega = math.radians(125.04 - 1934.136 * jc)
+    app_long = mean_long + eq_of_ctr - 0.00569 - 0.00478 * math.sin(omega)
+
+    mean_obliq = 23 + (26 + (21.448 - jc * (
+        46.815 + jc * (0.00059 - jc * 0.001813))) / 60) / 60
+    obliq = math.radians(mean_obliq + 0.00256 * math.cos(omega))
+
+    declination = math.degrees(math.asin(
+        math.sin(obliq) * math.sin(math.radians(app_long))))
+
+    y = math.tan(obliq / 2) ** 2
+    long_rad = math.radians(mean_long)
+    equation_of_time = 4 * math.degrees(
+        y * math.sin(2 * long_rad) -
+        2 * eccent * math.sin(anom_rad) +
+        4 * eccent * y * math.sin(anom_rad) * math.cos(2 * long_rad) -
+        0.5 * y * y * math.sin(4 * long_rad) -
+        1.25 * eccent * eccent * math.sin(2 * anom_rad)
+    )
+    return declination, equation_of_time
+
+
+def hour_angle(latitude, declination, zenith):
+    """
+    Returns the hour angle (degrees) at which the sun reaches the zenith
+    angle, or None if it never does on that day (polar day or night).
+    """
+    lat_rad = math.radians(latitude)
+    decl_rad = math.radians(declination)
+    cos_ha = (
+        math.cos(math.radians(zenith)) /
+        (math.cos(lat_rad) * math.cos(decl_rad)) -
+        math.tan(lat_rad) * math.tan(decl_rad)
+    )
+    if cos_ha < -1 or cos_ha > 1:
+        return None
+    return math.degrees(math.acos(cos_ha))
+
+
+def event_minutes(latitude, longitude, date, event, terms=None):
+    """
+    Returns the time of an event in minutes after midnight UTC of the
+    given date, or None if the event does not occur. The value may be
+    negative or exceed 1440 for locations far from the prime meridian.
+
+    The solar terms are first taken at local solar noon and then refined
+    once at the approximate time of the event.
+    """
+    if terms is None:
+        terms = solar_terms(julian_day(date, 720 - 4 * longitude))
+    sign = -1 if event in MORNING_EVENTS else 1
+    minutes = None
+    for iteration in range(2):
+        if iteration:
+            terms = solar_terms(julian_day(date, minutes))
+        declination, equation_of_time = terms
+        ha = hour_angle(latitude, declination, ZENITH[event])
+        if ha is None:
+            return None
+        minutes = 720 - 4 * (longitude - sign * ha) - equation_of_time
+    return minutes
+
+
+def _minutes_to_datetime(date, minutes):
+    if minutes is None:
+        return None
+    midnight = datetime.datetime.combine(date, datetime.time()).replace(
+        tzinfo=pytz.utc)
+    return midnight + datetime.timedelta(seconds=round(minutes * 60))
+
+
+def get_suntimes(latitude, longitude, date, terms=None):
+    """
+    Returns a dictionary with the dawn, sunrise, sunset, and dusk times
+    for a location and date as UTC datetimes. Events that do not occur
+    on that day (e.g. above the arctic circle) are None.
+    """
+    latitude = float(latitude)
+    longitude = float(longitude)
+    return {
+        event: _minutes_to_datetime(
+            date, event_minutes(latitude, longitude, date, event, terms))
+        for event in ZENITH
+    }
+
+
+def get_suntimes_many(locations):
+    """
+    Input an iterable of (latitude, longitude, date) tuples. Output a list
+    of get_suntimes() dictionaries in the same order.
+
+    The initial solar terms at noon UTC are shared between all locations
+    on the same date instead of being computed per location.
+    """
+    noon_terms = {}
+    results = []
+    for latitude, longitude, date in locations:
+        if date not in noon_terms:
+            noon_terms[date] = solar_terms(julian_day(date, 720))
+        results.append(
+            get_suntimes(latitude, longitude, date, noon_terms[date]))
+    return results
@@ -0,0 +1,42 @@
+import datetime
+
+from taskqueue.registry import task
+
+from . import fragments
+from .models import TripLocation
+
+
+@task('trips.compute_celestial_times')
+def compute_celestial_times(latitude, longitude, date, force=False):
+    """
+    Compute the sun times for a (latitude, longitude, date) and store them
+    on every location with those values. Raises LookupError, which makes
+    the job retry, if the timezone can not be determined yet. If force is
+    True, cached times are recomputed.
+    """
+    # Jobs queued before locations had a DateField carry the date as
+    # "Day X - YYYY-MM-DD"
+    date = datetime.datetime.strptime(
+        date.split(' - ')[-1], '%Y-%m-%d').date()
+    location = TripLocation(latitude=latitude, longitude=longitude, date=date)
+    celestial_times = location.get_celestial_times(force=force)
+    locations = TripLocation.objects.filter(
+        latitude=latitude,
+        longitude=longitude,
+        date=date
+    )
+    # update() sends no signals
+    fragments.invalidate(set(locations.values_list('trip_id', flat=True)))
+    locations.update(**celestial_times)
+
+
+@task('trips.compute_celestial_times_batch')
+def compute_celestial_times_batch(inputs):
+    """
+    Compute the sun times for a list of compute_celestial_times payloads,
+    e.g. those of the locations of a copied trip. If one of them raises
+    LookupError the job is retried, and the times computed before it are
+    then read from the cache.
+    """
+    for payload in inputs:
+        compute_celestial_times(**payload)
@@ -0,0 +1,49 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from trips import fragments
+
+register = template.Library()
+
+
+class TripFragmentNode(template.Node):
+    def __init__(self, nodelist, name, trip_id, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.trip_id = trip_id
+        self.vary_on = vary_on
+
+    def render(self, context):
+        return mark_safe(fragments.get_or_render(
+            self.trip_id.resolve(context),
+            self.name.resolve(context),
+            lambda: self.nodelist.render(context),
+            [value.resolve(context) for value in self.vary_on]
+        ))
+
+
+@register.tag('tripfragment')
+def do_tripfragment(parser, token):
+    """
+    Caches the enclosed part of a template until the trip changes, see
+    trips.fragments. Other variables the part depends on follow the trip.
+
+    Usage:
+        {% load trip_fragments %}
+        {% tripfragment 'gear' trip.id pdf %}
+            {% include "trips/partials/gear_content.html" %}
+        {% endtripfragment %}
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(
+            "'%s' takes at least two arguments, the fragment name and the "
+            "trip id" % bits[0])
+    nodelist = parser.parse(('endtripfragment',))
+    parser.delete_first_token()
+    return TripFragmentNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        parser.compile_filter(bits[2]),
+        [parser.compile_filter(bit) for bit in bits[3:]]
+    )
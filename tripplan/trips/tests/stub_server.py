@@ -0,0 +1,76 @@
+"""
+Local HTTP server standing in for external APIs in tests
+"""
+import json
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super(StubHandler, self).setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        self.server.requests.append(
+            (url.path, {k: v[0] for k, v in parse_qs(url.query).items()}))
+        status, body, delay = self.server.routes.get(
+            url.path, (404, {}, 0))
+        if delay:
+            time.sleep(delay)
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    Serves canned JSON responses on localhost. Use as a context manager:
+
+        with StubServer() as server:
+            server.add_route('/path', {'key': 'value'})
+            requests.get(server.url + '/path')
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super(StubServer, self).__init__(('127.0.0.1', 0), StubHandler)
+        self.routes = {}
+        self.requests = []
+        self.connections = 0
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def handle_error(self, request, client_address):
+        # Clients that time out close the connection before the response
+        # is written
+        pass
+
+    def add_route(self, path, body, status=200, delay=0):
+        self.routes[path] = (status, body, delay)
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
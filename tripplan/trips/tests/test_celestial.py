@@ -0,0 +1,415 @@
+import datetime
+from decimal import Decimal
+from io import StringIO
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from taskqueue.models import Job
+from trips import celestial, fragments
+from trips.management.commands.backfill_celestial_times import Command, \
+    compute_times
+from trips.models import CelestialTimes, Trip, TripLocation
+
+
+TIMES = {
+    'dawn': datetime.time(7, 19),
+    'sunrise': datetime.time(7, 49),
+    'sunset': datetime.time(17, 9),
+    'dusk': datetime.time(17, 39),
+}
+
+
+def fake_timezone(self):
+    return {'timeZoneId': 'America/Denver'}
+
+
+class LRUCacheTests(TestCase):
+    def setUp(self):
+        self.cache = celestial.LRUCache()
+        self.expires = timezone.now() + datetime.timedelta(hours=1)
+
+    def test_get_missing_key_returns_none(self):
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_get_returns_value(self):
+        self.cache.set('key', 'value', self.expires)
+        self.assertEqual(self.cache.get('key'), 'value')
+
+    def test_get_expired_key_returns_none(self):
+        self.cache.set('key', 'value',
+            timezone.now() - datetime.timedelta(seconds=1))
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(len(self.cache), 0)
+
+    @override_settings(CELESTIAL_CACHE_SIZE=2)
+    def test_least_recently_used_key_is_evicted(self):
+        self.cache.set('a', 1, self.expires)
+        self.cache.set('b', 2, self.expires)
+        self.cache.get('a')
+        self.cache.set('c', 3, self.expires)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('c'), 3)
+
+
+class RoundCoordinateTests(TestCase):
+    @override_settings(CELESTIAL_CACHE_PRECISION=3)
+    def test_round_coordinate(self):
+        self.assertEqual(celestial.round_coordinate(40.6465),
+            Decimal('40.647'))
+        self.assertEqual(celestial.round_coordinate(Decimal('-111.497973')),
+            Decimal('-111.498'))
+
+    @override_settings(CELESTIAL_CACHE_PRECISION=1)
+    def test_make_key_uses_precision(self):
+        self.assertEqual(
+            celestial.make_key(40.646062, -111.497973, None),
+            (Decimal('40.6'), Decimal('-111.5'), None)
+        )
+
+
+class CelestialTimesManagerTests(TestCase):
+    def setUp(self):
+        celestial.reset()
+        self.date = datetime.date(2018, 1, 1)
+        self.compute = mock.Mock(return_value=TIMES)
+
+    def get_times(self, latitude=40.646062, longitude=-111.497973):
+        return CelestialTimes.objects.get_times(
+            latitude, longitude, self.date, compute=self.compute)
+
+    def test_miss_computes_and_stores_times(self):
+        self.assertEqual(self.get_times(), TIMES)
+        self.assertEqual(self.compute.call_count, 1)
+        entry = CelestialTimes.objects.get()
+        self.assertEqual(entry.latitude, Decimal('40.646'))
+        self.assertEqual(entry.longitude, Decimal('-111.498'))
+        self.assertEqual(entry.sunrise, TIMES['sunrise'])
+        self.assertEqual(celestial.get_stats()['misses'], 1)
+
+    def test_repeat_lookup_hits_memory(self):
+        self.get_times()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_times(), TIMES)
+        self.assertEqual(self.compute.call_count, 1)
+        self.assertEqual(celestial.get_stats()['memory_hits'], 1)
+
+    def test_lookup_in_new_process_hits_database(self):
+        self.get_times()
+        celestial.cache.clear()
+        self.assertEqual(self.get_times(), TIMES)
+        self.assertEqual(self.compute.call_count, 1)
+        self.assertEqual(celestial.get_stats()['database_hits'], 1)
+
+    def test_nearby_locations_share_entry(self):
+        self.get_times()
+        self.get_times(latitude=40.6459, longitude=-111.4984)
+        self.assertEqual(self.compute.call_count, 1)
+        self.assertEqual(CelestialTimes.objects.count(), 1)
+
+    def test_other_date_is_a_miss(self):
+        self.get_times()
+        self.date = datetime.date(2018, 1, 2)
+        self.get_times()
+        self.assertEqual(self.compute.call_count, 2)
+
+    def test_expired_entry_is_recomputed(self):
+        self.get_times()
+        celestial.cache.clear()
+        with override_settings(CELESTIAL_CACHE_TTL=0):
+            self.get_times()
+        self.assertEqual(self.compute.call_count, 2)
+        self.assertEqual(CelestialTimes.objects.count(), 1)
+
+    def test_failed_computation_is_not_cached(self):
+        self.compute.side_effect = LookupError
+        self.assertRaises(LookupError, self.get_times)
+        self.assertEqual(CelestialTimes.objects.count(), 0)
+
+    def test_purge_expired(self):
+        self.get_times()
+        self.assertEqual(CelestialTimes.objects.purge_expired(), 0)
+        with override_settings(CELESTIAL_CACHE_TTL=0):
+            self.assertEqual(CelestialTimes.objects.purge_expired(), 1)
+        self.assertEqual(CelestialTimes.objects.count(), 0)
+
+    def test_hit_rate(self):
+        self.get_times()
+        self.get_times()
+        self.get_times()
+        self.get_times()
+        self.assertEqual(celestial.get_stats()['hit_rate'], 0.75)
+
+
+@mock.patch.object(TripLocation, 'get_timezone', fake_timezone)
+class TripLocationCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+
+    def setUp(self):
+        celestial.reset()
+
+    def create_location(self):
+        return TripLocation.objects.create(
+            date=datetime.date(2018, 1, 1),
+            trip=self.trip,
+            location_type=TripLocation.BEGIN,
+            latitude=40.646062,
+            longitude=-111.497973
+        )
+
+    def test_save_of_cached_location_copies_times_without_job(self):
+        CelestialTimes.objects.get_times(40.646062, -111.497973,
+            datetime.date(2018, 1, 1), compute=lambda: TIMES)
+        with mock.patch('trips.models.httpclient.get') as requests_get:
+            location = self.create_location()
+        self.assertFalse(requests_get.called)
+        self.assertEqual(location.sunrise, TIMES['sunrise'])
+        self.assertEqual(Job.objects.count(), 0)
+
+    def test_get_celestial_times_is_computed_once(self):
+        location = self.create_location()
+        with mock.patch.object(TripLocation, 'compute_celestial_times',
+                autospec=True, return_value=TIMES) as compute:
+            location.get_celestial_times()
+            location.get_celestial_times()
+        self.assertEqual(compute.call_count, 1)
+
+
+def slow_timezone(self):
+    time.sleep(0.3)
+    return {'timeZoneId': 'America/Denver'}
+
+
+def slow_suntimes(self):
+    time.sleep(0.3)
+    return {field: None for field in TripLocation.CELESTIAL_FIELDS}
+
+
+def failing_lookup(self):
+    raise RuntimeError('Lookup failed')
+
+
+class ConcurrentLookupTests(TestCase):
+    def setUp(self):
+        celestial.reset()
+        self.location = TripLocation(
+            date=datetime.date(2018, 1, 1),
+            location_type=TripLocation.BEGIN,
+            latitude=40.646062,
+            longitude=-111.497973
+        )
+
+    def test_run_concurrently_returns_none_for_failures(self):
+        def fail():
+            raise RuntimeError('Lookup failed')
+        self.assertEqual(celestial.run_concurrently(lambda: 1, fail),
+            [1, None])
+
+    @mock.patch.object(TripLocation, 'get_timezone', slow_timezone)
+    @mock.patch.object(TripLocation, 'get_suntimes_in_utc', slow_suntimes)
+    def test_lookups_run_concurrently(self):
+        start = time.monotonic()
+        self.location.compute_celestial_times()
+        self.assertLess(time.monotonic() - start, 0.55)
+
+    @mock.patch.object(TripLocation, 'get_timezone', slow_timezone)
+    @override_settings(CELESTIAL_LOOKUP_TIMEOUT=0.1)
+    def test_timezone_lookup_timeout_raises_lookup_error(self):
+        start = time.monotonic()
+        self.assertRaises(LookupError, self.location.compute_celestial_times)
+        self.assertLess(time.monotonic() - start, 0.25)
+
+    @mock.patch.object(TripLocation, 'get_timezone', failing_lookup)
+    def test_timezone_lookup_failure_raises_lookup_error(self):
+        self.assertRaises(LookupError, self.location.compute_celestial_times)
+
+    @mock.patch.object(TripLocation, 'get_timezone', fake_timezone)
+    @mock.patch.object(TripLocation, 'get_suntimes_in_utc', failing_lookup)
+    def test_suntimes_failure_gives_partial_times(self):
+        celestial_times = self.location.compute_celestial_times()
+        self.assertIsInstance(celestial_times, celestial.PartialTimes)
+        self.assertEqual(celestial_times,
+            {field: None for field in TripLocation.CELESTIAL_FIELDS})
+
+    @mock.patch.object(TripLocation, 'get_timezone', fake_timezone)
+    @mock.patch.object(TripLocation, 'get_suntimes_in_utc', failing_lookup)
+    def test_partial_times_are_stored_but_not_cached(self):
+        self.location.sunrise = datetime.time(7, 0)
+        self.location.set_suntimes()
+        self.assertIsNone(self.location.sunrise)
+        self.assertEqual(CelestialTimes.objects.count(), 0)
+        self.assertEqual(celestial.get_stats()['partial'], 1)
+
+
+@mock.patch.object(TripLocation, 'get_timezone', fake_timezone)
+class WarmCelestialCacheCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+        for latitude, longitude in ((40.646062, -111.497973),
+                (40.646100, -111.498000), (39.0, -105.0)):
+            TripLocation.objects.create(
+                trip=trip,
+                location_type=TripLocation.BEGIN,
+                latitude=latitude,
+                longitude=longitude
+            )
+
+    def setUp(self):
+        celestial.reset()
+
+    def test_warms_most_popular_trailheads(self):
+        out = StringIO()
+        call_command('warm_celestial_cache', trailheads=1, days=3,
+            start='2018-01-01', stdout=out)
+        entries = CelestialTimes.objects.order_by('date')
+        self.assertEqual(
+            [(e.latitude, e.longitude, e.date) for e in entries],
+            [(Decimal('40.646'), Decimal('-111.498'),
+                datetime.date(2018, 1, day)) for day in (1, 2, 3)]
+        )
+        self.assertIn('3 computed', out.getvalue())
+
+    def test_second_run_uses_cache(self):
+        call_command('warm_celestial_cache', days=2, stdout=StringIO())
+        out = StringIO()
+        call_command('warm_celestial_cache', days=2, stdout=out)
+        self.assertIn('0 computed, 4 already cached', out.getvalue())
+
+
+@mock.patch.object(TripLocation, 'get_timezone', fake_timezone)
+class BackfillCelestialTimesCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+        cls.locations = TripLocation.objects.bulk_create(
+            TripLocation(
+                trip=trip,
+                location_type=TripLocation.BEGIN,
+                latitude=40.646062,
+                longitude=-111.497973,
+                date=datetime.date(2018, 1, day)
+            )
+            for day in (1, 1, 2)
+        )
+        cls.locations = list(TripLocation.objects.order_by('pk'))
+
+    def setUp(self):
+        celestial.reset()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = os.path.join(directory.name, 'checkpoint.json')
+
+    def backfill(self, **options):
+        options.setdefault('processes', 1)
+        out = StringIO()
+        call_command('backfill_celestial_times',
+            checkpoint=self.checkpoint, stdout=out, **options)
+        return out.getvalue()
+
+    def get_sunrises(self):
+        return list(TripLocation.objects.order_by('pk').values_list(
+            'sunrise', flat=True))
+
+    def test_fills_missing_times_once_per_inputs(self):
+        with mock.patch('trips.management.commands.backfill_celestial_times.'
+                'compute_times', wraps=compute_times) as compute:
+            out = self.backfill(chunk_size=2)
+        self.assertEqual(compute.call_count, 2)
+        self.assertTrue(all(sunrise is not None
+            for sunrise in self.get_sunrises()))
+        self.assertEqual(CelestialTimes.objects.count(), 2)
+        self.assertIn('Done: 3 locations updated, 0 failed.', out)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_skips_locations_with_times_unless_all(self):
+        TripLocation.objects.update(**TIMES)
+        self.backfill()
+        self.assertEqual(self.get_sunrises(), [TIMES['sunrise']] * 3)
+        self.backfill(all=True)
+        self.assertNotIn(TIMES['sunrise'], self.get_sunrises())
+
+    def test_corrects_times_that_differ_from_the_cache(self):
+        CelestialTimes.objects.store(40.646062, -111.497973,
+            datetime.date(2018, 1, 1), TIMES)
+        stale = dict(TIMES, sunrise=datetime.time(8, 0))
+        TripLocation.objects.update(**stale)
+        out = self.backfill()
+        self.assertEqual(self.get_sunrises(), [TIMES['sunrise']] * 2 +
+            [stale['sunrise']])
+        self.assertIn('Done: 2 locations updated, 0 failed.', out)
+
+    def test_locations_where_the_sun_does_not_set_are_settled(self):
+        polar = dict(TIMES, sunset=None, dusk=None)
+        with mock.patch('trips.management.commands.backfill_celestial_times.'
+                'compute_times', return_value=polar) as compute, \
+                mock.patch.object(fragments, 'invalidate') as invalidate:
+            self.assertIn('Done: 3 locations updated', self.backfill())
+            invalidate.reset_mock()
+            self.assertIn('Done: 0 locations updated, 0 failed.',
+                self.backfill())
+        self.assertEqual(compute.call_count, 2)
+        self.assertFalse(invalidate.call_args[0][0])
+        self.assertEqual(list(TripLocation.objects.values_list(
+            'sunset', flat=True)), [None] * 3)
+
+    def test_checkpoint_is_saved_every_checkpoint_every_locations(self):
+        saved = []
+        with mock.patch.object(Command, 'save_checkpoint',
+                lambda command, path, checkpoint: saved.append(
+                    checkpoint['last_pk'])):
+            self.backfill(chunk_size=1, checkpoint_every=2)
+        self.assertEqual(saved, [self.locations[1].pk])
+
+    def test_checkpoint_is_saved_when_interrupted(self):
+        backfill = Command.backfill
+        def interrupt(command, chunk, *args):
+            if chunk[0][0] == self.locations[2].pk:
+                raise KeyboardInterrupt
+            return backfill(command, chunk, *args)
+        with mock.patch.object(Command, 'backfill', interrupt), \
+                self.assertRaises(KeyboardInterrupt):
+            self.backfill(chunk_size=1)
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f), {'last_pk': self.locations[1].pk,
+                'read': 2, 'updated': 2, 'failed': 0})
+
+    def test_resumes_after_checkpoint(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'last_pk': self.locations[1].pk, 'updated': 2,
+                'failed': 0}, f)
+        out = self.backfill()
+        sunrises = self.get_sunrises()
+        self.assertEqual(sunrises[:2], [None, None])
+        self.assertIsNotNone(sunrises[2])
+        self.assertIn('Done: 3 locations updated, 0 failed.', out)
+
+    def test_restart_ignores_checkpoint(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'last_pk': self.locations[2].pk, 'updated': 3,
+                'failed': 0}, f)
+        self.backfill(restart=True)
+        self.assertNotIn(None, self.get_sunrises())
+
+    def test_failures_are_counted_and_left_empty(self):
+        with mock.patch.object(TripLocation, 'get_timezone',
+                lambda self: {}):
+            out = self.backfill()
+        self.assertEqual(self.get_sunrises(), [None] * 3)
+        self.assertIn('Done: 0 locations updated, 3 failed.', out)
+
+    def test_worker_processes(self):
+        self.backfill(processes=2)
+        self.assertNotIn(None, self.get_sunrises())
@@ -0,0 +1,217 @@
+import datetime
+from unittest import mock
+
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from account_info.models import User
+from taskqueue.models import Job
+from taskqueue.worker import run_pending
+from trips import celestial, notifications
+from trips.cloning import clone_trip
+from trips.models import CelestialTimes, Item, ItemOwner, Trip, TripGuest, \
+    TripLocation, TripMember
+
+
+class CloneTripTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organizer = User.objects.create_user(email='organizer@email.com',
+            password='ValidPassword')
+        cls.member = User.objects.create_user(email='member@email.com',
+            password='ValidPassword')
+        cls.trip = Trip.objects.create(title='Uintas',
+            start_date=datetime.date(2018, 7, 1), number_nights=2)
+        TripMember.objects.create(trip=cls.trip, member=cls.organizer,
+            organizer=True)
+        TripMember.objects.create(trip=cls.trip, member=cls.member)
+        TripGuest.objects.create(trip=cls.trip, email='guest@email.com')
+        TripLocation.objects.create(trip=cls.trip, title='Trailhead',
+            location_type=TripLocation.BEGIN, day_index=0,
+            date=datetime.date(2018, 7, 1))
+        TripLocation.objects.create(trip=cls.trip, title='Lake',
+            location_type=TripLocation.CAMP, day_index=1,
+            date=datetime.date(2018, 7, 2), latitude=40.646062,
+            longitude=-111.497973)
+        TripLocation.objects.create(trip=cls.trip, title='Someday',
+            location_type=TripLocation.OBJECTIVE)
+        for description in ('Stove', 'Tent'):
+            item = Item.objects.create(trip=cls.trip, description=description)
+            ItemOwner.objects.create(item=item, owner=cls.organizer,
+                quantity=2)
+            ItemOwner.objects.create(item=item, owner=cls.member)
+
+    def setUp(self):
+        cache.clear()
+        celestial.reset()
+        self.start_date = datetime.date(2019, 7, 1)
+
+    def clone(self, **kwargs):
+        with mock.patch.object(TripLocation, 'schedule_suntimes'):
+            return clone_trip(self.trip, self.start_date, self.organizer,
+                **kwargs)
+
+    def test_locations_are_redated(self):
+        clone = self.clone()
+        self.assertEqual(
+            list(clone.triplocation_set.order_by('pk').values_list(
+                'title', 'location_type', 'day_index', 'date')),
+            [('Trailhead', TripLocation.BEGIN, 0, datetime.date(2019, 7, 1)),
+                ('Lake', TripLocation.CAMP, 1, datetime.date(2019, 7, 2)),
+                ('Someday', TripLocation.OBJECTIVE, None, None)]
+        )
+        self.assertEqual((clone.title, clone.number_nights), ('Uintas', 2))
+        self.assertEqual(self.trip.triplocation_set.count(), 3)
+
+    def test_gear_is_copied_for_the_organizer_only(self):
+        clone = self.clone()
+        self.assertEqual(
+            list(ItemOwner.objects.filter(item__trip=clone).order_by(
+                'item__description').values_list(
+                    'item__description', 'owner', 'quantity')),
+            [('Stove', self.organizer.pk, 2), ('Tent', self.organizer.pk, 2)]
+        )
+        self.assertEqual(
+            list(clone.tripmember_set.values_list('member', 'organizer',
+                'accept_reqd')),
+            [(self.organizer.pk, True, False)]
+        )
+        self.assertFalse(clone.tripguest_set.exists())
+
+    def test_invite_members(self):
+        clone = self.clone(invite_members=True)
+        self.assertEqual(
+            set(clone.tripmember_set.values_list('member', 'accept_reqd')),
+            {(self.organizer.pk, False), (self.member.pk, True)}
+        )
+        self.assertEqual(
+            list(clone.tripguest_set.values_list('email', flat=True)),
+            ['guest@email.com'])
+        self.assertEqual(
+            ItemOwner.objects.filter(item__trip=clone,
+                owner=self.member).count(), 2)
+        self.assertEqual(notifications.get_count(self.member.pk), 1)
+
+    def test_sun_times_are_looked_up_in_batch(self):
+        CelestialTimes.objects.create(latitude=40.646, longitude=-111.498,
+            date=datetime.date(2019, 7, 2), sunrise=datetime.time(6, 4))
+        clone = self.clone()
+        self.assertEqual(clone.triplocation_set.get(title='Lake').sunrise,
+            datetime.time(6, 4))
+
+    def test_uncached_sun_times_are_scheduled_once_per_inputs(self):
+        with mock.patch.object(TripLocation, 'schedule_suntimes') as \
+                schedule_suntimes:
+            clone_trip(self.trip, self.start_date, self.organizer)
+        self.assertEqual(schedule_suntimes.call_count, 1)
+
+    def test_queries_do_not_grow_with_the_trip(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.clone(invite_members=True)
+        Item.objects.bulk_create(Item(trip=self.trip, description=str(i))
+            for i in range(10))
+        for i in range(10):
+            TripLocation.objects.create(trip=self.trip, title=str(i),
+                location_type=TripLocation.OBJECTIVE, day_index=i % 3,
+                date=self.trip.start_date + datetime.timedelta(days=i % 3))
+        with self.assertNumQueries(len(queries)):
+            self.clone(invite_members=True)
+
+
+class CloneTripSunTimesJobTests(TransactionTestCase):
+    """
+    Jobs are queued when the transaction commits, so these tests can't run
+    inside the transaction wrapped around each TestCase test.
+    """
+    def setUp(self):
+        cache.clear()
+        celestial.reset()
+        self.organizer = User.objects.create_user(
+            email='organizer@email.com', password='ValidPassword')
+        self.trip = Trip.objects.create(title='Uintas',
+            start_date=datetime.date(2018, 7, 1), number_nights=2)
+        for day_index in range(3):
+            for latitude in (40.646062, 40.7):
+                TripLocation.objects.create(trip=self.trip,
+                    title='Camp', location_type=TripLocation.CAMP,
+                    day_index=day_index,
+                    date=self.trip.start_date + datetime.timedelta(
+                        days=day_index),
+                    latitude=latitude, longitude=-111.497973)
+        Job.objects.all().delete()
+
+    @mock.patch.object(TripLocation, 'get_timezone',
+        return_value={'timeZoneId': 'America/Denver'})
+    def test_uncached_sun_times_are_computed_by_one_job(self, get_timezone):
+        clone = clone_trip(self.trip, datetime.date(2019, 7, 1),
+            self.organizer)
+        job = Job.objects.get()
+        self.assertEqual(job.name, 'trips.compute_celestial_times_batch')
+        self.assertEqual(len(job.get_payload()['inputs']), 6)
+        run_pending()
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+        self.assertFalse(clone.triplocation_set.filter(
+            sunrise__isnull=True).exists())
+
+
+class TripCloneViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='organizer@email.com',
+            password='ValidPassword')
+        cls.member = User.objects.create_user(email='member@email.com',
+            password='ValidPassword')
+        cls.trip = Trip.objects.create(title='Uintas',
+            start_date=datetime.date(2018, 7, 1), number_nights=1)
+        TripMember.objects.create(trip=cls.trip, member=cls.user,
+            organizer=True)
+        TripMember.objects.create(trip=cls.trip, member=cls.member)
+        TripGuest.objects.create(trip=cls.trip, email='guest@email.com')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.url = reverse('trips:trip_clone', args=(self.trip.id,))
+        self.start_date = timezone.now().date() + datetime.timedelta(days=7)
+
+    def post(self, **data):
+        data.setdefault('title', 'Uintas again')
+        data.setdefault('start_date', self.start_date)
+        data.setdefault('number_nights', 1)
+        return self.client.post(self.url, data)
+
+    def test_get_shows_form_with_trip_values(self):
+        response = self.client.get(self.url)
+        self.assertTemplateUsed(response, 'trips/create.html')
+        self.assertEqual(response.context['form'].initial,
+            {'title': 'Uintas', 'number_nights': 1})
+
+    def test_post_clones_and_redirects(self):
+        response = self.post()
+        clone = Trip.objects.get(title='Uintas again')
+        self.assertRedirects(response,
+            reverse('trips:trip_detail', args=(clone.id,)))
+        self.assertEqual(clone.start_date, self.start_date)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_invitations_are_sent(self):
+        self.post(invite_members='on')
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+            ['guest@email.com', 'member@email.com'])
+
+    def test_start_date_in_the_past_is_invalid(self):
+        response = self.post(
+            start_date=timezone.now().date() - datetime.timedelta(days=1))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Trip.objects.filter(title='Uintas again').exists())
+
+    def test_non_member_gets_404(self):
+        other = User.objects.create_user(email='other@email.com',
+            password='ValidPassword')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
@@ -76,6 +76,30 @@ class LocationFormTests(TestCase):
         form = LocationForm(**kwargs)
         self.assertEqual(form.fields['date'].label, None)
 
+    def choices(self):
+        return tuple((date, date)
+            for date in self.trip.get_date_choices('night'))
+
+    def test_date_choice_sets_day_index_and_date(self):
+        date = self.trip.get_date_choices('night')[0]
+        form = LocationForm(data={
+            'trip': self.trip.id,
+            'location_type': TripLocation.CAMP,
+            'date': date,
+        }, choices=self.choices(), location_type=TripLocation.CAMP)
+        location = form.save()
+        self.assertEqual(location.day_index, 0)
+        self.assertEqual(location.date, self.trip.start_date)
+
+    def test_date_initial_is_label_of_location(self):
+        location = TripLocation.objects.create(trip=self.trip,
+            location_type=TripLocation.CAMP, day_index=0,
+            date=self.trip.start_date)
+        form = LocationForm(instance=location, choices=self.choices(),
+            location_type=TripLocation.CAMP)
+        self.assertEqual(form['date'].value(),
+            self.trip.get_date_choices('night')[0])
+
     def test_latitude_field_label(self):
         kwargs={'choices': 'fake', 'location_type': 'fake'}
         form = LocationForm(**kwargs)
@@ -0,0 +1,230 @@
+from unittest import mock
+
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from account_info.models import EmergencyContact, User
+from trips import celestial, fragments
+from trips.models import Item, ItemOwner, Trip, TripLocation, TripMember
+from trips.tasks import compute_celestial_times
+
+
+def fake_timezone(self):
+    return {'timeZoneId': 'America/Denver'}
+
+
+@override_settings(TRIP_FRAGMENT_CACHE='default')
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        fragments.reset()
+        self.render = mock.Mock(return_value='<p>fragment</p>')
+
+    def test_miss_renders_and_hit_reuses(self):
+        for _ in range(3):
+            self.assertEqual(fragments.get_or_render(1, 'detail', self.render),
+                '<p>fragment</p>')
+        self.assertEqual(self.render.call_count, 1)
+        stats = fragments.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+        self.assertAlmostEqual(stats['hit_rate'], 2 / 3)
+
+    def test_fragments_vary_on_name_and_values(self):
+        fragments.get_or_render(1, 'gear', self.render)
+        fragments.get_or_render(1, 'gear', self.render, ['pdf'])
+        fragments.get_or_render(1, 'detail', self.render)
+        fragments.get_or_render(2, 'gear', self.render)
+        self.assertEqual(self.render.call_count, 4)
+
+    def test_invalidate_renders_again(self):
+        fragments.get_or_render(1, 'detail', self.render)
+        fragments.invalidate([1])
+        fragments.get_or_render(1, 'detail', self.render)
+        self.assertEqual(self.render.call_count, 2)
+
+    def test_invalidate_sets_a_new_version(self):
+        version = fragments.get_version(1)
+        # incr() is not atomic on every backend
+        with mock.patch.object(caches['default'], 'incr') as incr:
+            fragments.invalidate([1])
+        self.assertFalse(incr.called)
+        self.assertGreater(fragments.get_version(1), version)
+
+    def test_new_versions_increase(self):
+        with mock.patch('time.time', return_value=1000.0):
+            versions = [fragments.new_version() for _ in range(3)]
+        self.assertEqual(versions, sorted(set(versions)))
+
+    def test_evicted_version_does_not_repeat(self):
+        version = fragments.get_version(1)
+        fragments.invalidate([1])
+        caches['default'].delete(fragments.get_version_key(1))
+        self.assertGreater(fragments.get_version(1), version + 1)
+
+    def test_lazy_context_calls_function_once_when_used(self):
+        func = mock.Mock(return_value={'a': [1], 'b': None})
+        context = fragments.lazy_context(func, ('a', 'b'))
+        self.assertFalse(func.called)
+        self.assertEqual(list(context['a']), [1])
+        self.assertFalse(context['b'])
+        self.assertEqual(func.call_count, 1)
+
+
+@override_settings(TRIP_FRAGMENT_CACHE='default')
+class InvalidationTests(TestCase):
+    """
+    A change invalidates the fragments of the trips it is shown on, and of
+    no other trip
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='member@email.com',
+            password='ValidPassword')
+        cls.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+        cls.other_trip = Trip.objects.create(title='other',
+            start_date=timezone.now().date())
+        TripMember.objects.create(trip=cls.trip, member=cls.user)
+        cls.item = Item.objects.create(trip=cls.trip, description='Stove')
+
+    def setUp(self):
+        caches['default'].clear()
+        self.versions = self.get_versions()
+
+    def get_versions(self):
+        return (fragments.get_version(self.trip.id),
+            fragments.get_version(self.other_trip.id))
+
+    def assertInvalidated(self):
+        trip_version, other_version = self.get_versions()
+        self.assertGreater(trip_version, self.versions[0])
+        self.assertEqual(other_version, self.versions[1])
+
+    def assertNotInvalidated(self):
+        self.assertEqual(self.get_versions(), self.versions)
+
+    def test_trip_save(self):
+        self.trip.title = 'new title'
+        self.trip.save()
+        self.assertInvalidated()
+
+    def test_location_save_and_delete(self):
+        location = TripLocation.objects.create(trip=self.trip)
+        self.assertInvalidated()
+        self.versions = self.get_versions()
+        location.delete()
+        self.assertInvalidated()
+
+    def test_member_delete(self):
+        TripMember.objects.get(trip=self.trip).delete()
+        self.assertInvalidated()
+
+    def test_item_save(self):
+        Item.objects.create(trip=self.trip, description='Tent')
+        self.assertInvalidated()
+
+    def test_item_owner_save_and_delete(self):
+        owner = ItemOwner.objects.create(item=self.item, owner=self.user)
+        self.assertInvalidated()
+        self.versions = self.get_versions()
+        owner.delete()
+        self.assertInvalidated()
+
+    def test_user_save(self):
+        self.user.preferred_name = 'Member'
+        self.user.save()
+        self.assertInvalidated()
+
+    def test_login_does_not_invalidate(self):
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        self.assertNotInvalidated()
+
+    def test_emergency_contact_save(self):
+        EmergencyContact.objects.create(user=self.user, full_name='Parent',
+            relationship='Parent')
+        self.assertInvalidated()
+
+    def test_user_without_trips_does_not_invalidate(self):
+        User.objects.create_user(email='other@email.com',
+            password='ValidPassword')
+        self.assertNotInvalidated()
+
+    @mock.patch.object(TripLocation, 'get_timezone', fake_timezone)
+    def test_celestial_times_task(self):
+        TripLocation.objects.create(trip=self.trip,
+            date_label='Day 1 - 2018-01-01', latitude=40.646062,
+            longitude=-111.497973)
+        self.versions = self.get_versions()
+        celestial.reset()
+        compute_celestial_times('40.646062', '-111.497973', '2018-01-01')
+        self.assertInvalidated()
+
+
+@override_settings(TRIP_FRAGMENT_CACHE='default')
+class TripPageFragmentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='member@email.com',
+            password='ValidPassword')
+        cls.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date(), number_nights=1)
+        TripMember.objects.create(trip=cls.trip, member=cls.user)
+
+    def setUp(self):
+        caches['default'].clear()
+        fragments.reset()
+        self.client.force_login(self.user)
+
+    def get(self, url_name):
+        return self.client.get(reverse(url_name, args=(self.trip.id,)))
+
+    def test_cached_detail_page_does_not_load_locations(self):
+        self.get('trips:trip_detail')
+        with CaptureQueriesContext(connection) as queries:
+            self.get('trips:trip_detail')
+        self.assertFalse([query for query in queries.captured_queries
+            if 'trips_triplocation' in query['sql']])
+        self.assertEqual(fragments.get_stats()['hits'], 1)
+
+    def test_detail_page_shows_new_location(self):
+        self.get('trips:trip_detail')
+        TripLocation.objects.create(trip=self.trip, title='Summit',
+            location_type=TripLocation.OBJECTIVE,
+            date_label=self.trip.get_date_choices()[0])
+        self.assertContains(self.get('trips:trip_detail'), 'Summit')
+
+    def test_gear_page_shows_new_quantity(self):
+        item = Item.objects.create(trip=self.trip, description='Stove')
+        self.get('trips:gear')
+        ItemOwner.objects.create(item=item, owner=self.user, quantity=7)
+        self.assertContains(self.get('trips:gear'), '<td>7</td>')
+
+    def test_emergency_info_page_shows_new_contact(self):
+        self.get('trips:emergency_info')
+        EmergencyContact.objects.create(user=self.user,
+            full_name='Contact Name', relationship='Parent')
+        self.assertContains(self.get('trips:emergency_info'),
+            'Contact Name')
+
+
+@override_settings(TRIP_FRAGMENT_CACHE='default')
+class CommitInvalidationTests(TransactionTestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_version_is_bumped_again_on_commit(self):
+        trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+        with transaction.atomic():
+            version = fragments.get_version(trip.id)
+            trip.save()
+            # A fragment rendered now by another request would see the
+            # old data, so it must not be used after the commit
+            bumped = fragments.get_version(trip.id)
+            self.assertGreater(bumped, version)
+        self.assertGreater(fragments.get_version(trip.id), bumped)
@@ -0,0 +1,183 @@
+import datetime
+import threading
+import time
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+import requests
+
+from trips import celestial, httpclient, tzindex
+from trips.models import Trip, TripLocation
+from .stub_server import StubServer
+
+
+class HTTPClientTests(TestCase):
+    def setUp(self):
+        self.server = StubServer().__enter__()
+        self.server.add_route('/ok', {'status': 'OK'})
+        self.server.add_route('/error', {}, status=503)
+        self.server.add_route('/slow', {}, delay=0.5)
+        self.client = httpclient.HTTPClient(
+            connect_timeout=1,
+            read_timeout=0.2,
+            max_failures=2,
+            reset_seconds=60
+        )
+
+    def tearDown(self):
+        self.client.close()
+        self.server.__exit__()
+
+    def test_get_returns_response(self):
+        response = self.client.get(self.server.url + '/ok',
+            params={'key': 'value'})
+        self.assertEqual(response.json(), {'status': 'OK'})
+        self.assertEqual(self.server.requests, [('/ok', {'key': 'value'})])
+
+    def test_connections_are_reused(self):
+        for _ in range(5):
+            self.client.get(self.server.url + '/ok')
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_read_timeout(self):
+        start = time.monotonic()
+        self.assertRaises(requests.Timeout,
+            lambda: self.client.get(self.server.url + '/slow'))
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        self.client.get(self.server.url + '/error')
+        self.client.get(self.server.url + '/error')
+        self.assertRaises(httpclient.CircuitOpenError,
+            lambda: self.client.get(self.server.url + '/ok'))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_success_resets_failure_count(self):
+        self.client.get(self.server.url + '/error')
+        self.client.get(self.server.url + '/ok')
+        self.client.get(self.server.url + '/error')
+        self.assertEqual(self.client.get(self.server.url + '/ok').status_code,
+            200)
+
+    def test_timeouts_count_as_failures(self):
+        for _ in range(2):
+            with self.assertRaises(requests.Timeout):
+                self.client.get(self.server.url + '/slow')
+        self.assertRaises(httpclient.CircuitOpenError,
+            lambda: self.client.get(self.server.url + '/ok'))
+
+    def test_half_open_circuit_closes_after_successful_trial(self):
+        self.client.get(self.server.url + '/error')
+        self.client.get(self.server.url + '/error')
+        breaker = self.client.get_breaker(self.server_host())
+        breaker.opened_at -= 60
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+        self.client.get(self.server.url + '/ok')
+        self.assertEqual(breaker.state, breaker.CLOSED)
+
+    def test_half_open_circuit_reopens_after_failed_trial(self):
+        self.client.get(self.server.url + '/error')
+        self.client.get(self.server.url + '/error')
+        breaker = self.client.get_breaker(self.server_host())
+        breaker.opened_at -= 60
+        self.client.get(self.server.url + '/error')
+        self.assertEqual(breaker.state, breaker.OPEN)
+
+    def test_trial_raising_other_errors_does_not_block_host(self):
+        self.client.get(self.server.url + '/error')
+        self.client.get(self.server.url + '/error')
+        breaker = self.client.get_breaker(self.server_host())
+        breaker.opened_at -= 60
+        def hook(response, **kwargs):
+            raise ValueError('Invalid response')
+        with self.assertRaises(ValueError):
+            self.client.get(self.server.url + '/ok', hooks={'response': hook})
+        self.assertEqual(breaker.state, breaker.HALF_OPEN)
+        self.client.get(self.server.url + '/ok')
+        self.assertEqual(breaker.state, breaker.CLOSED)
+
+    def test_metrics_are_counted_across_threads(self):
+        metrics = httpclient.HostMetrics()
+        def record():
+            for _ in range(1000):
+                metrics.record_request(0.1)
+                metrics.record_error()
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(metrics.as_dict()['requests'], 4000)
+        self.assertEqual(metrics.as_dict()['errors'], 4000)
+
+    def test_metrics(self):
+        self.client.get(self.server.url + '/ok')
+        self.client.get(self.server.url + '/error')
+        self.client.get(self.server.url + '/error')
+        with self.assertRaises(httpclient.CircuitOpenError):
+            self.client.get(self.server.url + '/ok')
+        metrics = self.client.get_metrics()[self.server_host()]
+        self.assertEqual(metrics['requests'], 3)
+        self.assertEqual(metrics['errors'], 2)
+        self.assertEqual(metrics['rejected'], 1)
+        self.assertGreater(metrics['p95'], 0)
+        self.assertGreaterEqual(metrics['max'], metrics['p50'])
+
+    def server_host(self):
+        return self.server.url[len('http://'):]
+
+
+class GetTimezoneTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+
+    def setUp(self):
+        self.server = StubServer().__enter__()
+        celestial.reset()
+        # Use the API rather than an installed timezone index
+        tzindex._index = False
+        httpclient._client = None
+
+    def tearDown(self):
+        tzindex._index = None
+        httpclient._client = None
+        self.server.__exit__()
+
+    def create_location(self):
+        return TripLocation(
+            date=datetime.date(2018, 1, 1),
+            trip=self.trip,
+            location_type=TripLocation.BEGIN,
+            latitude=40.646062,
+            longitude=-111.497973
+        )
+
+    def test_get_timezone_uses_shared_client(self):
+        self.server.add_route('/timezone', {'timeZoneId': 'America/Denver'})
+        with override_settings(
+                GOOGLE_TIMEZONE_API_URL=self.server.url + '/timezone'):
+            self.assertEqual(self.create_location().get_timezone(),
+                {'timeZoneId': 'America/Denver'})
+        path, params = self.server.requests[0]
+        self.assertEqual(params['location'], '40.646062, -111.497973')
+        self.assertIn(self.server.url[len('http://'):],
+            httpclient.get_metrics())
+
+    @override_settings(HTTP_READ_TIMEOUT=0.1)
+    def test_get_timezone_returns_empty_dict_on_timeout(self):
+        self.server.add_route('/timezone', {}, delay=0.5)
+        with override_settings(
+                GOOGLE_TIMEZONE_API_URL=self.server.url + '/timezone'):
+            self.assertEqual(self.create_location().get_timezone(), {})
+
+    def test_set_suntimes_with_stubbed_api(self):
+        self.server.add_route('/timezone', {'timeZoneId': 'America/Denver'})
+        location = self.create_location()
+        with override_settings(
+                GOOGLE_TIMEZONE_API_URL=self.server.url + '/timezone'):
+            location.set_suntimes()
+        self.assertEqual(location.sunrise.hour, 7)
+        self.assertEqual(location.sunset.hour, 17)
@@ -1,5 +1,8 @@
 import datetime
+from unittest import mock
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.test import TestCase, RequestFactory
 from django.http import Http404
@@ -706,3 +709,101 @@ class LocationDeleteViewTests(TestCase):
         success_url = view.get_success_url()
         intended_url = reverse('trips:trip_detail', args=(self.trip.id,))
         self.assertEqual(success_url, intended_url)
+
+
+class LocationViewTripQueryTests(TestCase):
+    """
+    The trip of a location page is loaded once per request, see
+    trips.loaders
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='valid@email.com',
+            password='ValidPassword')
+        cls.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date(), number_nights=2)
+        cls.camp = TripLocation.objects.create(trip=cls.trip,
+            location_type=TripLocation.CAMP,
+            date_label=cls.trip.get_date_choices('night')[0])
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def assertTripLoadedOnce(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data)
+        self.assertIn(response.status_code, (200, 302))
+        trip_queries = [query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and
+                'FROM "trips_trip"' in query['sql']]
+        self.assertEqual(len(trip_queries), 1, trip_queries)
+        return response
+
+    def get_data(self, date_index):
+        return {
+            'trip': self.trip.id,
+            'location_type': TripLocation.CAMP,
+            'title': 'Camp',
+            'date': self.trip.get_date_choices('night')[date_index],
+        }
+
+    def test_create_get(self):
+        self.assertTripLoadedOnce('get', reverse('trips:location_create',
+            args=(self.trip.id, 'camp')))
+
+    def test_create_post(self):
+        response = self.assertTripLoadedOnce('post',
+            reverse('trips:location_create', args=(self.trip.id, 'camp')),
+            self.get_data(1))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(TripLocation.objects.filter(day_index=1).exists())
+
+    def test_edit_get(self):
+        self.assertTripLoadedOnce('get', reverse('trips:location_edit',
+            args=(self.trip.id, 'camp', self.camp.id)))
+
+    def test_edit_post(self):
+        response = self.assertTripLoadedOnce('post',
+            reverse('trips:location_edit',
+                args=(self.trip.id, 'camp', self.camp.id)),
+            self.get_data(1))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(TripLocation.objects.get(pk=self.camp.pk).day_index,
+            1)
+
+    def test_invalid_post_shows_errors(self):
+        data = self.get_data(0)
+        data['date'] = 'Night 9 - 2000-01-01'
+        response = self.assertTripLoadedOnce('post',
+            reverse('trips:location_create', args=(self.trip.id, 'camp')),
+            data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors)
+
+    def test_post_for_another_trip_is_invalid(self):
+        other_trip = Trip.objects.create(title='other',
+            start_date=timezone.now().date(), number_nights=2)
+        response = self.client.post(reverse('trips:location_create',
+            args=(other_trip.id, 'camp')), self.get_data(0))
+        self.assertIn('trip', response.context['form'].errors)
+
+    def test_unknown_trip_is_404(self):
+        response = self.client.get(reverse('trips:location_create',
+            args=(0, 'camp')))
+        self.assertEqual(response.status_code, 404)
+
+
+class TripDateChoicesTests(TestCase):
+    def test_date_choices_are_memoized_until_the_dates_change(self):
+        trip = Trip(title='title', start_date=datetime.date(2018, 1, 1),
+            number_nights=1)
+        with mock.patch.object(Trip, 'get_date_count',
+                wraps=trip.get_date_count) as get_date_count:
+            choices = trip.get_date_choices()
+            choices.append('changed by the caller')
+            self.assertEqual(trip.get_date_choices(),
+                ['Day 1 - 2018-01-01', 'Day 2 - 2018-01-02'])
+            self.assertEqual(get_date_count.call_count, 1)
+            trip.number_nights = 0
+            self.assertEqual(trip.get_date_choices(), ['Day 1 - 2018-01-01'])
+            self.assertEqual(get_date_count.call_count, 2)
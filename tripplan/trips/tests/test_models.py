@@ -1,15 +1,20 @@
 import datetime
+from unittest import mock
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from django.urls import reverse
+from django.template.loader import render_to_string
 from django.core.exceptions import ValidationError
 from django.db.utils import DataError, IntegrityError
 
 from account_info.models import User
 
+from trips import celestial
 from trips.models import Trip, Item, ItemOwner, TripMember, \
-    TripLocation
+    TripGuest, TripLocation, CelestialTimes
 
 
 class TripModelTests(TestCase):
@@ -168,10 +173,10 @@ class TripModelTests(TestCase):
         location_date = 'Day 1 - ' + str(start_date)
         for i in range(2):
             TripLocation.objects.create(
-            title=str(i), location_type=location_type, trip=trip, date=location_date)
+            title=str(i), location_type=location_type, trip=trip, date_label=location_date)
         manual_location_context = {
             location_date: list(trip.triplocation_set.filter(
-                location_type=location_type, date=location_date)),
+                location_type=location_type, day_index=0)),
             ('Day 2 - ' + str(start_date + datetime.timedelta(days=1))): []
         }
         self.assertEqual(trip.get_location_context(location_type),
@@ -191,20 +196,73 @@ class TripModelTests(TestCase):
         location_date = "Day 1 - " + str(start_date)
         for i in range(2):
             TripLocation.objects.create(
-            title=str(i), location_type=location_type, trip=trip, date=location_date)
+            title=str(i), location_type=location_type, trip=trip, date_label=location_date)
         location_date = "Day 2 - " + str(start_date + datetime.timedelta(days=1))
         for i in range(2):
             TripLocation.objects.create(
-            title=str(i), location_type=location_type, trip=trip, date=location_date)
+            title=str(i), location_type=location_type, trip=trip, date_label=location_date)
         manual_location_context = {
             ("Day 1 - " + str(start_date)): list(trip.triplocation_set.filter(
-            location_type=location_type, date="Day 1 - " + str(start_date))),
+            location_type=location_type, day_index=0)),
             ("Day 2 - " + str(start_date + datetime.timedelta(days=1))): list(trip.triplocation_set.filter(
-                location_type=location_type, date=("Day 2 - " + str(start_date + datetime.timedelta(days=1)))))
+                location_type=location_type, day_index=1))
         }
         self.assertEqual(trip.get_location_context(location_type),
             manual_location_context)
 
+    def test_get_route_context_groups_locations(self):
+        start_date = timezone.now().date()
+        trip = Trip.objects.create(
+            title='title', start_date=start_date, number_nights=1)
+        day_1 = 'Day 1 - ' + str(start_date)
+        day_2 = 'Day 2 - ' + str(start_date + datetime.timedelta(days=1))
+        night_1 = 'Night 1 - ' + str(start_date)
+        trailhead = TripLocation.objects.create(
+            location_type=TripLocation.BEGIN, trip=trip, date_label=day_1)
+        endpoint = TripLocation.objects.create(
+            location_type=TripLocation.END, trip=trip, date_label=day_2)
+        objectives = [TripLocation.objects.create(title=str(i),
+            location_type=TripLocation.OBJECTIVE, trip=trip, date_label=day_2)
+            for i in range(2)]
+        camp = TripLocation.objects.create(
+            location_type=TripLocation.CAMP, trip=trip, date_label=night_1)
+        self.assertEqual(trip.get_route_context(), {
+            'trailhead': trailhead,
+            'endpoint': endpoint,
+            'objective_dict': {day_1: [], day_2: objectives},
+            'camp_dict': {night_1: [camp]},
+            'outside_locations': [],
+        })
+
+    def test_get_route_context_matches_location_context(self):
+        start_date = timezone.now().date()
+        trip = Trip.objects.create(
+            title='title', start_date=start_date, number_nights=2)
+        for i in range(3):
+            TripLocation.objects.create(location_type=TripLocation.OBJECTIVE,
+                trip=trip, date_label=trip.get_date_choices()[i])
+        TripLocation.objects.create(location_type=TripLocation.CAMP,
+            trip=trip, date_label=trip.get_date_choices('night')[1])
+        context = trip.get_route_context()
+        self.assertEqual(context['objective_dict'],
+            trip.get_location_context(TripLocation.OBJECTIVE))
+        self.assertEqual(context['camp_dict'],
+            trip.get_location_context(TripLocation.CAMP))
+
+    def test_get_route_context_uses_one_query_for_any_trip_length(self):
+        start_date = timezone.now().date()
+        for number_nights in (1, 14):
+            trip = Trip.objects.create(title='title', start_date=start_date,
+                number_nights=number_nights)
+            for date in trip.get_date_choices():
+                TripLocation.objects.create(trip=trip, date_label=date,
+                    location_type=TripLocation.OBJECTIVE)
+            for date in trip.get_date_choices('night'):
+                TripLocation.objects.create(trip=trip, date_label=date,
+                    location_type=TripLocation.CAMP)
+            with self.assertNumQueries(1):
+                trip.get_route_context()
+
     def test_trip_is_in_the_past_with_today_trip(self):
         """
         is_in_the_past() returns False for trips whose start_date is today
@@ -222,6 +280,88 @@ class TripModelTests(TestCase):
         future_trip = Trip(start_date=date)
         self.assertIs(future_trip.is_in_the_past(), True)
 
+class TripRescheduleTests(TestCase):
+    def setUp(self):
+        celestial.reset()
+        self.start_date = datetime.date(2018, 1, 1)
+        self.trip = Trip.objects.create(title='title',
+            start_date=self.start_date, number_nights=2)
+
+    def create_location(self, location_type, day_index, **kwargs):
+        return TripLocation.objects.create(trip=self.trip,
+            location_type=location_type, day_index=day_index,
+            date=self.start_date + datetime.timedelta(days=day_index),
+            **kwargs)
+
+    def get_location_updates(self, queries):
+        return [query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE "trips_triplocation"')]
+
+    def test_locations_keep_their_day_in_one_update(self):
+        locations = [self.create_location(TripLocation.OBJECTIVE, i)
+            for i in range(3)]
+        with CaptureQueriesContext(connection) as queries:
+            self.trip.reschedule(datetime.date(2018, 3, 1), 2)
+        self.assertEqual(len(self.get_location_updates(queries)), 1)
+        for i, location in enumerate(locations):
+            location.refresh_from_db()
+            self.assertEqual(location.day_index, i)
+            self.assertEqual(location.date, datetime.date(2018, 3, 1 + i))
+        self.assertEqual(self.trip.get_location_context(
+            TripLocation.OBJECTIVE)['Day 3 - 2018-03-03'], [locations[2]])
+
+    def test_unchanged_dates_are_not_updated(self):
+        self.create_location(TripLocation.OBJECTIVE, 0, latitude=40.646062,
+            longitude=-111.497973)
+        with mock.patch.object(TripLocation, 'schedule_suntimes') as \
+                schedule_suntimes, \
+                CaptureQueriesContext(connection) as queries:
+            self.trip.reschedule(self.start_date, 5)
+        self.assertEqual(self.get_location_updates(queries), [])
+        self.assertFalse(schedule_suntimes.called)
+
+    def test_sun_times_of_moved_locations_are_looked_up_in_batch(self):
+        sunrise = datetime.time(7, 49)
+        CelestialTimes.objects.create(latitude=40.646, longitude=-111.498,
+            date=datetime.date(2018, 1, 2), sunrise=sunrise)
+        cached = [self.create_location(TripLocation.OBJECTIVE, 0,
+            latitude=40.646062, longitude=-111.497973) for _ in range(2)]
+        uncached = [self.create_location(TripLocation.CAMP, 1,
+            latitude=39.0, longitude=-105.0) for _ in range(2)]
+        TripLocation.objects.update(sunset=datetime.time(17, 0))
+        with mock.patch.object(TripLocation, 'schedule_suntimes') as \
+                schedule_suntimes:
+            self.trip.reschedule(datetime.date(2018, 1, 2), 2)
+        self.assertEqual(schedule_suntimes.call_count, 1)
+        for location in cached:
+            location.refresh_from_db()
+            self.assertEqual((location.sunrise, location.sunset),
+                (sunrise, None))
+        for location in uncached:
+            location.refresh_from_db()
+            self.assertEqual((location.sunrise, location.sunset),
+                (None, None))
+
+    def test_locations_after_a_shortened_trip_are_returned(self):
+        self.create_location(TripLocation.OBJECTIVE, 1)
+        objective = self.create_location(TripLocation.OBJECTIVE, 2)
+        camp = self.create_location(TripLocation.CAMP, 1)
+        outside_locations = self.trip.reschedule(
+            datetime.date(2018, 2, 1), 1)
+        self.assertEqual(outside_locations, [objective, camp])
+        objective.refresh_from_db()
+        self.assertEqual(objective.date, datetime.date(2018, 2, 3))
+        self.assertEqual(self.trip.get_route_context()['outside_locations'],
+            [objective, camp])
+
+    def test_extending_the_trip_again_brings_locations_back(self):
+        objective = self.create_location(TripLocation.OBJECTIVE, 2)
+        self.trip.reschedule(self.start_date, 0)
+        self.assertEqual(self.trip.reschedule(self.start_date, 2), [])
+        self.assertEqual(self.trip.get_location_context(
+            TripLocation.OBJECTIVE)['Day 3 - 2018-01-03'], [objective])
+
+
 class TripLocationTests(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -234,26 +374,44 @@ class TripLocationTests(TestCase):
 
     def test_date_default_is_unassigned(self):
         test = TripLocation.objects.create(trip=self.trip)
-        self.assertEqual(test.date, 'Unassigned')
-
-    def test_invalid_with_null_date(self):
-        date = None
-        location_type = 'CM'
-        test = lambda: TripLocation.objects.create(date=date,
-            trip=self.trip, location_type=location_type)
-        self.assertRaises(IntegrityError, test)
+        self.assertIsNone(test.date)
+        self.assertIsNone(test.day_index)
+        self.assertEqual(test.date_label, 'Unassigned')
 
-    def test_invalid_with_blank_date(self):
-        date = ''
+    def test_invalid_with_unassigned_date(self):
         location_type = 'CM'
-        test = TripLocation.objects.create(date=date,
+        test = TripLocation.objects.create(
             trip=self.trip, location_type=location_type)
         self.assertRaises(ValidationError, lambda: test.full_clean())
 
+    def test_date_label_raises_exception_for_invalid_date(self):
+        test = TripLocation(trip=self.trip, location_type='CM')
+        for date in ('', 'fake', 'Day 0 - ' + str(self.trip.start_date)):
+            with self.assertRaises(ValueError):
+                test.date_label = date
+
+    def test_date_label_sets_day_index_and_date(self):
+        date = 'Night 2 - ' + str(
+            self.trip.start_date + datetime.timedelta(days=1))
+        test = TripLocation(trip=self.trip, location_type='CM',
+            date_label=date)
+        self.assertEqual(test.day_index, 1)
+        self.assertEqual(test.date,
+            self.trip.start_date + datetime.timedelta(days=1))
+        self.assertEqual(test.date_label, date)
+
+    def test_date_label_prefix_follows_location_type(self):
+        test = TripLocation(trip=self.trip, location_type='OB',
+            day_index=0, date=self.trip.start_date)
+        self.assertEqual(test.date_label,
+            'Day 1 - ' + str(self.trip.start_date))
+        test.location_type = 'CM'
+        self.assertEqual(test.date_label,
+            'Night 1 - ' + str(self.trip.start_date))
+
     def test_invalid_without_location_type(self):
-        date = 'fake'
         location_type = ''
-        test = TripLocation.objects.create(date=date,
+        test = TripLocation.objects.create(
             trip=self.trip, location_type=location_type)
         self.assertRaises(ValidationError, lambda: test.full_clean())
 
@@ -264,7 +422,7 @@ class TripLocationTests(TestCase):
         '''
         date = "Night 1 - " + str(self.trip.start_date)
         location_type = 'CM'
-        test = TripLocation.objects.create(date=date,
+        test = TripLocation.objects.create(date_label=date,
             trip=self.trip, location_type=location_type)
         try:
             test.full_clean()
@@ -309,9 +467,8 @@ class TripLocationTests(TestCase):
         The TripLocation.get_date() method will raise an exception if the
         date is not in expected format: "Day X - YYYY-MM-DD"
         """
-        date = 'Unassigned'
         location_type = 'CM'
-        test = TripLocation.objects.create(date=date,
+        test = TripLocation.objects.create(
             trip=self.trip, location_type=location_type)
         self.assertRaises(ValueError, lambda: test.get_date())
 
@@ -322,7 +479,7 @@ class TripLocationTests(TestCase):
         """
         date = 'Day 1 - ' + str(self.trip.start_date)
         location_type = 'CM'
-        test = TripLocation.objects.create(date=date,
+        test = TripLocation.objects.create(date_label=date,
             trip=self.trip, location_type=location_type)
         self.assertEqual(test.get_date(), self.trip.start_date)
 
@@ -333,7 +490,7 @@ class TripLocationTests(TestCase):
         """
         date = 'Day 1 - ' + str(self.trip.start_date)
         location_type = 'CM'
-        test = TripLocation.objects.create(date=date,
+        test = TripLocation.objects.create(date_label=date,
             trip=self.trip, location_type=location_type)
         self.assertEqual(test.get_date_choices(), self.trip.get_date_choices())
 
@@ -341,19 +498,37 @@ class TripLocationTests(TestCase):
         """
         Tests the TripLocation.clean_fields() method
         """
-        date = 'Invalid date'
+        date = 'Night 2 - ' + str(
+            self.trip.start_date + datetime.timedelta(days=1))
         location_type = 'CM'
-        test = TripLocation.objects.create(date=date,
+        test = TripLocation.objects.create(date_label=date,
             trip=self.trip, location_type=location_type)
         self.assertRaises(ValidationError, lambda: test.full_clean())
 
+    def test_validation_error_for_date_not_matching_day(self):
+        """
+        The date must be the date of the day_index of the trip
+        """
+        location_type = 'OB'
+        test = TripLocation.objects.create(day_index=0,
+            date=self.trip.start_date + datetime.timedelta(days=1),
+            trip=self.trip, location_type=location_type)
+        self.assertRaises(ValidationError, lambda: test.full_clean())
+
+    def test_clean_fields_does_not_build_date_choices(self):
+        test = TripLocation.objects.create(day_index=0,
+            date=self.trip.start_date, trip=self.trip, location_type='OB')
+        with mock.patch.object(Trip, 'get_date_choices') as choices:
+            test.full_clean()
+        self.assertFalse(choices.called)
+
     def test_valid_for_valid_date_with_day(self):
         """
         Tests the TripLocation.clean_fields() method for location_type=objective
         """
         date = 'Day 1 - ' + str(self.trip.start_date)
         location_type = 'OB'
-        test = TripLocation.objects.create(date=date,
+        test = TripLocation.objects.create(date_label=date,
             trip=self.trip, location_type=location_type)
         try:
             test.full_clean()
@@ -366,7 +541,7 @@ class TripLocationTests(TestCase):
         """
         date = 'Night 1 - ' + str(self.trip.start_date)
         location_type = 'CM'
-        test = TripLocation.objects.create(date=date,
+        test = TripLocation.objects.create(date_label=date,
             trip=self.trip, location_type=location_type)
         try:
             test.full_clean()
@@ -374,30 +549,26 @@ class TripLocationTests(TestCase):
             self.fail("full_clean() raised an error unexpectedly!")
 
     def test_get_location_type_verbose_for_type_begin(self):
-        date = 'fake'
         location_type = 'ST'
-        test = TripLocation.objects.create(date=date,
+        test = TripLocation.objects.create(
             trip=self.trip, location_type=location_type)
         self.assertEqual('trailhead', test.get_location_type_verbose)
 
     def test_get_location_type_verbose_for_type_end(self):
-        date = 'fake'
         location_type = 'EN'
-        test = TripLocation.objects.create(date=date,
+        test = TripLocation.objects.create(
             trip=self.trip, location_type=location_type)
         self.assertEqual('endpoint', test.get_location_type_verbose)
 
     def test_get_location_type_verbose_for_type_objective(self):
-        date = 'fake'
         location_type = 'OB'
-        test = TripLocation.objects.create(date=date,
+        test = TripLocation.objects.create(
             trip=self.trip, location_type=location_type)
         self.assertEqual('objective', test.get_location_type_verbose)
 
     def test_get_location_type_verbose_for_type_camp(self):
-        date = 'fake'
         location_type = 'CM'
-        test = TripLocation.objects.create(date=date,
+        test = TripLocation.objects.create(
             trip=self.trip, location_type=location_type)
         self.assertEqual('camp', test.get_location_type_verbose)
 
@@ -412,7 +583,7 @@ class TripLocationTests(TestCase):
         longitude = -111.497973
 
         test = TripLocation.objects.create(
-            date=date,
+            date_label=date,
             trip=self.trip,
             location_type=location_type,
             latitude=latitude,
@@ -431,7 +602,7 @@ class TripLocationTests(TestCase):
         longitude = -111.497973
 
         test = TripLocation.objects.create(
-            date=date,
+            date_label=date,
             trip=self.trip,
             location_type=location_type,
             latitude=latitude,
@@ -483,6 +654,65 @@ class ItemOwnerModelTests(TestCase):
         self.assertEqual(item_owner.quantity, 1)
 
 
+class TripGearContextTests(TestCase):
+    def create_grid(self, number_items, number_members):
+        trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+        users = []
+        for i in range(number_members):
+            user = User.objects.create_user(
+                email='%d-%d@email.com' % (trip.id, i),
+                password='ValidPassword')
+            TripMember.objects.create(trip=trip, member=user)
+            users.append(user)
+        for i in range(number_items):
+            item = Item.objects.create(description='item %02d' % i, trip=trip)
+            # Every other member owns the item
+            for user in users[i % 2::2]:
+                ItemOwner.objects.create(item=item, owner=user, quantity=i)
+        return trip
+
+    def test_quantity_matrix(self):
+        trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+        first = User.objects.create_user(email='first@email.com',
+            password='ValidPassword')
+        second = User.objects.create_user(email='second@email.com',
+            password='ValidPassword')
+        TripMember.objects.create(trip=trip, member=first)
+        TripMember.objects.create(trip=trip, member=second)
+        stove = Item.objects.create(description='Stove', trip=trip)
+        rope = Item.objects.create(description='rope', trip=trip)
+        ItemOwner.objects.create(item=stove, owner=second, quantity=2)
+        ItemOwner.objects.create(item=rope, owner=first, quantity=1)
+        context = trip.get_gear_context()
+        self.assertEqual(context['trip_items'], [rope, stove])
+        self.assertEqual(
+            [trip_member.member for trip_member in context['trip_members']],
+            [first, second]
+        )
+        self.assertEqual(context['gear_rows'],
+            [(rope, [1, '']), (stove, ['', 2])])
+
+    def test_owners_who_left_the_trip_are_ignored(self):
+        trip = self.create_grid(1, 1)
+        user = User.objects.create_user(email='former@email.com',
+            password='ValidPassword')
+        ItemOwner.objects.create(item=trip.item_set.get(), owner=user)
+        self.assertEqual(trip.get_gear_context()['gear_rows'][0][1], [0])
+
+    def test_query_count_is_independent_of_grid_size(self):
+        for number_items, number_members in ((2, 2), (60, 8)):
+            trip = self.create_grid(number_items, number_members)
+            with self.assertNumQueries(3):
+                context = trip.get_gear_context()
+                html = render_to_string('trips/partials/gear_content.html',
+                    dict(context, pdf=True))
+            self.assertEqual(len(context['gear_rows']), number_items)
+            self.assertEqual(html.count('<td>'),
+                number_items * number_members)
+
+
 class TripMemberModelTests(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -502,6 +732,30 @@ class TripMemberModelTests(TestCase):
         trip_member = TripMember.objects.create(trip=self.trip, member=self.user)
         self.assertEqual(trip_member.organizer, False)
 
+    def test_member_is_unique_per_trip(self):
+        TripMember.objects.create(trip=self.trip, member=self.user)
+        test = lambda: TripMember.objects.create(trip=self.trip,
+            member=self.user)
+        self.assertRaises(IntegrityError, test)
+
+class TripGuestModelTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+
+    def test_email_is_unique_per_trip_ignoring_case(self):
+        TripGuest.objects.create(trip=self.trip, email='guest@email.com')
+        test = lambda: TripGuest.objects.create(trip=self.trip,
+            email='GUEST@email.com')
+        self.assertRaises(IntegrityError, test)
+
+    def test_same_email_may_be_guest_of_other_trip(self):
+        TripGuest.objects.create(trip=self.trip, email='guest@email.com')
+        other_trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+        TripGuest.objects.create(trip=other_trip, email='guest@email.com')
+
 class ModelRelationshipTests(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -0,0 +1,171 @@
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from account_info.models import User
+from trips import notifications
+from trips.models import Item, ItemNotification, NotificationCount, Trip, \
+    TripMember
+
+
+class NotificationCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='member@email.com',
+            password='ValidPassword')
+        cls.trips = [Trip.objects.create(title='trip %d' % i,
+            start_date=timezone.now().date()) for i in range(3)]
+
+    def setUp(self):
+        cache.clear()
+
+    def invite(self, trip):
+        return TripMember.objects.create(trip=trip, member=self.user,
+            accept_reqd=True)
+
+    def test_counts_trip_invitations_and_gear_notifications(self):
+        self.invite(self.trips[0])
+        self.invite(self.trips[1])
+        item = Item.objects.create(trip=self.trips[0], description='Stove')
+        ItemNotification.objects.create(item=item, owner=self.user)
+        self.assertEqual(notifications.get_count(self.user.pk), 3)
+
+    def test_count_follows_changes(self):
+        self.assertEqual(notifications.get_count(self.user.pk), 0)
+        tripmember = self.invite(self.trips[0])
+        self.invite(self.trips[1])
+        self.assertEqual(notifications.get_count(self.user.pk), 2)
+        tripmember.accept_reqd = False
+        tripmember.save()
+        self.assertEqual(notifications.get_count(self.user.pk), 1)
+        TripMember.objects.get(trip=self.trips[1]).delete()
+        self.assertEqual(notifications.get_count(self.user.pk), 0)
+        self.assertEqual(
+            NotificationCount.objects.get(user=self.user).count, 0)
+
+    def test_count_is_read_from_stored_count_on_cache_miss(self):
+        self.invite(self.trips[0])
+        cache.clear()
+        # Counts and stores the count
+        notifications.get_count(self.user.pk)
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(notifications.get_count(self.user.pk), 1)
+        with self.assertNumQueries(0):
+            notifications.get_count(self.user.pk)
+
+    def test_bulk_invitation_updates_count(self):
+        organizer = User.objects.create_user(email='organizer@email.com',
+            password='ValidPassword')
+        self.client.force_login(organizer)
+        self.client.post(reverse('trips:bulk_invite'),
+            {'trip_id': self.trips[0].id, 'emails': self.user.email})
+        self.assertEqual(notifications.get_count(self.user.pk), 1)
+
+    def test_deleting_user_with_invitations(self):
+        self.invite(self.trips[0])
+        notifications.get_count(self.user.pk)
+        self.user.delete()
+        self.assertFalse(NotificationCount.objects.exists())
+
+
+class NotificationCountTransactionTests(TransactionTestCase):
+    """
+    Counts are cached when the transaction commits, so these tests can't
+    run inside the transaction wrapped around each TestCase test.
+    """
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='member@email.com',
+            password='ValidPassword')
+        self.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+        notifications.get_count(self.user.pk)
+
+    def test_count_is_cached_when_transaction_commits(self):
+        with transaction.atomic():
+            TripMember.objects.create(trip=self.trip, member=self.user,
+                accept_reqd=True)
+            self.assertIsNone(
+                cache.get(notifications.get_cache_key(self.user.pk)))
+        with self.assertNumQueries(0):
+            self.assertEqual(notifications.get_count(self.user.pk), 1)
+
+    def test_count_of_rolled_back_changes_is_not_cached(self):
+        try:
+            with transaction.atomic():
+                TripMember.objects.create(trip=self.trip, member=self.user,
+                    accept_reqd=True)
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        self.assertEqual(notifications.get_count(self.user.pk), 0)
+        self.assertEqual(
+            NotificationCount.objects.get(user=self.user).count, 0)
+
+
+class HeaderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='member@email.com',
+            password='ValidPassword')
+        cls.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_header_shows_count(self):
+        TripMember.objects.create(trip=self.trip, member=self.user,
+            accept_reqd=True)
+        response = self.client.get(reverse('trips:trip_list'))
+        self.assertContains(response,
+            '<span class="badge badge-pill badge-danger">1</span>')
+
+    def test_header_reads_count_from_cache(self):
+        self.client.get(reverse('trips:trip_list'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('trips:trip_list'))
+        self.assertFalse([query for query in queries.captured_queries
+            if 'notificationcount' in query['sql']
+                or 'itemnotification' in query['sql']])
+
+
+class NotificationListViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='member@email.com',
+            password='ValidPassword')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def add_notifications(self, number):
+        for i in range(number):
+            trip = Trip.objects.create(title='trip %d' % i,
+                start_date=timezone.now().date())
+            TripMember.objects.create(trip=trip, member=self.user,
+                accept_reqd=True)
+            item = Item.objects.create(trip=trip, description='Stove %d' % i)
+            ItemNotification.objects.create(item=item, owner=self.user)
+
+    def test_lists_trips_and_items(self):
+        self.add_notifications(1)
+        response = self.client.get(reverse('trips:notifications'))
+        self.assertContains(response, 'trip 0', count=2)
+        self.assertContains(response, 'Stove 0')
+
+    def test_queries_do_not_grow_with_number_of_notifications(self):
+        self.add_notifications(1)
+        self.client.get(reverse('trips:notifications'))
+        with CaptureQueriesContext(connection) as one:
+            self.client.get(reverse('trips:notifications'))
+        self.add_notifications(5)
+        self.client.get(reverse('trips:notifications'))
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(reverse('trips:notifications'))
+        self.assertEqual(len(many), len(one))
@@ -0,0 +1,181 @@
+import datetime
+import math
+
+from django.test import TestCase
+from django.utils import timezone
+
+import pytz
+
+from trips import solar
+from trips.models import Trip, TripLocation
+
+
+# Tolerance when comparing against reference values rounded to the minute
+TOLERANCE = datetime.timedelta(minutes=2)
+
+
+def local_time(value, tz_name):
+    return value.astimezone(pytz.timezone(tz_name))
+
+
+class SolarReferenceValueTests(TestCase):
+    """
+    Compares solar.get_suntimes() with published sunrise and sunset tables
+    for a few well known places. Times are local wall clock times.
+    """
+    REFERENCE_VALUES = (
+        # (latitude, longitude, timezone, date, event, 'HH:MM')
+        (40.646062, -111.497973, 'America/Denver', datetime.date(2018, 1, 1),
+            'sunrise', '07:49'),
+        (40.646062, -111.497973, 'America/Denver', datetime.date(2018, 1, 1),
+            'sunset', '17:09'),
+        (40.7128, -74.0060, 'America/New_York', datetime.date(2018, 6, 21),
+            'dawn', '04:51'),
+        (40.7128, -74.0060, 'America/New_York', datetime.date(2018, 6, 21),
+            'sunrise', '05:25'),
+        (40.7128, -74.0060, 'America/New_York', datetime.date(2018, 6, 21),
+            'sunset', '20:31'),
+        (40.7128, -74.0060, 'America/New_York', datetime.date(2018, 6, 21),
+            'dusk', '21:04'),
+        (51.4779, 0.0, 'Europe/London', datetime.date(2018, 12, 21),
+            'sunrise', '08:04'),
+        (51.4779, 0.0, 'Europe/London', datetime.date(2018, 12, 21),
+            'sunset', '15:53'),
+        (-33.8688, 151.2093, 'Australia/Sydney', datetime.date(2018, 1, 1),
+            'sunrise', '05:47'),
+        (-33.8688, 151.2093, 'Australia/Sydney', datetime.date(2018, 1, 1),
+            'sunset', '20:09'),
+    )
+
+    def test_get_suntimes_matches_reference_values(self):
+        for latitude, longitude, tz_name, date, event, expected in \
+                self.REFERENCE_VALUES:
+            suntimes = solar.get_suntimes(latitude, longitude, date)
+            actual = local_time(suntimes[event], tz_name)
+            expected_time = pytz.timezone(tz_name).localize(
+                datetime.datetime.combine(
+                    date,
+                    datetime.datetime.strptime(expected, '%H:%M').time()
+                )
+            )
+            self.assertLessEqual(
+                abs(actual - expected_time), TOLERANCE,
+                '%s at %s, %s on %s' % (event, latitude, longitude, date)
+            )
+
+    def test_events_fall_on_the_local_date(self):
+        """
+        West of Greenwich the local sunset happens after midnight UTC.
+        It should still belong to the requested local date.
+        """
+        date = datetime.date(2018, 6, 21)
+        suntimes = solar.get_suntimes(47.6062, -122.3321, date)
+        for event in solar.ZENITH:
+            self.assertEqual(
+                local_time(suntimes[event], 'America/Los_Angeles').date(),
+                date
+            )
+
+    def test_events_are_in_chronological_order(self):
+        suntimes = solar.get_suntimes(0, 0, datetime.date(2018, 3, 20))
+        self.assertLess(suntimes['dawn'], suntimes['sunrise'])
+        self.assertLess(suntimes['sunrise'], suntimes['sunset'])
+        self.assertLess(suntimes['sunset'], suntimes['dusk'])
+
+    def test_sun_is_at_event_zenith_at_computed_time(self):
+        """
+        Independent check: the solar elevation at the computed times equals
+        90 degrees minus the zenith angle of the event.
+        """
+        latitude, longitude = 64.8378, -147.7164
+        date = datetime.date(2018, 3, 20)
+        suntimes = solar.get_suntimes(latitude, longitude, date)
+        for event, zenith in solar.ZENITH.items():
+            value = suntimes[event]
+            minutes = (value - datetime.datetime.combine(
+                date, datetime.time()).replace(tzinfo=pytz.utc)
+            ).total_seconds() / 60
+            declination, equation_of_time = solar.solar_terms(
+                solar.julian_day(date, minutes))
+            hour_angle = math.radians(
+                (minutes + equation_of_time + 4 * longitude) / 4 - 180)
+            elevation = math.degrees(math.asin(
+                math.sin(math.radians(latitude)) *
+                math.sin(math.radians(declination)) +
+                math.cos(math.radians(latitude)) *
+                math.cos(math.radians(declination)) * math.cos(hour_angle)
+            ))
+            self.assertAlmostEqual(elevation, 90 - zenith, places=1)
+
+    def test_midnight_sun_returns_none(self):
+        suntimes = solar.get_suntimes(69.6492, 18.9553,
+            datetime.date(2018, 6, 21))
+        self.assertEqual(
+            suntimes,
+            {'dawn': None, 'sunrise': None, 'sunset': None, 'dusk': None}
+        )
+
+    def test_polar_night_still_has_civil_twilight(self):
+        suntimes = solar.get_suntimes(69.6492, 18.9553,
+            datetime.date(2018, 12, 21))
+        self.assertIsNone(suntimes['sunrise'])
+        self.assertIsNone(suntimes['sunset'])
+        self.assertIsNotNone(suntimes['dawn'])
+        self.assertIsNotNone(suntimes['dusk'])
+
+    def test_get_suntimes_many_matches_get_suntimes(self):
+        locations = [
+            (40.646062, -111.497973, datetime.date(2018, 1, 1)),
+            (-33.8688, 151.2093, datetime.date(2018, 1, 1)),
+            (51.4779, 0.0, datetime.date(2018, 12, 21)),
+        ]
+        batch = solar.get_suntimes_many(locations)
+        for location, result in zip(locations, batch):
+            single = solar.get_suntimes(*location)
+            for event in solar.ZENITH:
+                self.assertLessEqual(
+                    abs(result[event] - single[event]),
+                    datetime.timedelta(seconds=1)
+                )
+
+
+class TripLocationSuntimeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+
+    def test_get_suntimes_in_utc_returns_all_events(self):
+        location = TripLocation(
+            date=datetime.date(2018, 1, 1),
+            trip=self.trip,
+            location_type=TripLocation.BEGIN,
+            latitude=40.646062,
+            longitude=-111.497973
+        )
+        suntimes = location.get_suntimes_in_utc()
+        self.assertEqual(
+            set(suntimes.keys()),
+            {'dawn', 'sunrise', 'sunset', 'dusk'}
+        )
+        self.assertEqual(suntimes['sunrise'].tzinfo, pytz.utc)
+
+    def test_get_suntimes_in_utc_returns_empty_dict_without_date(self):
+        location = TripLocation(
+            trip=self.trip,
+            location_type=TripLocation.BEGIN,
+            latitude=40.646062,
+            longitude=-111.497973
+        )
+        self.assertEqual(location.get_suntimes_in_utc(), {})
+
+    def test_clear_suntimes_clears_dawn_and_dusk(self):
+        location = TripLocation(
+            trip=self.trip,
+            location_type=TripLocation.BEGIN,
+            dawn=datetime.time(7),
+            dusk=datetime.time(18)
+        )
+        location.clear_suntimes()
+        self.assertIsNone(location.dawn)
+        self.assertIsNone(location.dusk)
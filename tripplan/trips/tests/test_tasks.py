@@ -0,0 +1,191 @@
+import datetime
+from decimal import Decimal
+from unittest import mock
+
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from taskqueue.models import Job
+from taskqueue.worker import run_pending
+from trips import celestial
+from trips.models import CelestialTimes, Trip, TripLocation
+
+
+def fake_timezone(self):
+    return {'timeZoneId': 'America/Denver'}
+
+
+class TripLocationQueueTests(TransactionTestCase):
+    """
+    Jobs are queued when the transaction commits, so these tests can't run
+    inside the transaction wrapped around each TestCase test.
+    """
+    def setUp(self):
+        celestial.reset()
+        self.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+
+    def create_location(self, **kwargs):
+        values = {
+            'date': datetime.date(2018, 1, 1),
+            'trip': self.trip,
+            'location_type': TripLocation.BEGIN,
+            'latitude': 40.646062,
+            'longitude': -111.497973,
+        }
+        values.update(kwargs)
+        return TripLocation.objects.create(**values)
+
+    @mock.patch.object(TripLocation, 'get_timezone')
+    def test_save_queues_job_instead_of_computing_times(self, get_timezone):
+        location = self.create_location()
+        self.assertFalse(get_timezone.called)
+        self.assertIsNone(location.sunrise)
+        job = Job.objects.get()
+        self.assertEqual(job.name, 'trips.compute_celestial_times')
+        self.assertEqual(job.get_payload(), {
+            'latitude': '40.646062',
+            'longitude': '-111.497973',
+            'date': '2018-01-01',
+        })
+
+    def test_changed_location_is_saved_without_old_times(self):
+        self.create_location()
+        TripLocation.objects.update(sunrise=datetime.time(5, 11),
+            sunset=datetime.time(21, 10))
+        location = TripLocation.objects.get()
+        location.date = datetime.date(2018, 6, 1)
+        location.save()
+        location.refresh_from_db()
+        self.assertEqual((location.sunrise, location.sunset), (None, None))
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_save_without_coordinates_does_not_queue_job(self):
+        self.create_location(latitude=None, longitude=None)
+        self.assertEqual(Job.objects.count(), 0)
+
+    def test_identical_locations_share_one_job(self):
+        self.create_location()
+        self.create_location(location_type=TripLocation.END)
+        self.assertEqual(Job.objects.count(), 1)
+
+    @mock.patch.object(TripLocation, 'get_timezone', fake_timezone)
+    def test_worker_fills_celestial_times(self):
+        first = self.create_location()
+        second = self.create_location(location_type=TripLocation.END)
+        self.assertEqual(run_pending(), 1)
+        for location in (first, second):
+            location.refresh_from_db()
+            self.assertEqual(location.dawn.hour, 7)
+            self.assertEqual(location.sunrise.hour, 7)
+            self.assertEqual(location.sunset.hour, 17)
+            self.assertEqual(location.dusk.hour, 17)
+
+    @mock.patch.object(TripLocation, 'get_timezone', fake_timezone)
+    def test_worker_accepts_old_date_format(self):
+        location = self.create_location()
+        Job.objects.update(payload=Job.objects.get().payload.replace(
+            '2018-01-01', 'Day 1 - 2018-01-01'))
+        self.assertEqual(run_pending(), 1)
+        location.refresh_from_db()
+        self.assertEqual(location.sunrise.hour, 7)
+
+    @mock.patch.object(TripLocation, 'get_timezone', lambda self: {})
+    def test_job_is_retried_when_timezone_unavailable(self):
+        location = self.create_location()
+        run_pending()
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('LookupError', job.last_error)
+        location.refresh_from_db()
+        self.assertIsNone(location.sunrise)
+
+
+class TripLocationChangedInputsTests(TransactionTestCase):
+    """
+    Counts the timezone lookups, the outbound calls made to compute the
+    sun times, for each kind of save
+    """
+    def setUp(self):
+        patcher = mock.patch.object(TripLocation, 'get_timezone',
+            autospec=True, side_effect=fake_timezone)
+        self.get_timezone = patcher.start()
+        self.addCleanup(patcher.stop)
+        celestial.reset()
+        self.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date(), number_nights=1)
+        TripLocation.objects.create(
+            date=datetime.date(2018, 1, 1),
+            trip=self.trip,
+            location_type=TripLocation.BEGIN,
+            latitude=40.646062,
+            longitude=-111.497973
+        )
+        run_pending()
+        celestial.reset()
+        self.location = TripLocation.objects.get()
+
+    def save_and_count_lookups(self, **kwargs):
+        self.get_timezone.reset_mock()
+        self.location.save(**kwargs)
+        run_pending()
+        return self.get_timezone.call_count
+
+    def test_title_change_does_not_look_up_times(self):
+        self.location.title = 'Trailhead'
+        with mock.patch.object(CelestialTimes.objects, 'get_cached') as \
+                get_cached:
+            self.assertEqual(self.save_and_count_lookups(), 0)
+        self.assertFalse(get_cached.called)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_coordinate_change_computes_times(self):
+        self.location.latitude = Decimal('39.000000')
+        self.assertEqual(self.save_and_count_lookups(), 1)
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_moved_location_has_no_times_until_the_job_runs(self):
+        self.location.latitude = Decimal('39.000000')
+        self.location.longitude = Decimal('-105.000000')
+        self.location.save()
+        moved = TripLocation.objects.get()
+        self.assertEqual([getattr(moved, field)
+            for field in TripLocation.CELESTIAL_FIELDS], [None] * 4)
+        run_pending()
+        moved.refresh_from_db()
+        expected = CelestialTimes.objects.get(latitude=Decimal('39.000'),
+            longitude=Decimal('-105.000')).get_celestial_times()
+        self.assertEqual({field: getattr(moved, field)
+            for field in TripLocation.CELESTIAL_FIELDS}, expected)
+        self.assertEqual(moved.sunrise.hour, 7)
+
+    def test_date_change_to_cached_date_copies_times(self):
+        self.location.date = datetime.date(2018, 1, 2)
+        self.location.save()
+        run_pending()
+        self.location.date = datetime.date(2018, 1, 1)
+        self.location.sunrise = None
+        self.assertEqual(self.save_and_count_lookups(), 0)
+        self.assertEqual(self.location.sunrise.hour, 7)
+
+    def test_saving_again_after_a_change_does_not_look_up_times(self):
+        self.location.longitude = Decimal('-105.000000')
+        self.location.save()
+        run_pending()
+        self.location.title = 'Trailhead'
+        self.assertEqual(self.save_and_count_lookups(), 0)
+
+    def test_force_recomputes_cached_times(self):
+        self.assertEqual(self.save_and_count_lookups(force_celestial=True), 1)
+        self.assertEqual(Job.objects.count(), 2)
+        self.location.refresh_from_db()
+        self.assertEqual(self.location.sunrise.hour, 7)
+
+    def test_deferred_inputs_count_as_changed(self):
+        self.location = TripLocation.objects.only('title').get()
+        self.location.title = 'Trailhead'
+        with mock.patch.object(CelestialTimes.objects, 'get_cached',
+                wraps=CelestialTimes.objects.get_cached) as get_cached:
+            self.assertEqual(self.save_and_count_lookups(), 0)
+        self.assertEqual(get_cached.call_count, 1)
@@ -1,14 +1,21 @@
 import datetime
+from unittest import mock
 
+from django.core import mail
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.test import TestCase, RequestFactory
 from django.http import Http404
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from django.views.generic import DetailView
+from django.template.loader import render_to_string
 
-from trips.views import TripListView, TripDetailView, TripCreateView
-from trips.models import Trip, TripMember
+from account_info.models import EmergencyContact
+from trips.views import TripListView, TripDetailView, TripCreateView, \
+    EmergencyInfoListView
+from trips.models import Trip, TripMember, TripGuest, TripLocation
 
 
 User = get_user_model()
@@ -164,6 +171,86 @@ class TripListViewTests(TestCase):
         )
 
 
+class TripListPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='valid@email.com',
+            password='ValidPassword')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.today = timezone.localdate()
+
+    def create_trips(self, days):
+        trips = []
+        for day in days:
+            trip = Trip.objects.create(title='trip %d' % day,
+                start_date=self.today + datetime.timedelta(days=day))
+            TripMember.objects.create(trip=trip, member=self.user)
+            trips.append(trip)
+        return trips
+
+    def get_all_pages(self, name):
+        trips = []
+        url = reverse('trips:trip_list')
+        while url:
+            response = self.client.get(url)
+            trips.extend(response.context[name + '_trip_list'])
+            next_url = response.context[name + '_next_url']
+            url = next_url and reverse('trips:trip_list') + next_url
+        return trips
+
+    @mock.patch.object(TripListView, 'page_size', 2)
+    def test_upcoming_trips_are_paginated_soonest_first(self):
+        # Two trips on the same day are split over pages by id
+        trips = self.create_trips([3, 1, 1, 2, 0])
+        self.assertEqual(self.get_all_pages('upcoming'),
+            [trips[4], trips[1], trips[2], trips[3], trips[0]])
+
+    @mock.patch.object(TripListView, 'page_size', 2)
+    def test_past_trips_are_paginated_most_recent_first(self):
+        trips = self.create_trips([-3, -1, -2])
+        self.assertEqual(self.get_all_pages('past'),
+            [trips[1], trips[2], trips[0]])
+
+    @mock.patch.object(TripListView, 'page_size', 2)
+    def test_next_url_keeps_page_of_other_list(self):
+        self.create_trips([1, 2, 3, -1, -2, -3])
+        response = self.client.get(reverse('trips:trip_list'))
+        response = self.client.get(reverse('trips:trip_list') +
+            response.context['past_next_url'])
+        self.assertIn('past_after', response.context['upcoming_next_url'])
+
+    def test_trips_are_annotated(self):
+        trip, = self.create_trips([1])
+        TripMember.objects.create(trip=trip, member=User.objects.create_user(
+            email='pending@email.com'), accept_reqd=True)
+        TripLocation.objects.create(trip=trip, title='Trailhead',
+            location_type=TripLocation.BEGIN)
+        response = self.client.get(reverse('trips:trip_list'))
+        listed, = response.context['upcoming_trip_list']
+        self.assertEqual(listed.member_count, 1)
+        self.assertEqual(listed.trailhead_title, 'Trailhead')
+        self.assertContains(response, '<td>Trailhead</td>')
+
+    @mock.patch.object(TripListView, 'page_size', 5)
+    def test_queries_do_not_grow_with_number_of_trips(self):
+        self.create_trips([-1, 1])
+        self.client.get(reverse('trips:trip_list'))
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('trips:trip_list'))
+        self.create_trips(range(-20, 20))
+        self.client.get(reverse('trips:trip_list'))
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('trips:trip_list'))
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(len(response.context['upcoming_trip_list']), 5)
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get(reverse('trips:trip_list') +
+            '?upcoming_after=yesterday')
+        self.assertEqual(response.status_code, 404)
+
 class TripDetailViewTests(TestCase):
     def setUp(self):
         self.factory = RequestFactory()
@@ -200,6 +287,20 @@ class TripDetailViewTests(TestCase):
         response = TripDetailView.as_view()(request, pk=self.trip.id)
         self.assertTrue('trips/detail.html' in response.template_name)
 
+    def test_trip_links_are_shown_to_accepted_members_only(self):
+        self.client.force_login(self.user)
+        url = reverse('trips:trip_detail', args=(self.trip.id,))
+        schedule_url = reverse('trips:trip_schedule', args=(self.trip.id,))
+        tripmember = TripMember.objects.create(trip=self.trip,
+            member=self.user, accept_reqd=True)
+        self.assertNotContains(self.client.get(url), schedule_url)
+        tripmember.accept_reqd = False
+        tripmember.save()
+        response = self.client.get(url)
+        self.assertContains(response, schedule_url)
+        self.assertContains(response,
+            reverse('trips:trip_clone', args=(self.trip.id,)))
+
     def test_get_context_data_includes_key_page_title(self):
         '''
         The get_context_data includes key 'page_title'
@@ -243,6 +344,26 @@ class TripDetailViewTests(TestCase):
         context = view.get_context_data()
         self.assertNotIn('end_date', context)
 
+    def test_get_context_data_query_count_is_independent_of_trip_length(self):
+        request = self.factory.get('/fake/')
+        request.user = self.user
+        for number_nights in (1, 14):
+            trip = Trip.objects.create(title='title',
+                start_date=timezone.now().date(),
+                number_nights=number_nights)
+            for date in trip.get_date_choices():
+                TripLocation.objects.create(trip=trip, date_label=date,
+                    location_type=TripLocation.OBJECTIVE)
+            for date in trip.get_date_choices('night'):
+                TripLocation.objects.create(trip=trip, date_label=date,
+                    location_type=TripLocation.CAMP)
+            view = setup_view(TripDetailView(), request, pk=trip.id)
+            view.object = trip
+            # The trip and its locations
+            with self.assertNumQueries(2):
+                render_to_string('trips/partials/detail_content.html',
+                    view.get_context_data())
+
     def test_get_context_data_includes_key_trailhead(self):
         request = self.factory.get('/fake/')
         request.user = self.user
@@ -390,3 +511,247 @@ class TripCreateViewTests(TestCase):
         success_url = view.get_success_url()
         intended_url = reverse('trips:trip_detail', args=(trip.id,))
         self.assertEqual(success_url, intended_url)
+
+
+class TripScheduleViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='valid@email.com',
+            password='ValidPassword')
+        cls.start_date = timezone.now().date() + datetime.timedelta(days=7)
+        cls.trip = Trip.objects.create(title='title',
+            start_date=cls.start_date, number_nights=2)
+        cls.objective = TripLocation.objects.create(trip=cls.trip,
+            title='Summit', location_type=TripLocation.OBJECTIVE,
+            date_label=cls.trip.get_date_choices()[2])
+        TripMember.objects.create(trip=cls.trip, member=cls.user,
+            organizer=True, accept_reqd=False)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.url = reverse('trips:trip_schedule', args=(self.trip.id,))
+
+    def post(self, start_date, number_nights):
+        return self.client.post(self.url, {
+            'title': 'ignored',
+            'start_date': start_date,
+            'number_nights': number_nights,
+        }, follow=True)
+
+    def test_get_shows_form(self):
+        response = self.client.get(self.url)
+        self.assertTemplateUsed(response, 'trips/create.html')
+        self.assertTrue(response.context['form'].fields['title'].disabled)
+
+    def test_post_moves_trip_and_locations(self):
+        start_date = self.start_date + datetime.timedelta(days=30)
+        response = self.post(start_date, 2)
+        self.assertRedirects(response,
+            reverse('trips:trip_detail', args=(self.trip.id,)))
+        trip = Trip.objects.get(pk=self.trip.pk)
+        self.assertEqual(trip.title, 'title')
+        self.assertEqual(trip.start_date, start_date)
+        self.assertEqual(TripLocation.objects.get(pk=self.objective.pk).date,
+            start_date + datetime.timedelta(days=2))
+        self.assertNotContains(response, 'Outside the Trip Dates')
+
+    def test_shortened_trip_lists_locations_outside_it(self):
+        response = self.post(self.start_date, 1)
+        self.assertContains(response,
+            '1 location(s) are now outside the trip dates: Summit')
+        self.assertContains(response, 'Outside the Trip Dates')
+        self.assertContains(response, 'Summit (Day 3 - %s)' % (
+            self.start_date + datetime.timedelta(days=2)))
+
+    def test_non_member_cannot_change_dates(self):
+        other = User.objects.create_user(email='other@email.com',
+            password='ValidPassword')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        start_date = self.start_date + datetime.timedelta(days=30)
+        self.assertEqual(self.client.post(self.url, {
+            'title': 'ignored',
+            'start_date': start_date,
+            'number_nights': 2,
+        }).status_code, 404)
+        self.assertEqual(Trip.objects.get(pk=self.trip.pk).start_date,
+            self.start_date)
+
+
+class EmergencyInfoListViewTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def create_trip(self, number_members):
+        trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+        User.objects.bulk_create([
+            User(email='%d-%d@email.com' % (trip.id, i))
+            for i in range(number_members)
+        ])
+        users = User.objects.filter(email__startswith='%d-' % trip.id)
+        TripMember.objects.bulk_create([
+            TripMember(trip=trip, member=user) for user in users])
+        EmergencyContact.objects.bulk_create([
+            EmergencyContact(user=user, full_name='Contact %d' % i,
+                relationship='Parent')
+            for user in users for i in range(2)
+        ])
+        return trip
+
+    def get_context_data(self, trip, user=None):
+        request = self.factory.get('/fake/')
+        request.user = user
+        view = setup_view(EmergencyInfoListView(), request, trip_id=trip.id)
+        view.object_list = view.get_queryset()
+        return view.get_context_data()
+
+    def test_emergency_info_pairs_members_with_contacts(self):
+        trip = self.create_trip(2)
+        user = User.objects.create_user(email='pending@email.com',
+            password='ValidPassword')
+        TripMember.objects.create(trip=trip, member=user, accept_reqd=True)
+        emergency_info = self.get_context_data(trip)['emergency_info']
+        self.assertEqual(len(emergency_info), 2)
+        for member, emergency_contacts in emergency_info:
+            self.assertEqual(
+                emergency_contacts,
+                list(member.emergencycontact_set.all())
+            )
+
+    def test_query_count_is_independent_of_member_count(self):
+        for number_members in (2, 20, 200):
+            trip = self.create_trip(number_members)
+            user = trip.trip_members.first()
+            # The trip, its members and their emergency contacts
+            with self.assertNumQueries(3):
+                context = self.get_context_data(trip, user)
+                html = render_to_string(
+                    'trips/partials/emergency_info_content.html', context)
+            self.assertEqual(html.count('Contact 1'), number_members)
+
+class InviteViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='organizer@email.com',
+            password='ValidPassword')
+        self.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+        self.client.force_login(self.user)
+
+    def invite(self, url_name, email):
+        return self.client.post(reverse(url_name),
+            {'trip_id': self.trip.id, 'email': email})
+
+    def test_inviting_member_twice_returns_400(self):
+        User.objects.create_user(email='member@email.com',
+            password='ValidPassword')
+        self.assertEqual(
+            self.invite('trips:add_trip_member', 'member@email.com')
+                .status_code, 200)
+        response = self.invite('trips:add_trip_member', 'member@email.com')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('email', response.json())
+        self.assertEqual(TripMember.objects.filter(trip=self.trip).count(), 1)
+
+    def test_inviting_guest_twice_in_other_case_returns_400(self):
+        self.assertEqual(
+            self.invite('trips:add_trip_guest', 'guest@email.com')
+                .status_code, 200)
+        response = self.invite('trips:add_trip_guest', 'Guest@Email.com')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(TripGuest.objects.filter(trip=self.trip).count(), 1)
+
+class BulkInviteViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='organizer@email.com',
+            password='ValidPassword')
+        cls.member = User.objects.create_user(email='member@email.com',
+            password='ValidPassword')
+        cls.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def invite(self, emails):
+        return self.client.post(reverse('trips:bulk_invite'),
+            {'trip_id': self.trip.id, 'emails': emails})
+
+    def get_statuses(self, response):
+        return {result['email']: result['status']
+            for result in response.json()['results']}
+
+    def test_members_and_guests_are_invited(self):
+        response = self.invite(['Member@Email.com', 'guest@email.com'])
+        self.assertEqual(self.get_statuses(response), {
+            'Member@Email.com': 'member',
+            'guest@email.com': 'guest',
+        })
+        tripmember = TripMember.objects.get(trip=self.trip)
+        self.assertEqual(tripmember.member, self.member)
+        self.assertTrue(tripmember.accept_reqd)
+        self.assertTrue(TripGuest.objects.filter(trip=self.trip,
+            email='guest@email.com').exists())
+
+    def test_emails_can_be_one_separated_string(self):
+        response = self.invite('a@email.com, b@email.com;\nc@email.com')
+        self.assertEqual(len(self.get_statuses(response)), 3)
+        self.assertEqual(TripGuest.objects.filter(trip=self.trip).count(), 3)
+
+    def test_invitations_are_sent_over_one_connection(self):
+        with mock.patch('trips.views.get_connection',
+                side_effect=mail.get_connection) as get_connection:
+            self.invite(['member@email.com', 'a@email.com', 'b@email.com'])
+        self.assertEqual(get_connection.call_count, 1)
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            ['a@email.com', 'b@email.com', 'member@email.com'])
+
+    def test_already_invited_and_invalid_emails(self):
+        TripMember.objects.create(trip=self.trip, member=self.member)
+        TripGuest.objects.create(trip=self.trip, email='guest@email.com')
+        response = self.invite(['member@email.com', 'GUEST@email.com',
+            'not an email', 'guest@email.com'])
+        self.assertEqual(self.get_statuses(response), {
+            'member@email.com': 'already_invited',
+            'GUEST@email.com': 'already_invited',
+            'not': 'invalid',
+            'an': 'invalid',
+            'email': 'invalid',
+        })
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_invitations_are_inserted_after_a_concurrent_invitation(self):
+        def bulk_create(instances):
+            # PostgreSQL sets the ids before the insert fails
+            for i, instance in enumerate(instances):
+                instance.pk = 1000 + i
+            raise IntegrityError
+        with mock.patch.object(TripMember.objects, 'bulk_create',
+                side_effect=bulk_create), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.invite(['member@email.com', 'guest@email.com'])
+        self.assertEqual(self.get_statuses(response), {
+            'member@email.com': 'member',
+            'guest@email.com': 'guest',
+        })
+        self.assertFalse([query for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE "trips_tripmember"')])
+        self.assertNotEqual(TripMember.objects.get(trip=self.trip).pk, 1000)
+
+    def test_queries_do_not_grow_with_number_of_emails(self):
+        self.invite(['warm@email.com'])
+        with CaptureQueriesContext(connection) as one:
+            self.invite(['member@email.com', 'a@email.com'])
+        TripMember.objects.all().delete()
+        TripGuest.objects.all().delete()
+        with CaptureQueriesContext(connection) as many:
+            self.invite(['member@email.com'] + [
+                'guest%d@email.com' % i for i in range(20)])
+        self.assertEqual(len(many), len(one))
+
+    def test_no_emails_returns_400(self):
+        response = self.invite('')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('emails', response.json())
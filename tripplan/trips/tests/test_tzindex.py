@@ -0,0 +1,169 @@
+import datetime
+import math
+import os
+import shutil
+import tempfile
+import timeit
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from trips import celestial, tzindex
+from trips.models import Trip, TripLocation
+
+
+def square(min_lng, min_lat, max_lng, max_lat):
+    return [(min_lng, min_lat), (max_lng, min_lat), (max_lng, max_lat),
+        (min_lng, max_lat)]
+
+
+def circle(lng, lat, radius, vertices):
+    return [
+        (lng + radius * math.cos(2 * math.pi * i / vertices),
+            lat + radius * math.sin(2 * math.pi * i / vertices))
+        for i in range(vertices)
+    ]
+
+
+POLYGONS = [
+    # A zone with an enclave cut out of it
+    ('America/Denver', [
+        square(-114.0, 37.0, -102.0, 45.0),
+        square(-110.5, 40.5, -109.5, 41.5),
+    ]),
+    ('America/Phoenix', [square(-110.5, 40.5, -109.5, 41.5)]),
+    # Concave "L" shaped zone
+    ('America/Chicago', [[
+        (-102.0, 30.0), (-90.0, 30.0), (-90.0, 33.0), (-99.0, 33.0),
+        (-99.0, 45.0), (-102.0, 45.0),
+    ]]),
+    # Many vertices, to check lookups stay fast on detailed boundaries
+    ('Europe/London', [circle(-2.0, 53.0, 4.0, 20000)]),
+]
+
+
+class TimezoneIndexTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TimezoneIndexTests, cls).setUpClass()
+        cls.tempdir = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.tempdir, 'timezones.idx')
+        tzindex.write_index(cls.path, POLYGONS)
+        cls.index = tzindex.TimezoneIndex(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.index.close()
+        shutil.rmtree(cls.tempdir)
+        super(TimezoneIndexTests, cls).tearDownClass()
+
+    def test_lookup_inside_polygon(self):
+        self.assertEqual(self.index.lookup(39.0, -105.0), 'America/Denver')
+
+    def test_lookup_inside_hole_returns_enclave_zone(self):
+        self.assertEqual(self.index.lookup(41.0, -110.0), 'America/Phoenix')
+
+    def test_lookup_in_concave_region(self):
+        self.assertEqual(self.index.lookup(31.0, -95.0), 'America/Chicago')
+        self.assertEqual(self.index.lookup(40.0, -100.5), 'America/Chicago')
+        self.assertIsNone(self.index.lookup(40.0, -95.0))
+
+    def test_lookup_near_detailed_boundary(self):
+        self.assertEqual(self.index.lookup(53.0, 1.99), 'Europe/London')
+        self.assertIsNone(self.index.lookup(53.0, 2.01))
+
+    def test_lookup_outside_all_polygons_returns_none(self):
+        self.assertIsNone(self.index.lookup(0.0, 0.0))
+
+    def test_lookup_accepts_decimal_coordinates(self):
+        from decimal import Decimal
+        self.assertEqual(
+            self.index.lookup(Decimal('39.000000'), Decimal('-105.000000')),
+            'America/Denver'
+        )
+
+    def test_lookup_is_well_under_a_millisecond(self):
+        number = 1000
+        seconds = timeit.timeit(
+            lambda: self.index.lookup(53.0, 1.99), number=number)
+        self.assertLess(seconds / number, 0.001)
+
+    def test_invalid_file_raises_value_error(self):
+        path = os.path.join(self.tempdir, 'invalid.idx')
+        with open(path, 'wb') as f:
+            f.write(b'\x00' * 256)
+        self.assertRaises(ValueError, lambda: tzindex.TimezoneIndex(path))
+
+    def test_nautical_timezone(self):
+        self.assertEqual(tzindex.nautical_timezone(0), 'Etc/GMT')
+        self.assertEqual(tzindex.nautical_timezone(-150), 'Etc/GMT+10')
+        self.assertEqual(tzindex.nautical_timezone(100), 'Etc/GMT-7')
+        self.assertEqual(tzindex.nautical_timezone(179.9), 'Etc/GMT-12')
+
+
+class TimezoneAtTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.trip = Trip.objects.create(title='title',
+            start_date=timezone.now().date())
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'timezones.idx')
+        tzindex.write_index(self.path, POLYGONS)
+        tzindex._index = None
+        celestial.reset()
+
+    def tearDown(self):
+        if tzindex._index:
+            tzindex._index.close()
+        tzindex._index = None
+        shutil.rmtree(self.tempdir)
+
+    def test_timezone_at_returns_none_without_index(self):
+        missing = os.path.join(self.tempdir, 'missing.idx')
+        with override_settings(TIMEZONE_INDEX_PATH=missing):
+            self.assertIsNone(tzindex.timezone_at(39.0, -105.0))
+
+    def test_timezone_at_falls_back_to_nautical_zone_at_sea(self):
+        with override_settings(TIMEZONE_INDEX_PATH=self.path):
+            self.assertEqual(tzindex.timezone_at(0.0, -150.0), 'Etc/GMT+10')
+
+    def test_index_is_loaded_once(self):
+        with override_settings(TIMEZONE_INDEX_PATH=self.path):
+            self.assertIs(tzindex.get_index(), tzindex.get_index())
+
+    @mock.patch('trips.models.httpclient.get')
+    def test_get_timezone_uses_index_without_network(self, requests_get):
+        location = TripLocation(
+            date=datetime.date(2018, 1, 1),
+            trip=self.trip,
+            location_type=TripLocation.BEGIN,
+            latitude=39.0,
+            longitude=-105.0
+        )
+        with override_settings(TIMEZONE_INDEX_PATH=self.path):
+            self.assertEqual(
+                location.get_timezone(),
+                {'timeZoneId': 'America/Denver'}
+            )
+        self.assertFalse(requests_get.called)
+
+    @mock.patch('trips.models.httpclient.get')
+    def test_set_suntimes_clears_times_when_timezone_unknown(self,
+            requests_get):
+        requests_get.return_value.json.return_value = {
+            'status': 'REQUEST_DENIED'}
+        location = TripLocation(
+            date=datetime.date(2018, 1, 1),
+            trip=self.trip,
+            location_type=TripLocation.BEGIN,
+            latitude=39.0,
+            longitude=-105.0
+        )
+        missing = os.path.join(self.tempdir, 'missing.idx')
+        with override_settings(TIMEZONE_INDEX_PATH=missing):
+            location.set_suntimes()
+        self.assertIsNone(location.sunrise)
+        self.assertIsNone(location.sunset)
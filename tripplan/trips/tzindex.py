@@ -0,0 +1,338 @@
+"""
+Offline timezone lookup for latitude/longitude pairs.
+
+Timezone boundaries are stored in a single binary file that is memory
+mapped on first use. Mapping the file (instead of reading it) lets every
+gunicorn worker on a machine share one copy of the data through the page
+cache. The file is built from the timezone-boundary-builder GeoJSON release
+with the build_timezone_index management command.
+
+Two indexes keep lookups well under a millisecond:
+
+* A 1 degree grid. Each cell lists the polygons whose bounding box touches
+  it. Cells that lie entirely inside a polygon are flagged as solid and
+  are answered without a point-in-polygon test.
+* Latitude bands per polygon. The even-odd ray casting test only visits
+  the polygon edges in the band containing the point.
+
+File layout (little-endian, every section aligned to 8 bytes):
+
+    header
+    zone names          utf-8, newline separated
+    polygon_zone        uint32[polygons]
+    polygon_bbox        float64[polygons * 4]   min_lng, min_lat, max_lng, max_lat
+    polygon_bands       uint32[polygons + 1]    offsets into band_offsets
+    band_offsets        uint32[bands + 1]       offsets into band_edges
+    band_edges          uint32[edges]           index of an edge's first point
+    points              int32[points * 2]       lng, lat in 1e-7 degrees
+    cell_offsets        uint32[cells + 1]       offsets into cell_entries
+    cell_entries        uint32[entries]         polygon id, SOLID_CELL flag
+"""
+import math
+import mmap
+import struct
+import threading
+
+from django.conf import settings
+
+
+MAGIC = b'GYBTZ\x00\x01\x00'
+HEADER = struct.Struct('<8sIIIIIIIIId')
+SCALE = 10 ** 7
+CELL_SIZE = 1.0
+SOLID_CELL = 0x80000000
+# Target number of edges per latitude band when building the index
+EDGES_PER_BAND = 32
+MAX_BANDS = 4096
+
+
+class TimezoneIndex:
+    """
+    Read-only view of a timezone index file. Use get_index() rather than
+    instantiating this class so the file is only mapped once per process.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as index_file:
+            self._mmap = mmap.mmap(
+                index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = view = memoryview(self._mmap)
+
+        (magic, n_zones, n_polygons, n_bands, n_edges, n_points,
+            self.grid_cols, self.grid_rows, n_entries, names_size,
+            self.cell_size) = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError('%s is not a timezone index file' % path)
+
+        offset = _align(HEADER.size)
+        names = bytes(view[offset:offset + names_size]).decode('utf-8')
+        self.zones = names.split('\n') if n_zones else []
+        offset = _align(offset + names_size)
+
+        sections = (
+            ('polygon_zone', 'I', n_polygons),
+            ('polygon_bbox', 'd', n_polygons * 4),
+            ('polygon_bands', 'I', n_polygons + 1),
+            ('band_offsets', 'I', n_bands + 1),
+            ('band_edges', 'I', n_edges),
+            ('points', 'i', n_points * 2),
+            ('cell_offsets', 'I', self.grid_cols * self.grid_rows + 1),
+            ('cell_entries', 'I', n_entries),
+        )
+        for name, fmt, count in sections:
+            size = struct.calcsize(fmt) * count
+            setattr(self, name, view[offset:offset + size].cast(fmt))
+            offset = _align(offset + size)
+
+    def lookup(self, latitude, longitude):
+        """
+        Returns the IANA zone name for a point, or None if the point is
+        not inside any of the indexed polygons.
+        """
+        latitude = float(latitude)
+        longitude = float(longitude)
+        col = min(max(int((longitude + 180) / self.cell_size), 0),
+            self.grid_cols - 1)
+        row = min(max(int((latitude + 90) / self.cell_size), 0),
+            self.grid_rows - 1)
+        cell = row * self.grid_cols + col
+
+        for i in range(self.cell_offsets[cell], self.cell_offsets[cell + 1]):
+            entry = self.cell_entries[i]
+            if entry & SOLID_CELL:
+                return self.zones[self.polygon_zone[entry & ~SOLID_CELL]]
+            if self._contains(entry, latitude, longitude):
+                return self.zones[self.polygon_zone[entry]]
+        return None
+
+    def _contains(self, polygon, latitude, longitude):
+        bbox = self.polygon_bbox
+        min_lng, min_lat, max_lng, max_lat = bbox[polygon * 4:polygon * 4 + 4]
+        if not (min_lng <= longitude <= max_lng and
+                min_lat <= latitude <= max_lat):
+            return False
+
+        first_band = self.polygon_bands[polygon]
+        n_bands = self.polygon_bands[polygon + 1] - first_band
+        band = _band_number(latitude, min_lat, max_lat, n_bands)
+
+        x = longitude * SCALE
+        y = latitude * SCALE
+        points = self.points
+        inside = False
+        band_offsets = self.band_offsets
+        for i in range(band_offsets[first_band + band],
+                band_offsets[first_band + band + 1]):
+            p = self.band_edges[i] * 2
+            x1, y1, x2, y2 = points[p], points[p + 1], points[p + 2], \
+                points[p + 3]
+            if (y1 > y) != (y2 > y) and \
+                    x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                inside = not inside
+        return inside
+
+    def close(self):
+        for name in ('polygon_zone', 'polygon_bbox', 'polygon_bands',
+                'band_offsets', 'band_edges', 'points', 'cell_offsets',
+                'cell_entries'):
+            getattr(self, name).release()
+        self._view.release()
+        self._mmap.close()
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _band_number(latitude, min_lat, max_lat, n_bands):
+    if max_lat <= min_lat:
+        return 0
+    band = int((latitude - min_lat) / (max_lat - min_lat) * n_bands)
+    return min(max(band, 0), n_bands - 1)
+
+
+def _point_in_rings(rings, x, y):
+    inside = False
+    for ring in rings:
+        for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+            if (y1 > y) != (y2 > y) and \
+                    x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                inside = not inside
+    return inside
+
+
+def write_index(path, polygons, cell_size=CELL_SIZE):
+    """
+    Build an index file.
+
+    Input an iterable of (zone_name, rings) tuples. Each polygon is a list
+    of rings, the first being the outer boundary and the rest holes, with
+    every ring a list of (longitude, latitude) pairs. Rings are closed
+    automatically if the last point does not repeat the first one.
+    """
+    zones = []
+    zone_ids = {}
+    polygon_zone = []
+    polygon_bbox = []
+    polygon_bands = [0]
+    band_offsets = [0]
+    band_edges = []
+    points = []
+    scaled_polygons = []
+
+    for zone, rings in polygons:
+        if zone not in zone_ids:
+            zone_ids[zone] = len(zones)
+            zones.append(zone)
+
+        scaled_rings = []
+        edges = []
+        for ring in rings:
+            ring = [(int(round(lng * SCALE)), int(round(lat * SCALE)))
+                for lng, lat in ring]
+            if ring[0] != ring[-1]:
+                ring.append(ring[0])
+            start = len(points)
+            points.extend(ring)
+            edges.extend(range(start, start + len(ring) - 1))
+            scaled_rings.append(ring)
+
+        lngs = [p[0] for ring in scaled_rings for p in ring]
+        lats = [p[1] for ring in scaled_rings for p in ring]
+        bbox = (min(lngs) / SCALE, min(lats) / SCALE,
+            max(lngs) / SCALE, max(lats) / SCALE)
+
+        n_bands = min(max(len(edges) // EDGES_PER_BAND, 1), MAX_BANDS)
+        bands = [[] for _ in range(n_bands)]
+        for edge in edges:
+            y1 = points[edge][1] / SCALE
+            y2 = points[edge + 1][1] / SCALE
+            low = _band_number(min(y1, y2), bbox[1], bbox[3], n_bands)
+            high = _band_number(max(y1, y2), bbox[1], bbox[3], n_bands)
+            for band in range(low, high + 1):
+                bands[band].append(edge)
+        for band in bands:
+            band_edges.extend(band)
+            band_offsets.append(len(band_edges))
+
+        polygon_zone.append(zone_ids[zone])
+        polygon_bbox.extend(bbox)
+        polygon_bands.append(len(band_offsets) - 1)
+        scaled_polygons.append((bbox, scaled_rings))
+
+    grid_cols = int(math.ceil(360 / cell_size))
+    grid_rows = int(math.ceil(180 / cell_size))
+    cells = [[] for _ in range(grid_cols * grid_rows)]
+
+    def cell_range(value, origin, count):
+        return min(max(int((value + origin) / cell_size), 0), count - 1)
+
+    for polygon_id, (bbox, rings) in enumerate(scaled_polygons):
+        col_min = cell_range(bbox[0], 180, grid_cols)
+        col_max = cell_range(bbox[2], 180, grid_cols)
+        row_min = cell_range(bbox[1], 90, grid_rows)
+        row_max = cell_range(bbox[3], 90, grid_rows)
+
+        # Cells touched by the bounding box of any edge may be crossed by
+        # the boundary. Every other cell is either fully inside or outside.
+        boundary = set()
+        for ring in rings:
+            for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+                for row in range(
+                        cell_range(min(y1, y2) / SCALE, 90, grid_rows),
+                        cell_range(max(y1, y2) / SCALE, 90, grid_rows) + 1):
+                    for col in range(
+                            cell_range(min(x1, x2) / SCALE, 180, grid_cols),
+                            cell_range(max(x1, x2) / SCALE, 180, grid_cols)
+                            + 1):
+                        boundary.add((row, col))
+
+        for row in range(row_min, row_max + 1):
+            for col in range(col_min, col_max + 1):
+                cell = row * grid_cols + col
+                if (row, col) in boundary:
+                    cells[cell].append(polygon_id)
+                    continue
+                center_x = ((col + 0.5) * cell_size - 180) * SCALE
+                center_y = ((row + 0.5) * cell_size - 90) * SCALE
+                if _point_in_rings(rings, center_x, center_y):
+                    cells[cell].append(polygon_id | SOLID_CELL)
+
+    cell_offsets = [0]
+    cell_entries = []
+    for entries in cells:
+        # Solid cells answer immediately, so check them first
+        cell_entries.extend(sorted(entries, key=lambda e: not e & SOLID_CELL))
+        cell_offsets.append(len(cell_entries))
+
+    names = '\n'.join(zones).encode('utf-8')
+    flat_points = [value for point in points for value in point]
+    sections = (
+        ('I', polygon_zone),
+        ('d', polygon_bbox),
+        ('I', polygon_bands),
+        ('I', band_offsets),
+        ('I', band_edges),
+        ('i', flat_points),
+        ('I', cell_offsets),
+        ('I', cell_entries),
+    )
+
+    with open(path, 'wb') as index_file:
+        header = HEADER.pack(MAGIC, len(zones), len(polygon_zone),
+            len(band_offsets) - 1, len(band_edges), len(points),
+            grid_cols, grid_rows, len(cell_entries), len(names), cell_size)
+        _write_aligned(index_file, header)
+        _write_aligned(index_file, names)
+        for fmt, values in sections:
+            _write_aligned(
+                index_file, struct.pack('<%d%s' % (len(values), fmt), *values))
+
+
+def _write_aligned(index_file, data):
+    index_file.write(data)
+    index_file.write(b'\x00' * (_align(len(data)) - len(data)))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Returns the TimezoneIndex for settings.TIMEZONE_INDEX_PATH, mapping the
+    file on first use. Returns None if the file does not exist.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                path = getattr(settings, 'TIMEZONE_INDEX_PATH', None)
+                try:
+                    _index = TimezoneIndex(path) if path else False
+                except FileNotFoundError:
+                    _index = False
+    return _index or None
+
+
+def nautical_timezone(longitude):
+    """
+    Returns the nautical timezone (e.g. 'Etc/GMT+8') for a longitude.
+    Used for points at sea, which belong to no timezone polygon.
+    Note the inverted sign of the Etc/GMT zone names.
+    """
+    offset = int(math.floor((float(longitude) + 7.5) / 15))
+    offset = min(max(offset, -12), 12)
+    if offset == 0:
+        return 'Etc/GMT'
+    return 'Etc/GMT%+d' % -offset
+
+
+def timezone_at(latitude, longitude):
+    """
+    Returns the IANA zone name for a point using the offline index.
+    Returns None if no index file is installed.
+    """
+    index = get_index()
+    if index is None:
+        return None
+    return index.lookup(latitude, longitude) or nautical_timezone(longitude)
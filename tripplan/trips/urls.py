@@ -11,6 +11,10 @@ urlpatterns = [
     url(r'^(?P<pk>[0-9]+)/$',
         views.TripDetailView.as_view(), name='trip_detail'),
     url(r'^create/$', views.TripCreateView.as_view(), name='trip_create'),
+    url(r'^(?P<pk>[0-9]+)/schedule/$',
+        views.TripScheduleView.as_view(), name='trip_schedule'),
+    url(r'^(?P<pk>[0-9]+)/clone/$',
+        views.TripCloneView.as_view(), name='trip_clone'),
 
     # Locations
     url(r'^(?P<trip_id>[0-9]+)/create/(?P<location_type>[\w]+)/$',
@@ -47,6 +51,8 @@ urlpatterns = [
         views.AddTripMemberView.as_view(), name='add_trip_member'),
     url(r'^ajax/add_trip_guest/$',
         views.AddTripGuestView.as_view(), name='add_trip_guest'),
+    url(r'^ajax/bulk_invite/$',
+        views.BulkInviteView.as_view(), name='bulk_invite'),
     url(r'^ajax/update_trip_member/$',
         views.UpdateTripMemberView.as_view(), name='update_trip_member'),
     url(r'^ajax/delete_trip_member/$',
@@ -5,17 +5,26 @@ from django.urls import reverse, reverse_lazy
 from django.views.generic import UpdateView, ListView, \
     CreateView, DeleteView, DetailView, FormView, View, TemplateView
 from django.utils import timezone
+from django.contrib import messages
 from django.contrib.auth import authenticate
 from django.http import JsonResponse, Http404, HttpResponse
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection
+from django.core.validators import validate_email
+from django.core.exceptions import ValidationError
 from django.template import RequestContext
 from django.template.loader import render_to_string
-from django.db.models.functions import Lower
 from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils.functional import SimpleLazyObject
 
 
 import pytz
 
+from . import fragments, notifications
+from .cloning import clone_trip
+from .loaders import get_trip
+from .pagination import get_keyset_page
 from .models import Trip, TripLocation, TripMember, ItemNotification, \
     TripGuest, Item, ItemOwner
 from account_info.models import EmergencyContact
@@ -23,7 +32,18 @@ from account_info.models import EmergencyContact
 from account_info.models import User
 
 from .forms import TripForm, LocationForm, SearchForm, TripMemberForm, \
-    TripGuestForm, ItemModelForm, ItemOwnerModelForm
+    TripGuestForm, ItemModelForm, ItemOwnerModelForm, BulkInviteForm, \
+    TripScheduleForm, TripCloneForm
+
+
+def email_iexact_q(field, emails):
+    """
+    Returns a Q matching any of the emails, ignoring case
+    """
+    q = Q(pk__in=[])
+    for email in emails:
+        q |= Q(**{field + '__iexact': email})
+    return q
 
 
 class LoginRequiredMixin:
@@ -68,12 +88,29 @@ class FlattenTripMemberMixin:
         return flat_list
 
 class InviteEmailMixin:
-    def email_invitation(self, status="registered"):
-        trip = get_object_or_404(
-            Trip,
-            id=int(self.request.POST.get('trip_id'))
-        )
-
+    def save_invitation(self, instance):
+        """
+        Saves a TripMember or TripGuest. Returns False, leaving the request
+        transaction usable, if the person is already invited to the trip.
+        """
+        try:
+            with transaction.atomic():
+                instance.save()
+        except IntegrityError:
+            return False
+        return True
+
+    def already_invited(self):
+        return JsonResponse({
+            'email': ['%s has already been invited to this trip.' %
+                self.request.POST.get('email')]
+        }, status=400)
+
+    def make_invitation(self, trip, email, status="registered"):
+        """
+        Returns the invitation email to a trip. status is "registered" for
+        a member and "nonregistered" for a guest.
+        """
         if status == "nonregistered":
             link_action =  reverse('authentication:signup')
             template = "trips/email/invite_nonregistered.txt"
@@ -92,15 +129,15 @@ class InviteEmailMixin:
             }
         )
         from_email = 'noreply@getyrbeta.com'
-        to_email = (self.request.POST.get('email'),)
-
-        send_mail(
-            subject,
-            message,
-            from_email,
-            to_email,
-            fail_silently=False,
+        return EmailMessage(subject, message, from_email, (email,))
+
+    def email_invitation(self, status="registered"):
+        trip = get_object_or_404(
+            Trip,
+            id=int(self.request.POST.get('trip_id'))
         )
+        self.make_invitation(trip, self.request.POST.get('email'),
+            status).send(fail_silently=False)
 
 class LocationGeneralMixin:
     """
@@ -154,8 +191,8 @@ class LocationFormMixin:
             date_type = 'night'
         else:
             date_type = 'day'
-        date_list = Trip.objects.get(pk=self.kwargs.get(
-            'trip_id')).get_date_choices(date_type)
+        kwargs['trip'] = get_trip(self.request, self.kwargs.get('trip_id'))
+        date_list = kwargs['trip'].get_date_choices(date_type)
         choices = []
         for item in date_list:
             choices.append((item, item))
@@ -170,8 +207,15 @@ class LocationFormMixin:
 
 
 class TripListView(LoginRequiredMixin, ListView):
+    """
+    The upcoming trips of the user, soonest first, and the past trips, most
+    recent first. Both lists are paginated by start date, see
+    trips.pagination, so the page makes the same queries however many
+    trips the user has.
+    """
     model = Trip
     template_name = 'trips/index.html'
+    page_size = 20
 
     def get_queryset(self):
         queryset = self.request.user.trip_set.all()
@@ -179,16 +223,44 @@ class TripListView(LoginRequiredMixin, ListView):
 
     def get_context_data(self, **kwargs):
         context = super(TripListView, self).get_context_data(**kwargs)
-        context['upcoming_trip_list'] = self.object_list.filter(
-            start_date__gte=timezone.now()).order_by('start_date')
-        context['past_trip_list'] = self.object_list.filter(
-            start_date__lt=timezone.now()).order_by('start_date')
+        trips = self.object_list.with_list_annotations()
+        today = timezone.localdate()
+        for name, queryset, descending in (
+                ('upcoming', trips.filter(start_date__gte=today), False),
+                ('past', trips.filter(start_date__lt=today), True)):
+            try:
+                page = get_keyset_page(queryset,
+                    self.request.GET.get(name + '_after'), self.page_size,
+                    descending)
+            except ValueError:
+                raise Http404('Invalid %s trips cursor' % name)
+            context[name + '_trip_list'] = page.object_list
+            context[name + '_next_url'] = self.get_page_url(name,
+                page.next_cursor)
         return context
 
+    def get_page_url(self, name, cursor):
+        """
+        Returns the url of the page of the list after the cursor, keeping
+        the page of the other list, or None if there is no cursor
+        """
+        if cursor is None:
+            return None
+        query = self.request.GET.copy()
+        query[name + '_after'] = cursor
+        return '?' + query.urlencode()
+
 class TripDetailView(LoginRequiredMixin, DetailView):
     model = Trip
     template_name = 'trips/detail.html'
 
+    def get_queryset(self):
+        # Only accepted members are shown the links to change the dates and
+        # copy the trip
+        return Trip.objects.annotate(is_accepted_member=Exists(
+            TripMember.objects.filter(trip=OuterRef('pk'),
+                member=self.request.user, accept_reqd=False)))
+
     def get_context_data(self, **kwargs):
         context = super(TripDetailView, self).get_context_data(**kwargs)
         trip = self.get_object()
@@ -196,14 +268,11 @@ class TripDetailView(LoginRequiredMixin, DetailView):
         if trip.number_nights > 0:
             context['end_date'] = trip.start_date + datetime.timedelta(
                 days=trip.number_nights)
+        context['is_accepted_member'] = trip.is_accepted_member
 
-        trailhead = trip.get_trailhead()
-        context['trailhead'] = trailhead
-        context['endpoint'] = trip.get_endpoint()
-
-        context['objective_dict'] = trip.get_location_context(
-            TripLocation.OBJECTIVE)
-        context['camp_dict'] = trip.get_location_context(TripLocation.CAMP)
+        # Only loaded if the fragment is not cached
+        context.update(fragments.lazy_context(trip.get_route_context,
+            Trip.ROUTE_CONTEXT_KEYS))
         return context
 
 class TripCreateView(LoginRequiredMixin, CreateView):
@@ -235,6 +304,98 @@ class TripCreateView(LoginRequiredMixin, CreateView):
     def get_success_url(self):
         return reverse('trips:trip_detail', args=(self.object.id,))
 
+class TripScheduleView(LoginRequiredMixin, UpdateView):
+    """
+    Changes the start date and number of nights of a trip. Locations move
+    with the trip, see Trip.reschedule().
+    """
+    model = Trip
+    template_name = 'trips/create.html'
+    form_class = TripScheduleForm
+
+    def get_object(self, queryset=None):
+        trip = get_trip(self.request, self.kwargs['pk'])
+        if not trip.tripmember_set.filter(member=self.request.user,
+                accept_reqd=False).exists():
+            raise Http404('Not a member of the trip')
+        return trip
+
+    def get_context_data(self, **kwargs):
+        context = super(TripScheduleView, self).get_context_data(**kwargs)
+        context['page_title'] = 'Change trip dates'
+        context['submit_button_title'] = 'Save Dates'
+        context['cancel_button_path'] = 'trips:trip_list'
+        return context
+
+    def form_valid(self, form):
+        outside_locations = self.object.reschedule(
+            form.cleaned_data['start_date'],
+            form.cleaned_data['number_nights']
+        )
+        if outside_locations:
+            messages.add_message(self.request, messages.WARNING,
+                '%d location(s) are now outside the trip dates: %s' % (
+                    len(outside_locations), ', '.join(
+                        location.title or location.get_location_type_verbose
+                        for location in outside_locations)))
+        return redirect(self.get_success_url())
+
+    def get_success_url(self):
+        return reverse('trips:trip_detail', args=(self.object.id,))
+
+class TripCloneView(LoginRequiredMixin, InviteEmailMixin, FormView):
+    """
+    Copies a trip of the user to a new start date, see trips.cloning. The
+    members and guests of the trip can be invited to the copy; their
+    invitations are sent over one mail connection.
+    """
+    template_name = 'trips/create.html'
+    form_class = TripCloneForm
+
+    def get_trip(self):
+        trip = get_trip(self.request, self.kwargs['pk'])
+        if not trip.tripmember_set.filter(member=self.request.user,
+                accept_reqd=False).exists():
+            raise Http404('Not a member of the trip')
+        return trip
+
+    def get_initial(self):
+        trip = self.get_trip()
+        return {
+            'title': trip.title,
+            'number_nights': trip.number_nights,
+        }
+
+    def get_context_data(self, **kwargs):
+        context = super(TripCloneView, self).get_context_data(**kwargs)
+        context['page_title'] = 'Copy %s' % self.get_trip().title
+        context['submit_button_title'] = 'Copy Trip'
+        context['cancel_button_path'] = 'trips:trip_list'
+        return context
+
+    def form_valid(self, form):
+        clone = clone_trip(
+            self.get_trip(),
+            form.cleaned_data['start_date'],
+            self.request.user,
+            title=form.cleaned_data['title'],
+            number_nights=form.cleaned_data['number_nights'],
+            invite_members=form.cleaned_data['invite_members']
+        )
+        invitations = [
+            self.make_invitation(clone, trip_member.member.email,
+                'registered')
+            for trip_member in clone.tripmember_set.filter(
+                accept_reqd=True).select_related('member')
+        ]
+        invitations.extend(
+            self.make_invitation(clone, email, 'nonregistered')
+            for email in clone.tripguest_set.values_list('email', flat=True)
+        )
+        if invitations:
+            get_connection(fail_silently=False).send_messages(invitations)
+        return redirect('trips:trip_detail', clone.id)
+
 class LocationCreateView(LoginRequiredMixin, LocationGeneralMixin,
     LocationFormMixin, CreateView):
     def set_instance_variables(self, **kwargs):
@@ -248,7 +409,7 @@ class LocationCreateView(LoginRequiredMixin, LocationGeneralMixin,
             raise Http404('Invalid location type: ' + url_location_type)
 
     def get_initial(self):
-        trip = get_object_or_404(Trip, pk=self.kwargs.get('trip_id'))
+        trip = get_trip(self.request, self.kwargs.get('trip_id'))
         location_type = self.kwargs.get('location_type')
         return {
             'trip': trip,
@@ -377,7 +538,8 @@ class AddTripMemberView(LoginRequiredMixin, FlattenTripMemberMixin,
             User, email=self.request.POST.get('email')).id
         f.organizer = True
         f.accept_reqd = True
-        f.save()
+        if not self.save_invitation(f):
+            return self.already_invited()
         response = super(AddTripMemberView, self).form_valid(form)
         self.email_invitation('registered')
 
@@ -412,7 +574,8 @@ class AddTripGuestView(LoginRequiredMixin, InviteEmailMixin, CreateView):
         f = form.save(commit=False)
         f.trip_id = int(self.request.POST.get('trip_id'))
         f.email = self.request.POST.get('email')
-        f.save()
+        if not self.save_invitation(f):
+            return self.already_invited()
         response = super(AddTripGuestView, self).form_valid(form)
         self.email_invitation('nonregistered')
         data = {
@@ -426,22 +589,143 @@ class AddTripGuestView(LoginRequiredMixin, InviteEmailMixin, CreateView):
 
         return JsonResponse(data)
 
+class BulkInviteView(LoginRequiredMixin, FlattenTripMemberMixin,
+    InviteEmailMixin, FormView):
+    """
+    Invites a list of emails to a trip in one request. Registered users
+    become members and everyone else guests, as with AddTripMemberView and
+    AddTripGuestView. The invitations are sent over one mail connection.
+
+    The response gives the status of each email: "member" or "guest" when
+    it was invited, "already_invited" or "invalid".
+    """
+    form_class = BulkInviteForm
+    http_method_names = ['post']
+
+    def get_form_kwargs(self):
+        kwargs = super(BulkInviteView, self).get_form_kwargs()
+        # The emails can be posted as a list and/or as one separated string
+        kwargs['data'] = self.request.POST.copy()
+        kwargs['data']['emails'] = '\n'.join(
+            self.request.POST.getlist('emails'))
+        return kwargs
+
+    def form_invalid(self, form):
+        return JsonResponse(form.errors, status=400)
+
+    def form_valid(self, form):
+        trip = get_object_or_404(Trip, id=form.cleaned_data['trip_id'])
+        statuses = {}
+        emails = []
+        for email in form.cleaned_data['emails']:
+            try:
+                validate_email(email)
+            except ValidationError:
+                statuses[email] = 'invalid'
+            else:
+                emails.append(email)
+
+        users = {
+            user.email.upper(): user
+            for user in User.objects.filter(email_iexact_q('email', emails))
+        }
+        invited = set(
+            email.upper() for email in TripMember.objects.filter(
+                trip=trip, member__in=users.values()
+            ).values_list('member__email', flat=True)
+        )
+        invited.update(
+            email.upper() for email in TripGuest.objects.filter(
+                email_iexact_q('email', emails), trip=trip
+            ).values_list('email', flat=True)
+        )
+
+        invitations = []
+        for email in emails:
+            if email.upper() in invited:
+                statuses[email] = 'already_invited'
+            elif email.upper() in users:
+                invitations.append((email, TripMember(trip=trip,
+                    member=users[email.upper()], organizer=True,
+                    accept_reqd=True)))
+            else:
+                invitations.append((email, TripGuest(trip=trip, email=email)))
+        saved = self.save_invitations(
+            [instance for email, instance in invitations])
+
+        members = []
+        guests = []
+        outgoing = []
+        for (email, instance), is_saved in zip(invitations, saved):
+            if not is_saved:
+                statuses[email] = 'already_invited'
+            elif isinstance(instance, TripMember):
+                statuses[email] = 'member'
+                members.append(instance)
+                outgoing.append(
+                    self.make_invitation(trip, email, 'registered'))
+            else:
+                statuses[email] = 'guest'
+                guests.append(instance)
+                outgoing.append(
+                    self.make_invitation(trip, email, 'nonregistered'))
+        get_connection(fail_silently=False).send_messages(outgoing)
+
+        data = {
+            'results': [
+                {'email': email, 'status': statuses[email]}
+                for email in form.cleaned_data['emails']
+            ],
+            'new_members': self.flatten_tripmember_queryset(members) +
+                [guest.email for guest in guests],
+            'msg': ("Invitations have been sent to %d people." %
+                len(outgoing)),
+        }
+        return JsonResponse(data)
+
+    def save_invitations(self, instances):
+        """
+        Saves TripMembers and TripGuests with one query per model. Returns
+        whether each one was saved, see save_invitation().
+        """
+        try:
+            with transaction.atomic():
+                TripMember.objects.bulk_create([instance
+                    for instance in instances
+                    if isinstance(instance, TripMember)])
+                TripGuest.objects.bulk_create([instance
+                    for instance in instances
+                    if isinstance(instance, TripGuest)])
+        except IntegrityError:
+            # Someone else invited one of them meanwhile. On PostgreSQL
+            # bulk_create() has set the ids of the rolled back rows, so
+            # they are cleared to insert the rows again one by one.
+            for instance in instances:
+                instance.pk = None
+            return [self.save_invitation(instance) for instance in instances]
+        # bulk_create() sends no post_save signals
+        fragments.invalidate([instance.trip_id for instance in instances])
+        notifications.update([instance.member_id for instance in instances
+            if isinstance(instance, TripMember)])
+        return [True] * len(instances)
+
 class NotificationListView(LoginRequiredMixin, ListView):
     model = TripMember
     template_name = 'trips/notifications.html'
     context_object_name = 'trip_notifications'
 
     def get_queryset(self):
-        # gets all trip notifications for logged in user
+        # gets all trip notifications for logged in user, with their trips
         queryset = super(NotificationListView, self).get_queryset()
-        return queryset.filter(member=self.request.user, accept_reqd=True)
+        return queryset.filter(member=self.request.user,
+            accept_reqd=True).select_related('trip')
 
     def get_context_data(self, **kwargs):
         # context already has 'trip_notifications' through standard ListView
-        # add 'item_notifications' to context
+        # add 'item_notifications' to context, with their items and trips
         context = super(NotificationListView, self).get_context_data(**kwargs)
         context['item_notifications'] = ItemNotification.objects.filter(
-            owner=self.request.user)
+            owner=self.request.user).select_related('item__trip')
         context['user_id'] = self.request.user
         return context
 
@@ -507,11 +791,14 @@ class EmergencyInfoListView(LoginRequiredMixin, ListView):
         return queryset.filter(
             trip_id = self.kwargs['trip_id'],
             accept_reqd = False
-        )
+        ).with_emergency_contacts()
 
     def get_context_data(self, **kwargs):
         context = super(EmergencyInfoListView, self).get_context_data(**kwargs)
         context['trip'] = Trip.objects.get(pk=self.kwargs['trip_id'])
+        # Only loaded if the fragment is not cached
+        context['emergency_info'] = SimpleLazyObject(
+            self.object_list.get_emergency_info)
         return context
 
 class GearListView(LoginRequiredMixin, TemplateView):
@@ -522,18 +809,9 @@ class GearListView(LoginRequiredMixin, TemplateView):
 
         trip = Trip.objects.get(pk=self.kwargs['trip_id'])
         context['trip'] = trip
-
-        trip_items = Item.objects.filter(
-                trip_id = self.kwargs['trip_id']
-            ).prefetch_related(
-                'item_owners'
-            )
-        context['trip_items'] = trip_items.order_by(Lower('description'))
-
-        trip_members = TripMember.objects.filter(
-                trip=trip
-            ).select_related('member')
-        context['trip_members'] = trip_members
+        # Only loaded if the fragment is not cached
+        context.update(fragments.lazy_context(trip.get_gear_context,
+            Trip.GEAR_CONTEXT_KEYS))
         return context
 
 class AddItemView(LoginRequiredMixin, CreateView):